@@ -2,6 +2,9 @@
 
 Currently used for publishing in Deadline machines.
 
+Set environment variable `REVERIES_PROFILE` to profile each plugin, the
+trace will be saved into version dirs, see `reveries.profiler`.
+
 (NOTE) This script is located by avalon-config module relative path, so if
 module was loaded from local environment, the script path sent to Deadline
 will be local path which highly possible not be able to access by Deadline
@@ -16,8 +19,9 @@ import pyblish.util
 import avalon.api
 import avalon.io
 
-from reveries.utils import publish_results_formatting
-from reveries.plugins import parse_contract_environment
+from reveries import profiler
+from reveries.utils import publish_results_formatting, discover_plugins
+from reveries.plugins import parse_contract_environment, teardown_publish
 
 
 log = logging.getLogger("Contractor")
@@ -41,20 +45,28 @@ def publish():
     except Exception as e:
         error_raiser(str(e))
 
+    # Discover once for all stages
+    plugins = discover_plugins().plugins()
+
     log.info("Collecting instances ...")
-    pyblish.util.collect(context)
+    pyblish.util.collect(context, plugins=plugins)
 
     """
     log.info("Validating ...")
-    pyblish.util.validate(context)
+    pyblish.util.validate(context, plugins=plugins)
     check_success(context)
     """
 
-    log.info("Extracting ...")
-    pyblish.util.extract(context)
+    try:
+        log.info("Extracting ...")
+        pyblish.util.extract(context, plugins=plugins)
+
+        log.info("Integrating ...")
+        pyblish.util.integrate(context, plugins=plugins)
+    finally:
+        # In case integration never reached `PublishTeardown`
+        teardown_publish(context)
 
-    log.info("Integrating ...")
-    pyblish.util.integrate(context)
     check_success(context)
 
     log.info("Completed.")
@@ -89,6 +101,10 @@ if __name__ == "__main__":
     else:
         error_raiser = log.error
 
+    if os.environ.get("REVERIES_PROFILE"):
+        log.info("Profiling publish ..")
+        profiler.install()
+
     if not avalon.io._is_installed:
         log.info("Fixing database connections..")
         os.environ["PATH"] += ";" + os.getenv("AVALON_TOOLS", "")
@@ -0,0 +1,33 @@
+
+import os
+import pyblish.api
+
+from reveries.database import DatabaseStats, instrument, instrumented_stats
+
+
+class CollectDatabaseStats(pyblish.api.ContextPlugin):
+    """Start recording database calls of each plugin and instance
+
+    Only when environment variable `REVERIES_DATABASE_STATS` is set.
+    Recorded calls are reported by `PublishReports`, and recording is
+    stopped by `PublishTeardown` whether publish succeeded or not.
+
+    keys in context.data:
+        * databaseStats
+
+    """
+
+    label = "Record Database Calls"
+    order = pyblish.api.CollectorOrder - 0.5
+
+    def process(self, context):
+        if not os.environ.get("REVERIES_DATABASE_STATS"):
+            return
+
+        # May have been started by publish profiler
+        stats = instrumented_stats() or DatabaseStats()
+        if not instrument(stats):
+            self.log.warning("Database not installed, calls not recorded.")
+            return
+
+        context.data["databaseStats"] = stats
@@ -0,0 +1,21 @@
+
+import pyblish.api
+import avalon.api
+
+
+class CollectLoadedContainers(pyblish.api.ContextPlugin):
+    """Collect containers loaded in host
+
+    So validators checking containers do not need to call host.
+
+    keys in context.data:
+        * loadedContainers
+
+    """
+
+    label = "Loaded Containers"
+    order = pyblish.api.CollectorOrder + 0.4
+
+    def process(self, context):
+        host = avalon.api.registered_host()
+        context.data["loadedContainers"] = list(host.ls())
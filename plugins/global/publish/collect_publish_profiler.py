@@ -0,0 +1,27 @@
+
+import os
+import pyblish.api
+
+from reveries import profiler
+
+
+class CollectPublishProfiler(pyblish.api.ContextPlugin):
+    """Start profiling each plugin and instance
+
+    Only when environment variable `REVERIES_PROFILE` is set. Profile is
+    reported by `PublishReports`.
+
+    keys in context.data:
+        * publishProfiler
+
+    """
+
+    label = "Profile Publish"
+    order = pyblish.api.CollectorOrder - 0.5
+
+    def process(self, context):
+        if not os.environ.get("REVERIES_PROFILE"):
+            return
+
+        # May have been installed by publish script
+        context.data["publishProfiler"] = profiler.install()
@@ -0,0 +1,26 @@
+
+import pyblish.api
+
+from reveries.plugins import join_background_jobs
+
+
+class ExtractBackgroundJobs(pyblish.api.ContextPlugin):
+    """Wait for background jobs of extractors before integration
+
+    See `reveries.plugins.PackageExtractor.add_job`.
+
+    """
+
+    label = "Join Background Jobs"
+    order = pyblish.api.ExtractorOrder + 0.49
+
+    def process(self, context):
+        failed = join_background_jobs(context)
+
+        for instance, representation, error in failed:
+            self.log.error("{0} ({1}): {2}".format(instance,
+                                                   representation,
+                                                   error))
+        if failed:
+            raise RuntimeError("{} background jobs failed."
+                               "".format(len(failed)))
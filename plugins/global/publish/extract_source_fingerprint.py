@@ -2,17 +2,59 @@
 import os
 import pyblish.api
 
-from reveries.utils import AssetHasher
+from reveries.utils import AssetHasher, BackgroundHasher, quick_hash_file
 
 
 class ExtractSourceFingerprint(pyblish.api.ContextPlugin):
+    """Compute workfile fingerprint
+
+    keys in context.data:
+        * sourceFingerprint
+        * sourceFingerprintJob (only if workfile is large)
+
+    The fingerprint has two tiers:
+
+        - `"currentHash"`: Full content hash of the workfile.
+
+        - `"quickHash"`: Only for workfile larger than `QUICK_MIN_SIZE`,
+          which hashes file size, modified time and sampled blocks, and the
+          full hash will be computed in background. `"currentHash"` will be
+          `None` until the background job `"sourceFingerprintJob"` is done.
+
+    """
 
     label = "Extract Fingerprint"
     order = pyblish.api.ExtractorOrder - 0.41
 
+    QUICK_MIN_SIZE = 1024 * 1024 * 256
+
     def process(self, context):
 
         current_making = context.data["currentMaking"]
+        fingerprint = {
+            "currentMaking": current_making,
+            "currentHash": None,
+        }
+        context.data["sourceFingerprint"] = fingerprint
+
+        if (os.path.isfile(current_making) and
+                os.path.getsize(current_making) >= self.QUICK_MIN_SIZE):
+
+            self.log.info("Workfile is large, computing full hash in "
+                          "background.")
+
+            def on_hashed(hash_val):
+                fingerprint["currentHash"] = hash_val
+
+            job = BackgroundHasher(current_making)
+            job.add_done_callback(on_hashed)
+            job.start()
+
+            fingerprint["quickHash"] = quick_hash_file(current_making)
+            context.data["sourceFingerprintJob"] = job
+
+            return
+
         hasher = AssetHasher()
 
         if os.path.isfile(current_making):
@@ -21,7 +63,4 @@ class ExtractSourceFingerprint(pyblish.api.ContextPlugin):
         if os.path.isdir(current_making):
             hasher.add_dir(current_making)
 
-        context.data["sourceFingerprint"] = {
-            "currentMaking": current_making,
-            "currentHash": hasher.digest(),
-        }
+        fingerprint["currentHash"] = hasher.digest()
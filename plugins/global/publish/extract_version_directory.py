@@ -6,6 +6,13 @@ import pyblish.api
 import avalon.api
 import avalon.io
 
+from reveries.transfer import TransferJournal
+from reveries.database import (
+    get_cache,
+    get_reserved_version,
+    reserve_version,
+)
+
 
 class ExtractVersionDirectory(pyblish.api.InstancePlugin):
     """Create publish version directory
@@ -28,6 +35,21 @@ class ExtractVersionDirectory(pyblish.api.InstancePlugin):
           publish session been completed, no matter what happened during
           long extraction time.
 
+        - New version number is reserved from the subset's counter document
+          in one atomic update, so concurrent publishes of the same subset
+          never get the same version. Versions that reserved by previous
+          publish of the same workfile but not integrated are reused.
+
+        - If the version is locked (e.g. retried by contractor), packages and
+          partial transfers recorded in transfer journal are kept, so the
+          integration can be resumed.
+
+    * If the fingerprint has `"quickHash"`, the full hash is computing in
+      background and will be written into version dir's fingerprint file
+      once it's done. While locating the version with version locked, the
+      fingerprints are compared by full hash if both have it, or by quick
+      hash.
+
     """
 
     label = "Extract Version Directory"
@@ -53,7 +75,7 @@ class ExtractVersionDirectory(pyblish.api.InstancePlugin):
 
         version_dir_template = os.path.dirname(publish_dir_template)
 
-        subset_doc = avalon.io.find_one({
+        subset_doc = get_cache(context).find_one({
             "type": "subset",
             "parent": context.data["assetDoc"]["_id"],
             "name": instance.data["subset"],
@@ -73,40 +95,88 @@ class ExtractVersionDirectory(pyblish.api.InstancePlugin):
             # Clean the path
             return os.path.abspath(os.path.normpath(version_dir))
 
+        fingerprint_job = context.data.get("sourceFingerprintJob")
+
         def write_metadata(version_dir):
             metadata_path = os.path.join(version_dir, self.META_FILE)
-            metadata = context.data["sourceFingerprint"]
+            metadata = dict(context.data["sourceFingerprint"])
             metadata["success"] = False
 
             # Save workfile fingerprint to version dir
             with open(metadata_path, "w") as fp:
                 json.dump(metadata, fp, indent=4)
 
-        def is_version_matched(version_dir, strict):
-            """Does the fingerprint in this version match with workfile ?"""
+            if fingerprint_job is not None:
+                # Write full hash once it's been computed in background
+                def write_hash(hash_val):
+                    with open(metadata_path, "r") as fp:
+                        metadata = json.load(fp)
+                    metadata["currentHash"] = hash_val
+                    with open(metadata_path, "w") as fp:
+                        json.dump(metadata, fp, indent=4)
+
+                fingerprint_job.add_done_callback(write_hash)
+
+        def is_version_matched(version_dir, strict, reserved=False):
+            """Does the fingerprint in this version match with workfile ?
+
+            If `reserved` is True, version that failed to publish from any
+            workfile is also matched, since the version number has been
+            reserved by this publish.
+
+            """
             metadata_path = os.path.join(version_dir, self.META_FILE)
             # Load fingerprint from version dir
-            with open(metadata_path, "r") as fp:
-                metadata = json.load(fp)
-                try:
-                    success = metadata.pop("success")
-                except KeyError:
-                    # For backwards compatibility, assuming it succeed
-                    success = True
+            try:
+                with open(metadata_path, "r") as fp:
+                    metadata = json.load(fp)
+            except (IOError, ValueError):
+                # Not yet written, or not from a publish
+                return False
 
             fingerprint = context.data["sourceFingerprint"]
+            again = metadata["currentMaking"] == fingerprint["currentMaking"]
 
             if strict:
-                return metadata == fingerprint
+                return again and is_fingerprint_matched(metadata, fingerprint)
 
-            again = metadata["currentMaking"] == fingerprint["currentMaking"]
-            return again or not success
+            # For backwards compatibility, assuming it succeed
+            failed = not metadata.get("success", True)
+            return again or (reserved and failed)
+
+        def is_fingerprint_matched(metadata, fingerprint):
+            """Compare fingerprint by full hash, or quick hash"""
+            for tier in ("currentHash", "quickHash"):
+                if metadata.get(tier) and fingerprint.get(tier):
+                    return metadata[tier] == fingerprint[tier]
+
+            # No comparable tier, full hash must be there after job done
+            if fingerprint_job is not None:
+                fingerprint_job.wait()
+
+            return metadata.get("currentHash") == fingerprint["currentHash"]
 
-        def clean_version_dir(version_dir):
-            """Remove all content from the version dir, except fingerprint"""
+        def clean_version_dir(version_dir, resume=False):
+            """Remove all content from the version dir, except fingerprint
+
+            If `resume` is True, transfer journal and transferred items will
+            be kept.
+
+            """
             self.log.debug("Cleaning version dir.")
 
+            keep = set()
+            if resume:
+                journal = TransferJournal(version_dir)
+                keep.add(journal.FILE_NAME)
+                keep.update(journal.packages())
+
             for item in os.listdir(version_dir):
+                partial = item.endswith(TransferJournal.PARTIAL_SUFFIX)
+                if item in keep or (resume and partial):
+                    self.log.debug("Keeping {!r} for resume.".format(item))
+                    continue
+
                 item_path = os.path.join(version_dir, item)
                 try:
                     if os.path.isdir(item_path):
@@ -116,70 +186,87 @@ class ExtractVersionDirectory(pyblish.api.InstancePlugin):
                 except Exception as e:
                     self.log.debug(e)
 
-        def get_next_version():
-            """Get current subset instance's next version number"""
-            if context.data.get("contractorAccepted"):
-                # version lock if publish process has been delegated.
-                return instance.data["versionNext"]
-
-            version = None
-            version_number = 1  # assume there is no version yet, start at 1
-            if subset_doc is not None:
-                version = avalon.io.find_one({"type": "version",
-                                              "parent": subset_doc["_id"]},
-                                             {"name": True},
-                                             sort=[("name", -1)])
+        def get_latest_version():
+            """Get current subset instance's latest version number"""
+            if subset_doc is None:
+                return 0
+
+            version = avalon.io.find_one({"type": "version",
+                                          "parent": subset_doc["_id"]},
+                                         {"name": True},
+                                         sort=[("name", -1)])
             # if there is a subset there ought to be version
-            if version is not None:
-                version_number += version["name"]
+            return version["name"] if version is not None else 0
 
-            return version_number
+        def use_version_dir(version_dir):
+            clean_version_dir(version_dir, resume=VERSION_LOCKED)
+            write_metadata(version_dir)
 
-        # Check
-        version = get_next_version()
-        tried = 0
+        if VERSION_LOCKED:
+            # version lock if publish process has been delegated.
+            version_number = instance.data["versionNext"]
+            version_dir = format_version_dir(version_number)
+
+            if not os.path.isdir(version_dir):
+                self.log.debug("Creating version dir.")
+                os.makedirs(version_dir)
+                write_metadata(version_dir)
 
-        while True:
-            if tried > self.MAX_RETRY:
-                msg = "Critical Error: Version Dir retry times exceeded."
+            elif is_version_matched(version_dir, strict=True):
+                use_version_dir(version_dir)
+
+            else:
+                # This should not happend.
+                # If the version is locked, the workfile should never
+                # changed.
+                msg = ("Critical Error: Version locked but version dir is "
+                       "not available ('sourceFingerprint' not match), "
+                       "this is a bug.")
                 self.log.critical(msg)
                 raise Exception(msg)
 
-            # Bump version
-            version_number = version + tried
-            version_dir = format_version_dir(version_number)
-
-            if os.path.isdir(version_dir):
-                if is_version_matched(version_dir, VERSION_LOCKED):
-                    # This version dir match the current workfile, remove
-                    # previous extracted stuff.
-                    clean_version_dir(version_dir)
-                    write_metadata(version_dir)
+        else:
+            asset_id = context.data["assetDoc"]["_id"]
+            subset_name = instance.data["subset"]
+            latest = get_latest_version()
+            reserved = get_reserved_version(asset_id, subset_name)
+
+            # Reuse the version that reserved by previous publish of this
+            # workfile, but not been integrated.
+            for version_number in range(latest + 1, reserved + 1):
+                version_dir = format_version_dir(version_number)
+                if (os.path.isdir(version_dir) and
+                        is_version_matched(version_dir, strict=False)):
+                    use_version_dir(version_dir)
                     break
 
-                elif VERSION_LOCKED:
-                    # This should not happend.
-                    # If the version is locked, the workfile should never
-                    # changed.
-                    msg = ("Critical Error: Version locked but version dir is "
-                           "not available ('sourceFingerprint' not match), "
-                           "this is a bug.")
-                    self.log.critical(msg)
-                    raise Exception(msg)
-
-                else:
-                    # Version dir has been created, but the `sourceFingerprint`
-                    # not matched because the workfile has changed.
-                    # Try next version.
-                    pass
-
             else:
-                self.log.debug("Creating version dir.")
-                os.makedirs(version_dir)
-                write_metadata(version_dir)
-                break
+                for _ in range(self.MAX_RETRY):
+                    version_number = reserve_version(asset_id,
+                                                     subset_name,
+                                                     latest)
+                    version_dir = format_version_dir(version_number)
+
+                    try:
+                        os.makedirs(version_dir)
+                    except OSError:
+                        if not os.path.isdir(version_dir):
+                            raise
+                        # Left by publish before version reservation
+                        if is_version_matched(version_dir,
+                                              strict=False,
+                                              reserved=True):
+                            use_version_dir(version_dir)
+                            break
+                    else:
+                        self.log.debug("Creating version dir.")
+                        write_metadata(version_dir)
+                        break
 
-            tried += 1
+                else:
+                    msg = "Critical Error: Version Dir retry times exceeded."
+                    self.log.critical(msg)
+                    raise Exception(msg)
 
         instance.data["versionNext"] = version_number
         instance.data["versionDir"] = version_dir
@@ -0,0 +1,32 @@
+
+import pyblish.api
+
+from reveries.transfer import TransferJournal
+
+
+class IntegrateAvalonBulkWrite(pyblish.api.ContextPlugin):
+    """Write database operations of all instances at once
+
+    Only when environment variable `REVERIES_BULK_WRITE_CONTEXT` is set,
+    see `IntegrateAvalonSubset`.
+
+    """
+
+    label = "Integrate Bulk Write"
+    order = pyblish.api.IntegratorOrder + 0.05
+
+    def process(self, context):
+        writer = context.data.get("avalonBulkWriter")
+        if writer is None:
+            return
+
+        assert all(result["success"] for result in context.data["results"]), (
+            "Atomicity not held, aborting.")
+
+        self.log.info("Writing {} operations to database ..."
+                      "".format(len(writer)))
+        writer.flush()
+
+        for instance in context:
+            if "insertedVersionId" in instance.data:
+                TransferJournal(instance.data["versionDir"]).remove()
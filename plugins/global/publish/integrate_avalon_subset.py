@@ -1,12 +1,28 @@
 
 import os
+import uuid
 import logging
-import shutil
 
 import errno
 import pyblish.api
 from avalon import api, io
 from avalon.vendor import filelink
+from reveries.contentstore import ContentStore
+from reveries.database import BulkWriter, get_cache
+from reveries.utils import normalize_source, get_hash_cache
+from reveries.transfer import (
+    TransferEngine,
+    is_same_device,
+    reflink_file,
+    copy_file_hashed,
+    COPY_BUFFER,
+    file_checksum,
+    replace_file,
+    TransferJournal,
+    RENAME,
+    REFLINK,
+    COPY,
+)
 
 
 log = logging.getLogger(__name__)
@@ -21,6 +37,11 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
     This plug-in resolves any paths which, if not updated might break
     the published file.
 
+    Subset, version, representations and dependents are written to database
+    in one ordered bulk write per instance. If environment variable
+    `REVERIES_BULK_WRITE_CONTEXT` is set, the writes of all instances are
+    queued and written at once by `IntegrateAvalonBulkWrite`.
+
     The order of families is important, when working with lookdev you want to
     first publish the texture, update the texture paths in the nodes and then
     publish the shading network. Same goes for file dependent assets.
@@ -30,11 +51,19 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
     label = "Integrate Subset"
     order = pyblish.api.IntegratorOrder
 
+    # Transfer jobs that run in parallel, stage by stage. Packages first,
+    # because other files may be transferred into representation dirs.
+    TRANSFER_STAGES = [
+        ["packages"],
+        ["files", "hardlinks", "blobs"],
+    ]
+
     def process(self, instance):
 
         self.transfers = dict(packages=list(),
                               files=list(),
-                              hardlinks=list())
+                              hardlinks=list(),
+                              blobs=list())
 
         # Check Delegation
         #
@@ -44,21 +73,30 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
         if instance.data.get("useContractor") and not delegated:
             return
 
+        self.writer = self.get_writer(instance.context)
+
         # Assemble data and create version, representations
         subset, version, representations = self.register(instance)
 
         # Integrate representations' files to shareable space
         self.log.info("Integrating representations to shareable space ...")
+        self.journal = TransferJournal(instance.data["versionDir"])
         self.integrate()
+        instance.data["packageTransfers"] = self.package_transfers
+        self.add_checksums(representations)
 
-        existed = io.find_one({"parent": subset["_id"],
-                               "name": version["name"]})
+        existed = None
+        if not self.subset_created:
+            existed = io.find_one({"parent": subset["_id"],
+                                   "name": version["name"]})
         if existed is not None:
             self.log.info("Version existed, representation file has been "
                           "overwritten.")
             filter_ = {"_id": existed["_id"]}
             update = {"$set": {"data.time": instance.context.data["time"]}}
             io.update_many(filter_, update)
+            get_cache(instance.context).invalidate(existed["_id"])
+            self.journal.remove()
             return
 
         # Write version and representations to database
@@ -68,6 +106,23 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
         # Update dependent
         self.update_dependent(instance, version_id)
 
+        if self.writer is not instance.context.data.get("avalonBulkWriter"):
+            self.writer.flush()
+            self.journal.remove()
+
+    def get_writer(self, context):
+        """Return bulk writer of this instance, or the one shared in context
+        """
+        cache = get_cache(context)
+
+        if not os.environ.get("REVERIES_BULK_WRITE_CONTEXT"):
+            return BulkWriter(cache)
+
+        if "avalonBulkWriter" not in context.data:
+            context.data["avalonBulkWriter"] = BulkWriter(cache)
+
+        return context.data["avalonBulkWriter"]
+
     def register(self, instance):
 
         context = instance.context
@@ -148,17 +203,22 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
             src = os.path.join(stagingdir, package)
             dst = publish_path
 
-            self.transfers["packages"].append([src, dst])
+            self.transfers["packages"].append([src, dst, package])
 
         self.transfers["files"] += instance.data["files"]
         self.transfers["hardlinks"] += instance.data["hardlinks"]
+        self.transfers["blobs"] += instance.data.get("blobs", [])
 
         return subset, version, representations
 
     def integrate(self):
         """Move the files
 
-        Through `self.transfers`
+        Through `self.transfers`, files are transferred in parallel by
+        `TransferEngine`, stage by stage in `TRANSFER_STAGES` order.
+
+        Finished transfers are recorded in `self.journal`, and will be
+        skipped if the integration is retried.
 
         """
 
@@ -173,68 +233,323 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
         #     \|________|
         #
 
-        for job in self.transfers:
-            transfers = self.transfers[job]
+        self.engine = TransferEngine(log=self.log)
+        self.package_transfers = dict()
+        self.package_dirs = dict()
+        self.partial_packages = list()
+        self.checksums = dict()
+
+        for stage in self.TRANSFER_STAGES:
+            for job in stage:
+                self._queue_transfers(job)
+
+            self.engine.run()
+            self.journal.flush()
+            self.commit_packages()
+
+    def _queue_transfers(self, job):
+        """Queue transfers of the job into transfer engine"""
+        transfers = self.transfers[job]
+
+        for transfer in transfers:
+            src, dst = transfer[:2]
+            # normpath
+            self.log.debug("Src. Before: {!r}".format(src))
+            self.log.debug("Dst. Before: {!r}".format(dst))
+
+            src = os.path.abspath(
+                os.path.normpath(os.path.expandvars(src)))
+            dst = os.path.abspath(
+                os.path.normpath(os.path.expandvars(dst)))
+
+            self.log.debug("Src. After: {!r}".format(src))
+            self.log.debug("Dst. After: {!r}".format(dst))
+
+            self.log.info("Copying {0}: {1} -> {2}".format(job, src, dst))
+            if src == dst:
+                self.log.debug("Source and destination are the same, "
+                               "will not copy.")
+                if job == "packages":
+                    self.package_dirs[transfer[2]] = dst
+                    self.package_transfers[transfer[2]] = "direct"
+                    self.checksum_dir(dst, dst)
+                continue
+
+            if job == "packages":
+                package = transfer[2]
+                self.package_dirs[package] = dst
+
+                if self.journal.has_package(package) and os.path.isdir(dst):
+                    self.log.info("Package {!r} has been transferred, "
+                                  "skipped.".format(package))
+                    self.package_transfers[package] = "resumed"
+                    self.resume_dir(dst)
+                    continue
 
-            for src, dst in transfers:
-                # normpath
-                self.log.debug("Src. Before: {!r}".format(src))
-                self.log.debug("Dst. Before: {!r}".format(dst))
+                method = self.copy_dir(src, dst, package)
+                self.package_transfers[package] = method
+                self.log.info("Package {0!r} transferred by {1}."
+                              "".format(package, method))
+                continue
+
+            if self.resume_file(dst):
+                self.log.debug("Transferred, skipped.")
+                continue
+
+            if job == "files":
+                self.engine.add(self.copy_file,
+                                (src, dst),
+                                os.path.getsize(src),
+                                self.checksum_callback(dst))
+            if job == "hardlinks":
+                self.engine.add(self.hardlink_file, (src, dst))
+                self.engine.add(file_checksum,
+                                (src,),
+                                callback=self.checksum_callback(dst))
+            if job == "blobs":
+                self.engine.add(self.store_blob,
+                                (src, dst, transfer[2]),
+                                os.path.getsize(src),
+                                self.checksum_callback(dst))
+
+    def checksum_callback(self, dst):
+        """Return transfer callback that records checksum of `dst`"""
+        def record(checksum):
+            self.checksums[dst] = checksum
+            self.journal.record_file(dst, *checksum)
+        return record
+
+    def checksum_dir(self, src, dst):
+        """Queue checksum tasks of files in `src`, recorded as in `dst`"""
+        for root, _, files in os.walk(src):
+            dst_root = os.path.normpath(
+                os.path.join(dst, os.path.relpath(root, src)))
+            for name in files:
+                self.engine.add(file_checksum,
+                                (os.path.join(root, name),),
+                                callback=self.checksum_callback(
+                                    os.path.join(dst_root, name)))
+
+    def checksum_renamed(self, src, dst):
+        """Record checksums of files in `dst` that renamed from `src`
+
+        Files hashed while extracting are found in hash cache by staged
+        path, since renaming keeps the file stat. Only the others will be
+        queued for hashing.
 
-                src = os.path.abspath(
-                    os.path.normpath(os.path.expandvars(src)))
-                dst = os.path.abspath(
-                    os.path.normpath(os.path.expandvars(dst)))
+        """
+        cache = get_hash_cache()
+        for root, _, files in os.walk(dst):
+            src_root = os.path.normpath(
+                os.path.join(src, os.path.relpath(root, dst)))
+            for name in files:
+                dst_file = os.path.join(root, name)
+                stat = os.stat(dst_file)
+                c4id = None
+                if cache is not None:
+                    c4id = cache.get(os.path.join(src_root, name), stat)
+
+                if c4id is None:
+                    self.engine.add(file_checksum,
+                                    (dst_file,),
+                                    callback=self.checksum_callback(
+                                        dst_file))
+                    continue
 
-                self.log.debug("Src. After: {!r}".format(src))
-                self.log.debug("Dst. After: {!r}".format(dst))
+                cache.set(dst_file, c4id, stat)
+                self.checksum_callback(dst_file)((c4id, stat.st_size))
 
-                self.log.info("Copying {0}: {1} -> {2}".format(job, src, dst))
-                if src == dst:
-                    self.log.debug("Source and destination are the same, "
-                                   "will not copy.")
+    def resume_file(self, dst, check_path=None):
+        """Load checksum from journal if the file has been transferred
+
+        Returns:
+            bool: True if the file has been transferred
+
+        """
+        checksum = self.journal.get_file(dst, check_path)
+        if checksum is None:
+            return False
+
+        self.checksums[dst] = checksum
+        return True
+
+    def resume_dir(self, dst):
+        """Load checksums of transferred dir, hash files that not in journal
+        """
+        for root, _, files in os.walk(dst):
+            for name in files:
+                file_path = os.path.join(root, name)
+                if not self.resume_file(file_path):
+                    self.engine.add(file_checksum,
+                                    (file_path,),
+                                    callback=self.checksum_callback(
+                                        file_path))
+
+    def add_checksums(self, representations):
+        """Save integrated files' C4 ID and size into representation data
+
+        Only files inside the representation dir are recorded, in
+        `representation["data"]["checksums"]` as a list of dict with keys
+        "file" (relative path), "c4id" and "size".
+
+        """
+        for representation in representations:
+            root = self.package_dirs.get(representation["name"])
+            if root is None:
+                continue
+
+            checksums = list()
+            for path, (c4id, size) in sorted(self.checksums.items()):
+                if not path.startswith(root + os.sep):
                     continue
+                checksums.append({
+                    "file": os.path.relpath(path, root).replace("\\", "/"),
+                    "c4id": c4id,
+                    "size": size,
+                })
 
-                if job == "packages":
-                    self.copy_dir(src, dst)
-                if job == "files":
-                    self.copy_file(src, dst)
-                if job == "hardlinks":
-                    self.hardlink_file(src, dst)
+            representation["data"]["checksums"] = checksums
 
-    def copy_dir(self, src, dst):
+    def copy_dir(self, src, dst, package):
         """ Copy given source to destination
 
+        If source and destination are on the same device, the staged dir
+        will be renamed into destination, or reflinked file by file if
+        rename failed and the filesystem supports it. Otherwise each file
+        is queued into transfer engine for copy.
+
+        Files are reflinked or copied into a hidden partial dir next to the
+        destination, which will be renamed to destination by
+        `commit_packages` once all files are transferred. Files that have
+        been transferred into the partial dir by previous try are skipped.
+
         Arguments:
             src (str): the source dir which needs to be copied
             dst (str): the destination of the sourc dir
+            package (str): the representation name
         Returns:
-            None
+            str: Transfer method, "rename", "reflink" or "copy"
         """
+        if os.path.exists(dst):
+            msg = ("Representation dir existed, this should "
+                   "not happen. Copy aborted.")
+            self.log.critical(msg)
+            raise OSError(msg)
+
+        parent = os.path.dirname(dst)
         try:
-            shutil.copytree(src, dst)
+            os.makedirs(parent)
         except OSError as e:
-            if e.errno == errno.EEXIST:
-                msg = ("Representation dir existed, this should "
-                       "not happen. Copy aborted.")
-            else:
+            if e.errno != errno.EEXIST:
                 msg = "An unexpected error occurred."
+                self.log.critical(msg)
+                raise OSError(msg)
+
+        same_device = is_same_device(src, parent)
+        if same_device:
+            # Record before rename, so the package will be resumed if
+            # the process died right after the rename.
+            self.journal.record_package(package, RENAME)
+            try:
+                os.rename(src, dst)
+            except OSError as e:
+                self.log.debug("Rename failed, fallback to copy: "
+                               "{}".format(e))
+                self.journal.discard_package(package)
+            else:
+                self.checksum_renamed(src, dst)
+                return RENAME
+
+        partial = os.path.join(parent, TransferJournal.partial_name(dst))
+        file_list = list()
+        for root, dirs, files in os.walk(src):
+            rel_root = os.path.relpath(root, src)
+            partial_root = os.path.normpath(os.path.join(partial, rel_root))
+            dst_root = os.path.normpath(os.path.join(dst, rel_root))
+
+            if not os.path.isdir(partial_root):
+                os.makedirs(partial_root)
+
+            for name in files:
+                partial_file = os.path.join(partial_root, name)
+                dst_file = os.path.join(dst_root, name)
+                if self.resume_file(dst_file, partial_file):
+                    continue
 
-            self.log.critical(msg)
-            raise OSError(msg)
+                file_list.append((os.path.join(root, name),
+                                  partial_file,
+                                  dst_file))
+
+        method = COPY
+        if same_device and file_list:
+            # Try reflink with first file
+            try:
+                reflink_file(*file_list[0][:2])
+            except OSError as e:
+                self.log.debug("Reflink not supported: {}".format(e))
+            else:
+                method = REFLINK
+
+        for index, (src_file, partial_file, dst_file) in enumerate(file_list):
+            if method == REFLINK:
+                if index:
+                    self.engine.add(reflink_file,
+                                    (src_file, partial_file),
+                                    os.path.getsize(src_file))
+                # Content is the same, hash source while cloning
+                self.engine.add(file_checksum,
+                                (src_file,),
+                                callback=self.checksum_callback(dst_file))
+            else:
+                self.engine.add(copy_file_hashed,
+                                (src_file,
+                                 partial_file,
+                                 COPY_BUFFER,
+                                 dst_file),  # Cache as final path
+                                os.path.getsize(src_file),
+                                self.checksum_callback(dst_file))
+
+        self.partial_packages.append((package, partial, dst, method))
+
+        return method
+
+    def commit_packages(self):
+        """Rename transferred partial package dirs to destination"""
+        for package, partial, dst, method in self.partial_packages:
+            self.journal.record_package(package, method)
+            os.rename(partial, dst)
+
+        self.partial_packages = list()
 
     def copy_file(self, src, dst):
+        """Copy file into a hidden temporary name then rename to `dst`
+
+        Returns:
+            str: C4 ID of the file content
+            int: File size
+
+        """
         file_dir = os.path.dirname(dst)
-        if not os.path.isdir(file_dir):
+        try:
             os.makedirs(file_dir)
+        except OSError as e:
+            # Possibly created by other transfer at the same time
+            if e.errno != errno.EEXIST:
+                self.log.critical("An unexpected error occurred.")
+                raise
 
+        temp = os.path.join(file_dir, ".%s.%s.tmp" % (os.path.basename(dst),
+                                                      uuid.uuid4().hex))
         try:
-            shutil.copyfile(src, dst)
-        except OSError:
+            checksum = copy_file_hashed(src, temp, cache_path=dst)
+            replace_file(temp, dst)
+        except (IOError, OSError):
             msg = "An unexpected error occurred."
             self.log.critical(msg)
             raise OSError(msg)
 
+        return checksum
+
     def hardlink_file(self, src, dst):
 
         dirname = os.path.dirname(dst)
@@ -247,14 +562,46 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
                 self.log.critical("An unexpected error occurred.")
                 raise
 
+        if os.path.isfile(dst):
+            # Left by previous try
+            os.remove(dst)
+
         filelink.create(src, dst, filelink.HARDLINK)
 
+    def store_blob(self, src, dst, c4id):
+        """Store file into project content store and hardlink to destination
+
+        Arguments:
+            src (str): Source file path
+            dst (str): The path that stored blob needs to be hardlinked to
+            c4id (str): C4 ID of the source file
+
+        Returns:
+            str: C4 ID of the file content
+            int: File size
+
+        """
+        store = ContentStore.for_project()
+        if store.has(c4id):
+            self.log.debug("Content existed in store, sharing.")
+
+        blob = store.put(src, c4id)
+        try:
+            self.hardlink_file(blob, dst)
+        except OSError as e:
+            self.log.warning("Hardlink failed, copying instead: {}".format(e))
+            self.copy_file(blob, dst)
+
+        return c4id, os.path.getsize(blob)
+
     def write_database(self, instance, version, representations):
         """Write version and representations to database
 
         Should write version documents until files collecting passed
         without error.
 
+        Documents are queued into `self.writer`.
+
         """
         # Write version
         #
@@ -264,7 +611,7 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
         if "pregeneratedVersionId" in instance.data:
             version["_id"] = instance.data["pregeneratedVersionId"]
 
-        version_id = io.insert_one(version).inserted_id
+        version_id = self.writer.insert_one(version)
 
         # Write representations
         #
@@ -273,7 +620,7 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
         for representation in representations:
             representation["parent"] = version_id
 
-        io.insert_many(representations)
+        self.writer.insert_many(representations)
 
         return version_id
 
@@ -281,23 +628,30 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
 
         asset_id = instance.context.data["assetDoc"]["_id"]
 
-        subset = io.find_one({"type": "subset",
-                              "parent": asset_id,
-                              "name": instance.data["subset"]})
+        filter_ = {
+            "type": "subset",
+            "parent": asset_id,
+            "name": instance.data["subset"],
+        }
+        # Subset may be created by other publish after been cached as not
+        # found, always look it up again here.
+        cache = get_cache(instance.context)
+        cache.invalidate(document=filter_)
+        subset = cache.find_one(filter_)
+        self.subset_created = subset is None
 
         if subset is None:
             subset_name = instance.data["subset"]
             self.log.info("Subset '%s' not found, creating.." % subset_name)
 
-            _id = io.insert_one({
+            subset = {
                 "schema": "avalon-core:subset-2.0",
                 "type": "subset",
                 "name": subset_name,
                 "data": {},
                 "parent": asset_id
-            }).inserted_id
-
-            subset = io.find_one({"_id": _id})
+            }
+            self.writer.insert_one(subset)
 
         return subset
 
@@ -351,6 +705,11 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
         work_dir = work_dir.replace(api.registered_root(), "{root}")
         work_dir = work_dir.replace("\\", "/")
 
+        fingerprint_job = context.data.get("sourceFingerprintJob")
+        if fingerprint_job is not None:
+            # Workfile full hash may still computing in background
+            fingerprint_job.wait()
+
         hash_val = context.data["sourceFingerprint"]["currentHash"]
 
         version_data = {
@@ -359,6 +718,8 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
             "author": context.data["user"],
             "task": api.Session.get("AVALON_TASK"),
             "source": source,
+            "sourcePath": normalize_source(source,
+                                           api.Session["AVALON_PROJECT"]),
             "workDir": work_dir,
             "hash": hash_val,
             "comment": context.data.get("comment"),
@@ -388,4 +749,4 @@ class IntegrateAvalonSubset(pyblish.api.InstancePlugin):
         for version_id_, data in instance.data["dependencies"].items():
             filter_ = {"_id": io.ObjectId(version_id_)}
             update = {"$set": {field: {"count": data["count"]}}}
-            io.update_many(filter_, update)
+            self.writer.update_one(filter_, update)
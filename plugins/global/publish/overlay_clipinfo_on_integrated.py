@@ -1,7 +1,8 @@
 
 import subprocess
 import pyblish.api
-from avalon import io
+
+from reveries.database import get_cache
 
 
 class OverlayClipInfoOnIntegrated(pyblish.api.InstancePlugin):
@@ -27,7 +28,7 @@ class OverlayClipInfoOnIntegrated(pyblish.api.InstancePlugin):
         if instance.data.get("useContractor") and not delegated:
             return
 
-        representation = io.find_one({
+        representation = get_cache(context).find_one({
             "type": "representation",
             "parent": instance.data["insertedVersionId"],
             "name": "imageSequence"
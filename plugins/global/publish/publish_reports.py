@@ -1,4 +1,6 @@
 
+import os
+import json
 import pyblish.api
 import avalon.api
 
@@ -10,6 +12,9 @@ class PublishReports(pyblish.api.ContextPlugin):
     label = "Reports (Please READ)"
     order = pyblish.api.IntegratorOrder + 0.49999
 
+    STATS_FILE = ".database_stats.json"
+    TRACE_FILE = ".publish_trace.json"
+
     def process(self, context):
         assert all(result["success"] for result in context.data["results"]), (
             "Atomicity not held, aborting.")
@@ -25,6 +30,20 @@ class PublishReports(pyblish.api.ContextPlugin):
         self.log.info("Asset: {}".format(asset))
         self.log.info("")
 
+        cache = context.data.get("avalonCache")
+        if cache is not None:
+            self.log.info("Database cache: {0} hits, {1} misses"
+                          "".format(cache.hits, cache.misses))
+            self.log.info("")
+
+        stats = context.data.get("databaseStats")
+        if stats is not None:
+            self.report_stats(stats)
+
+        profiler = context.data.get("publishProfiler")
+        if profiler is not None:
+            self.report_profile(profiler)
+
         for instance in context:
             if not instance.data.get("publish", True):
                 continue
@@ -36,11 +55,68 @@ class PublishReports(pyblish.api.ContextPlugin):
             self.log.info("Version: {}".format(version))
 
             self.log.info("Representations:")
+            package_transfers = instance.data.get("packageTransfers", {})
             for package in instance.data["packages"]:
                 publish_contractor = instance.data.get("publishContractor")
 
                 self.log.info("    {}".format(package))
                 self.log.info("    - Publish contractor: {}"
                               "".format(publish_contractor))
+                self.log.info("    - Transferred by: {}"
+                              "".format(package_transfers.get(package)))
 
             self.log.info("")
+
+            if stats is not None:
+                self.write_stats(stats, instance)
+            if profiler is not None:
+                profiler.dump(os.path.join(instance.data["versionDir"],
+                                           self.TRACE_FILE))
+
+    def report_stats(self, stats):
+        self.log.info("Database calls:")
+        self.log.info("    {0:<36} {1:<24} {2:>6} {3:>10} {4:>8}"
+                      "".format("Plugin", "Instance", "Calls", "ms", "Docs"))
+        for entry in stats.entries():
+            self.log.info("    {0:<36} {1:<24} {2:>6} {3:>10.1f} {4:>8}"
+                          "".format(entry["plugin"],
+                                    entry["instance"],
+                                    entry["calls"],
+                                    entry["seconds"] * 1000,
+                                    entry["documents"]))
+        self.log.info("")
+
+    def write_stats(self, stats, instance):
+        stats_path = os.path.join(instance.data["versionDir"],
+                                  self.STATS_FILE)
+        with open(stats_path, "w") as fp:
+            json.dump(stats.entries(instance.name), fp, indent=4)
+
+    def report_profile(self, profiler):
+        self.log.info("Profile:")
+        for stage, seconds in sorted(profiler.stage_totals().items(),
+                                     key=lambda item: item[1],
+                                     reverse=True):
+            self.log.info("    {0}: {1:.2f} sec".format(stage, seconds))
+
+        self.log.info("    {0:<36} {1:<24} {2:>10} {3:>10} {4:>6} {5:>8} "
+                      "{6:>8}".format("Plugin", "Instance", "Wall ms",
+                                      "CPU ms", "DB", "IO MB", "RSS MB"))
+
+        def megabytes(value):
+            return "-" if value is None else "%.1f" % (value / 1024.0 ** 2)
+
+        for entry in profiler.summary():
+            io_bytes = None
+            if entry["ioRead"] is not None:
+                io_bytes = entry["ioRead"] + entry["ioWrite"]
+
+            self.log.info("    {0:<36} {1:<24} {2:>10.1f} {3:>10.1f} {4:>6} "
+                          "{5:>8} {6:>8}".format(entry["plugin"],
+                                                 entry["instance"],
+                                                 entry["wall"] * 1000,
+                                                 entry["cpu"] * 1000,
+                                                 entry["dbCalls"],
+                                                 megabytes(io_bytes),
+                                                 megabytes(entry["peakRss"])))
+        self.log.info("")
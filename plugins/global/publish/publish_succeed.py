@@ -3,6 +3,8 @@ import os
 import json
 import pyblish.api
 
+from reveries.staging import get_staging_manager
+
 
 class PublishSucceed(pyblish.api.ContextPlugin):
 
@@ -15,6 +17,11 @@ class PublishSucceed(pyblish.api.ContextPlugin):
         assert all(result["success"] for result in context.data["results"]), (
             "Atomicity not held, aborting.")
 
+        fingerprint_job = context.data.get("sourceFingerprintJob")
+        if fingerprint_job is not None:
+            # Wait for full hash been written into fingerprint file
+            fingerprint_job.wait()
+
         for instance in context:
             if not instance.data.get("publish", True):
                 continue
@@ -29,3 +36,8 @@ class PublishSucceed(pyblish.api.ContextPlugin):
 
             with open(metadata_path, "w") as fp:
                     json.dump(metadata, fp, indent=4)
+
+            # Integrated, staging dir no longer needed
+            staging_dir = instance.data.get("stagingDir")
+            if staging_dir:
+                get_staging_manager().release(staging_dir)
@@ -0,0 +1,21 @@
+
+import pyblish.api
+
+from reveries.plugins import teardown_publish
+
+
+class PublishTeardown(pyblish.api.ContextPlugin):
+    """Release what publish session holds, even if publish failed
+
+    Ordered last but still in integration range, so it also runs with
+    `pyblish.util.integrate` in contractor. Publish stopped by validation
+    never reaches here, which is covered by the "published" signal callback
+    registered in `reveries.install`.
+
+    """
+
+    label = "Publish Teardown"
+    order = pyblish.api.IntegratorOrder + 0.4999999
+
+    def process(self, context):
+        teardown_publish(context)
@@ -2,6 +2,9 @@
 import pyblish.api
 import avalon.io
 
+from reveries.database import get_cache
+from reveries.plugins import host_independent
+
 
 class ValidateAvalonDependencies(pyblish.api.InstancePlugin):
     """Ensure subset dependencies is acyclic
@@ -27,41 +30,76 @@ class ValidateAvalonDependencies(pyblish.api.InstancePlugin):
     label = "Avalon Dependencies Acyclic"
     order = pyblish.api.ValidatorOrder
 
+    @host_independent
     def process(self, instance):
         if "dependencies" not in instance.data:
             raise Exception("Dependencies not collected, this is a bug.")
 
         dependencies = instance.data["dependencies"]
         asset_id = instance.context.data["assetDoc"]["_id"]
-        subset = avalon.io.find_one({"type": "subset",
-                                     "parent": asset_id,
-                                     "name": instance.data["subset"]})
+        self.cache = get_cache(instance.context)
+        subset = self.cache.find_one({"type": "subset",
+                                      "parent": asset_id,
+                                      "name": instance.data["subset"]})
 
         if subset is None:
             # Never been published
             return
 
         # Ensure Acyclic
-        acyclic = self.is_acyclic(dependencies, subset["_id"])
-        if not acyclic:
+        path = self.find_cycle(dependencies, subset["_id"])
+        if path:
+            self.log.error("Dependency path: {}".format(
+                " -> ".join(str(_id) for _id in path)))
             raise Exception("Cyclic dependency detected, this is invalid.")
 
-    def is_acyclic(self, dependencies, current_subset_id):
-        for version_id in dependencies:
+    def find_cycle(self, dependencies, current_subset_id):
+        """Return the dependency path to current subset, or empty list
 
-            version_id = avalon.io.ObjectId(version_id)
-            version = avalon.io.find_one({"_id": version_id})
+        Walk the dependency graph level by level, each level of versions
+        are fetched at once, and each version is visited only once.
 
-            if version is None:
-                continue
+        Arguments:
+            dependencies (dict): Dependency version ids of current instance
+            current_subset_id (ObjectId): Current subset id
 
-            if version["parent"] == current_subset_id:
-                # Current subset has been found in dependency chain.
-                # This is not okay. :(
-                return False
+        Returns:
+            list: Version ids from the direct dependency to the version
+                of current subset, empty if acyclic
 
-            dependencies = version["data"]["dependencies"]
-            if not self.is_acyclic(dependencies, current_subset_id):
-                return False
+        """
+        visited = set()
+        previous = dict()  # version id -> dependent version id
+        level = list()
 
-        return True
+        for version_id in dependencies:
+            version_id = avalon.io.ObjectId(version_id)
+            if version_id not in visited:
+                visited.add(version_id)
+                level.append(version_id)
+
+        while level:
+            next_level = list()
+
+            for version in self.cache.find_many(level):
+                if version is None:
+                    continue
+
+                if version["parent"] == current_subset_id:
+                    # Current subset has been found in dependency chain.
+                    # This is not okay. :(
+                    path = [version["_id"]]
+                    while path[-1] in previous:
+                        path.append(previous[path[-1]])
+                    return list(reversed(path))
+
+                for version_id in version["data"]["dependencies"]:
+                    version_id = avalon.io.ObjectId(version_id)
+                    if version_id not in visited:
+                        visited.add(version_id)
+                        previous[version_id] = version["_id"]
+                        next_level.append(version_id)
+
+            level = next_level
+
+        return []
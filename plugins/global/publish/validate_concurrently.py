@@ -0,0 +1,37 @@
+
+import os
+import pyblish.api
+
+from reveries.plugins import host_independent_plugins, run_host_independent
+
+
+class ValidateConcurrently(pyblish.api.ContextPlugin):
+    """Run host-independent validators concurrently
+
+    Validators marked by `reveries.plugins.host_independent` are run in a
+    thread pool here, and their results are reported when pyblish reaches
+    each of them.
+
+    Set environment variable `REVERIES_NO_CONCURRENT_VALIDATION` to run
+    them one after another as usual.
+
+    """
+
+    label = "Run Validators Concurrently"
+    order = pyblish.api.ValidatorOrder - 0.5
+
+    WORKERS = 8
+
+    def process(self, context):
+        if os.environ.get("REVERIES_NO_CONCURRENT_VALIDATION"):
+            return
+
+        pairs = host_independent_plugins(context,
+                                         self.order + 0.001,
+                                         pyblish.api.ValidatorOrder + 0.5)
+        if not pairs:
+            return
+
+        self.log.info("Running {} validations concurrently ..."
+                      "".format(len(pairs)))
+        run_host_independent(context, pairs, workers=self.WORKERS)
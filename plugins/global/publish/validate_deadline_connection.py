@@ -2,7 +2,7 @@
 import pyblish.api
 import avalon.api as api
 from avalon.vendor import requests
-from reveries.plugins import context_process
+from reveries.plugins import context_process, host_independent
 
 
 class ValidateDeadlineConnection(pyblish.api.InstancePlugin):
@@ -15,6 +15,7 @@ class ValidateDeadlineConnection(pyblish.api.InstancePlugin):
         "reveries.imgseq",
     ]
 
+    @host_independent
     @context_process
     def process(self, context):
 
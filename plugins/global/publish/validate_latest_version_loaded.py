@@ -3,41 +3,61 @@ import pyblish.api
 import avalon.api
 import avalon.io as io
 
+from reveries.database import get_cache, get_latest_version_names
+from reveries.plugins import host_independent
+
 
 class ValidateLatestVersionLoaded(pyblish.api.ContextPlugin):
     """Checking loaded subsets' version outdated or not
 
     Show warning if there are subset's version outdated.
 
+    All containers' representations and versions are queried at once, and
+    the latest version of each subset is found by one aggregation.
+
+    Containers are collected by `CollectLoadedContainers`, so this can run
+    without host.
+
     """
     order = pyblish.api.ValidatorOrder - 0.4
     label = "Latest Version Loaded"
 
+    @host_independent
     def process(self, context):
-        host = avalon.api.registered_host()
+        loaded = context.data.get("loadedContainers")
+        if loaded is None:
+            loaded = avalon.api.registered_host().ls()
 
-        checked = set()
-        outdated = dict()
+        cache = get_cache(context)
 
-        for container in host.ls():
-            container_node = container["objectName"]
+        containers = dict()
+        for container in loaded:
             representation_id = io.ObjectId(container["representation"])
+            containers.setdefault(representation_id, list()).append(
+                container["objectName"])
 
-            if representation_id in checked:
-                if representation_id in outdated:
-                    outdated[representation_id].append(container_node)
-                continue
+        representation_ids = list(containers)
+        representations = cache.find_many(representation_ids)
+        versions = cache.find_many(set(r["parent"] for r in representations
+                                       if r is not None))
+        versions = {v["_id"]: v for v in versions if v is not None}
 
-            checked.add(representation_id)
+        latest = get_latest_version_names(set(v["parent"]
+                                              for v in versions.values()))
 
-            representation = io.find_one({"_id": representation_id})
-            version = io.find_one({"_id": representation["parent"]})
-            highest_version = io.find_one({"type": "version",
-                                           "parent": version["parent"]},
-                                          sort=[("name", -1)])
+        outdated = dict()
+        for _id, representation in zip(representation_ids, representations):
+            if representation is None:
+                self.log.warning("Representation {} not found, container: "
+                                 "{}".format(_id, containers[_id]))
+                continue
+
+            version = versions.get(representation["parent"])
+            if version is None:
+                continue
 
-            if version["name"] < highest_version["name"]:
-                outdated[representation_id] = [container_node]
+            if version["name"] < latest[version["parent"]]:
+                outdated[_id] = containers[_id]
 
         if outdated:
             nodes = "\n".join(n for x in outdated.values() for n in x)
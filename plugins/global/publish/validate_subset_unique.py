@@ -1,5 +1,6 @@
 
 import pyblish.api
+from reveries.plugins import host_independent
 
 
 class ValidateSubsetUnique(pyblish.api.ContextPlugin):
@@ -12,6 +13,7 @@ class ValidateSubsetUnique(pyblish.api.ContextPlugin):
     label = "Subset Unique"
     order = pyblish.api.ValidatorOrder - 0.44
 
+    @host_independent
     def process(self, context):
         invalid = self.get_invalid(context)
 
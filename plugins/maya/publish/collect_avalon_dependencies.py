@@ -2,6 +2,8 @@
 import pyblish.api
 import avalon.io
 
+from reveries.database import get_cache
+
 
 class CollectAvalonDependencies(pyblish.api.ContextPlugin):
     """Collect Avalon dependencies from root containers
@@ -15,17 +17,26 @@ class CollectAvalonDependencies(pyblish.api.ContextPlugin):
         from maya import cmds
 
         root_containers = context.data["RootContainers"]
-        container_members = dict()
+        cache = get_cache(context)
 
-        # Collect root containers' members
+        # Index root containers by member
 
+        member_index = dict()
         for container in root_containers:
-            members = set()
-            members.update(cmds.ls(cmds.sets(container,
-                                             query=True,
-                                             nodesOnly=True),
-                                   long=True))
-            container_members[container] = members
+            members = cmds.ls(cmds.sets(container,
+                                        query=True,
+                                        nodesOnly=True),
+                              long=True)
+            for member in members:
+                member_index.setdefault(member, set()).add(container)
+
+        # Resolve all containers' representation at once, the parent of
+        # representation is the dependency version.
+
+        containers = list(root_containers)
+        repr_ids = [avalon.io.ObjectId(root_containers[con]["representation"])
+                    for con in containers]
+        representations = dict(zip(containers, cache.find_many(repr_ids)))
 
         # Scan dependencies for each instance
 
@@ -33,34 +44,27 @@ class CollectAvalonDependencies(pyblish.api.ContextPlugin):
 
             self.log.info("Collecting dependency: %s" % instance.data["name"])
 
-            members = set(instance)
+            # Compute dependency from the coverage between instance (and
+            # it's history) and container.
+            covered = set()
+            for node in instance:
+                covered.update(member_index.get(node, ()))
+            for node in instance.data["allHistory"]:
+                covered.update(member_index.get(node, ()))
 
-            # Compute dependency from the coverage between instance and
-            # container.
-            for con, con_member in container_members.items():
-
-                if not members.intersection(con_member):
-                    # Try history
-                    history = instance.data["allHistory"]
-                    if not history.intersection(con_member):
-                        # Not dependent
-                        continue
+            for con in covered:
 
                 namespace = root_containers[con]["namespace"]
                 name = root_containers[con]["name"]
 
-                repr_id = root_containers[con]["representation"]
-                repr_id = avalon.io.ObjectId(repr_id)
-                representation = avalon.io.find_one({"_id": repr_id})
+                representation = representations[con]
 
                 if representation is None:
                     self.log.warning("Dependency representation not found, "
                                      "this should not happen.")
                     continue
 
-                version = avalon.io.find_one({"_id": representation["parent"]})
-
-                self.register_dependency(instance, version["_id"])
+                self.register_dependency(instance, representation["parent"])
                 self.log.debug("Collected: %s - %s" % (namespace, name))
 
             # Register dependency from data.futureDependencies for those
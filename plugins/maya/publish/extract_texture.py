@@ -7,7 +7,8 @@ import avalon.io
 
 from reveries.plugins import PackageExtractor, skip_stage
 from reveries.maya.plugins import env_embedded_path
-from reveries.utils import hash_file
+from reveries.utils import hash_files
+from reveries.database import get_cache
 
 
 class ExtractTexture(PackageExtractor):
@@ -19,6 +20,8 @@ class ExtractTexture(PackageExtractor):
     hosts = ["maya"]
     families = ["reveries.texture"]
 
+    background = True
+
     representations = [
         "TexturePack"
     ]
@@ -55,12 +58,16 @@ class ExtractTexture(PackageExtractor):
             # Never been published
             latest_hashes = dict()
         else:
-            representation = avalon.io.find_one({"_id": representation})
-            latest_hashes = representation["data"]["hashes"]
+            representation = get_cache(self.context).find_one({
+                "_id": representation})
+            # Copy, document is shared in cache, and will be updated in
+            # background job
+            latest_hashes = dict(representation["data"]["hashes"])
 
         processed_pattern = dict()
+        texture_files = list()
 
-        # Hash file to check which to copy and which to remain old link
+        # Collect texture files of each file node
         for file_node in self.member:
 
             tiling_mode = cmds.getAttr(file_node + ".uvTilingMode")
@@ -114,8 +121,26 @@ class ExtractTexture(PackageExtractor):
             curreent_files = findAllFilesForPattern(pattern, None)
             self.log.debug("File count: {}".format(len(curreent_files)))
 
+            texture_files.append((paths, curreent_files))
+
+        # Hashing and linking not need Maya
+        self.add_job(self.transfer_textures, texture_files, latest_hashes)
+
+    def transfer_textures(self, texture_files, latest_hashes):
+        """Hash texture files and queue them for integration
+
+        Files that have been published are hardlinked from latest version.
+
+        """
+        # Hash all files at once, in parallel
+        hashes, _ = hash_files([file for _, files in texture_files
+                                for file in files])
+
+        # Check which to copy and which to remain old link
+        for paths, curreent_files in texture_files:
+
             for file in curreent_files:
-                hash_value = hash_file(file)
+                hash_value = hashes[file]
 
                 img_name = os.path.basename(file)
                 paths.pop()  # Change to resloved file path
@@ -136,8 +161,8 @@ class ExtractTexture(PackageExtractor):
                 except KeyError:
 
                     latest_hashes[hash_value] = final_path
-                    self.add_file(file, final_path)
-                    self.log.debug("File added: {0} -> {1}"
+                    self.add_blob(file, final_path, hash_value)
+                    self.log.debug("Blob added: {0} -> {1}"
                                    "".format(file, final_path))
 
                 else:
@@ -145,4 +170,4 @@ class ExtractTexture(PackageExtractor):
                     self.log.debug("Hardlink added: {0} -> {1}"
                                    "".format(file, final_path))
 
-        self.add_data({"hashes": latest_hashes})
+        return {"hashes": latest_hashes}
@@ -1,8 +1,8 @@
 
 import pyblish.api
 
-from avalon import io
 from reveries.maya import utils
+from reveries.database import get_latest_versions
 from maya import cmds
 
 
@@ -48,20 +48,16 @@ class ValidateModelConsistencyOnLook(pyblish.api.InstancePlugin):
         assert asset["name"] == instance.data["asset"], "Not the same asset."
         self.log.info("Asset: %s" % asset["name"])
 
-        for subset in io.find({"type": "subset", "parent": asset["_id"]}):
-            latest = io.find_one({"type": "version", "parent": subset["_id"]},
-                                 sort=[("name", -1)])
-            if latest is None:
-                continue
-
-            if not any(family in latest["data"]["families"]
-                       for family in FAMILIES):
-                continue
+        latest_versions = get_latest_versions({"parent": asset["_id"]},
+                                              families=FAMILIES,
+                                              representation=repr_name)
+        for subset, latest, representation in latest_versions:
+            if representation is None:
+                self.log.error("Subset {!r} has no {!r} representation."
+                               "".format(subset["name"], repr_name))
+                raise Exception("Model data missing, please check the "
+                                "latest version of %s." % subset["name"])
 
-            # Get representation
-            representation = io.find_one({"type": "representation",
-                                          "parent": latest["_id"],
-                                          "name": repr_name})
             profile = representation["data"]["modelProfile"]
             collected_profiles[subset["name"]] = profile
 
@@ -47,6 +47,13 @@ def install():  # pragma: no cover
     # Remove pyblish-base default plugins
     pyblish.deregister_plugin_path(PYBLISH_DEFAULT)
 
+    from . import plugins
+    pyblish.register_callback("published", plugins.teardown_publish)
+    # Publish GUI toggles, for validating concurrently
+    pyblish.register_callback("pluginToggled", plugins.on_plugin_toggled)
+    pyblish.register_callback("instanceToggled", plugins.on_instance_toggled)
+    pyblish.register_callback("reset", plugins.on_publish_reset)
+
     self.installed = True
 
 
@@ -58,6 +65,13 @@ def uninstall():  # pragma: no cover
     # Restore pyblish-base default plugins
     pyblish.register_plugin_path(PYBLISH_DEFAULT)
 
+    from . import plugins
+    pyblish.deregister_callback("published", plugins.teardown_publish)
+    pyblish.deregister_callback("pluginToggled", plugins.on_plugin_toggled)
+    pyblish.deregister_callback("instanceToggled",
+                                plugins.on_instance_toggled)
+    pyblish.deregister_callback("reset", plugins.on_publish_reset)
+
     self.installed = False
 
 
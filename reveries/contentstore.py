@@ -0,0 +1,220 @@
+"""Project-level content-addressed file store
+
+Published files that are added by content (e.g. textures) are stored once
+per project as blobs named by their C4 ID, and each published path is a
+hardlink to the blob. So identical files shared by many subsets only take
+disk space once.
+
+Remove blobs that no representation refers to with:
+
+    python -m reveries.contentstore <project> [--dry-run] [--min-age HOURS]
+
+"""
+import os
+import sys
+import stat
+import time
+import uuid
+import logging
+import argparse
+
+import avalon.api
+import avalon.io
+
+from .utils import get_hash_cache
+from .transfer import copy_file_hashed
+
+
+log = logging.getLogger(__name__)
+
+
+class ContentStore(object):
+    """Content-addressed blob store
+
+    Blobs are saved as `<root>/<c4id[2:4]>/<c4id>`, and set to read-only,
+    because every hardlinked published file shares the same content.
+
+    Arguments:
+        root (str): Store root directory
+
+    """
+
+    DIRNAME = ".contentstore"
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def for_project(cls, project=None):
+        """Return the store of project
+
+        The store is located in project root, on the same volume as the
+        publish dirs so blobs can be hardlinked.
+
+        Arguments:
+            project (str, optional): Project name, default is current
+                project in `avalon.Session`
+
+        """
+        project = project or avalon.api.Session["AVALON_PROJECT"]
+        root = os.path.join(avalon.api.registered_root(),
+                            project,
+                            cls.DIRNAME)
+        return cls(root)
+
+    def path(self, c4id):
+        """Return blob path of C4 ID"""
+        return os.path.join(self.root, c4id[2:4], c4id)
+
+    def has(self, c4id):
+        return os.path.isfile(self.path(c4id))
+
+    def put(self, src, c4id):
+        """Copy file into store if not exists, return blob path
+
+        The file is copied into a temporary name then renamed, so a blob is
+        either complete or not existed. Content is hashed while copying, and
+        `IOError` raised if not matching `c4id`, e.g. from a stale hash
+        cache entry, so the store never holds wrong content.
+
+        Arguments:
+            src (str): Source file path
+            c4id (str): C4 ID of the source file
+
+        """
+        blob = self.path(c4id)
+        if os.path.isfile(blob):
+            return blob
+
+        dirname = os.path.dirname(blob)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Possibly created by other publish at the same time
+                if not os.path.isdir(dirname):
+                    raise
+
+        temp = "%s.%s.tmp" % (blob, uuid.uuid4().hex)
+        copied, _ = copy_file_hashed(src, temp, cache_path=blob)
+        if copied != c4id:
+            os.remove(temp)
+            raise IOError("Content of %s does not match %s." % (src, c4id))
+
+        # Modified time is the stored time, which `collect_garbage` relies
+        # on, not the source's copied by `copy_file_hashed`.
+        os.utime(temp, None)
+        os.chmod(temp, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+
+        cache = get_hash_cache()
+        if cache is not None:
+            cache.set(blob, c4id, os.stat(temp))
+
+        try:
+            os.rename(temp, blob)
+        except OSError:
+            # Renaming onto existing file fails on Windows, which means other
+            # publish has stored the same content already.
+            os.chmod(temp, stat.S_IWRITE | stat.S_IREAD)
+            os.remove(temp)
+            if not os.path.isfile(blob):
+                raise
+
+        return blob
+
+    def iter_blobs(self):
+        """Yield C4 ID and path of each blob in store"""
+        if not os.path.isdir(self.root):
+            return
+
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+
+            for name in sorted(os.listdir(shard_dir)):
+                if name.startswith("c4") and not name.endswith(".tmp"):
+                    yield name, os.path.join(shard_dir, name)
+
+    def collect_garbage(self, referenced, min_age=24, dry_run=False):
+        """Remove blobs that not referenced
+
+        Arguments:
+            referenced (set): C4 IDs that still in use
+            min_age (float, optional): Only remove blobs older than this
+                hours, for not removing blobs from in-progress publishes.
+                Default 24.
+            dry_run (bool, optional): Only report, do not remove
+
+        Returns:
+            list: Removed blob paths
+            int: Freed bytes, blobs that still hardlinked by any published
+                file are not counted.
+
+        """
+        removed = list()
+        freed = 0
+        expired = time.time() - min_age * 3600
+
+        for c4id, blob in self.iter_blobs():
+            if c4id in referenced:
+                continue
+
+            blob_stat = os.stat(blob)
+            if blob_stat.st_mtime > expired:
+                continue
+
+            log.info("Removing blob {!r}".format(blob))
+            removed.append(blob)
+            if blob_stat.st_nlink <= 1:
+                freed += blob_stat.st_size
+
+            if not dry_run:
+                os.chmod(blob, stat.S_IWRITE | stat.S_IREAD)
+                os.remove(blob)
+
+        return removed, freed
+
+
+def referenced_blobs():
+    """Return C4 IDs that referenced by representations in current project
+    """
+    referenced = set()
+    cursor = avalon.io.find({"type": "representation",
+                             "data.hashes": {"$exists": True}},
+                            projection={"data.hashes": True})
+    for representation in cursor:
+        referenced.update(representation["data"]["hashes"])
+
+    return referenced
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Remove unreferenced blobs from project content store")
+    parser.add_argument("project", help="Project name")
+    parser.add_argument("--min-age", type=float, default=24,
+                        help="Only remove blobs older than this hours")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report, do not remove")
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    avalon.io.install()
+    avalon.api.Session["AVALON_PROJECT"] = args.project
+
+    store = ContentStore.for_project(args.project)
+    removed, freed = store.collect_garbage(referenced_blobs(),
+                                           min_age=args.min_age,
+                                           dry_run=args.dry_run)
+
+    print("%s %d blobs, %.2f MB freed." % ("Found" if args.dry_run
+                                           else "Removed",
+                                           len(removed),
+                                           freed / 1024.0 / 1024.0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
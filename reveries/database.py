@@ -0,0 +1,838 @@
+"""Avalon database helpers
+
+Operations that `avalon.io` does not wrap, like `bulk_write` and
+`aggregate`, are done with the collection of current project.
+
+Create indexes that queries in this config need, or report query shapes
+that are not served by index, with:
+
+    python -m reveries.database index [project ...] [--dry-run]
+    python -m reveries.database audit [project ...] [--slow-ms MS]
+
+Database calls made by each publish plugin can be recorded with
+`instrument`, see `DatabaseStats`.
+
+"""
+import sys
+import time
+import logging
+import argparse
+import threading
+
+import pymongo
+import pyblish.plugin
+from pymongo import InsertOne, UpdateOne, UpdateMany
+from avalon import io
+
+from .utils import normalize_source
+
+
+log = logging.getLogger(__name__)
+
+
+def get_collection():
+    """Return the collection of current project in `avalon.io.Session`"""
+    return io._database[io.Session["AVALON_PROJECT"]]
+
+
+def get_latest_version_names(subset_ids):
+    """Return latest version number of each subset, in one aggregation
+
+    Arguments:
+        subset_ids (list): Subset `_id`s
+
+    Returns:
+        dict: Latest version number by subset `_id`, subsets that have no
+            version are not included.
+
+    """
+    pipeline = [
+        {"$match": {"type": "version", "parent": {"$in": list(subset_ids)}}},
+        {"$group": {"_id": "$parent", "name": {"$max": "$name"}}},
+    ]
+    return {doc["_id"]: doc["name"]
+            for doc in get_collection().aggregate(pipeline)}
+
+
+def get_latest_versions(subset_filter, families=None, representation=None):
+    """Return latest version of each subset, optionally joined with
+    representation
+
+    Subsets are found by one query, and their latest versions, filtered by
+    family and joined with representation, are found by one aggregation.
+
+    Example:
+        >> get_latest_versions({"parent": asset_id},
+        ..                     families=["reveries.model"],
+        ..                     representation="mayaBinary")
+
+    Arguments:
+        subset_filter (dict): Filter of subsets, e.g. `{"parent": asset_id}`
+        families (list, optional): Only return subsets which latest version
+            has any of these families
+        representation (str, optional): Name of the representation to join
+
+    Returns:
+        list: Tuples of subset, latest version and representation document,
+            in the order subsets were found. Representation is `None` if
+            not given or not found.
+
+    """
+    subset_filter = dict(subset_filter, type="subset")
+    subsets = list(io.find(subset_filter))
+    if not subsets:
+        return []
+
+    order = {subset["_id"]: index for index, subset in enumerate(subsets)}
+    subsets = {subset["_id"]: subset for subset in subsets}
+
+    collection = get_collection()
+    pipeline = [
+        {"$match": {"type": "version", "parent": {"$in": list(subsets)}}},
+        {"$sort": {"name": -1}},
+        {"$group": {"_id": "$parent", "version": {"$first": "$$ROOT"}}},
+    ]
+    if families:
+        pipeline.append(
+            {"$match": {"version.data.families": {"$in": list(families)}}})
+    if representation:
+        pipeline.append({"$lookup": {"from": collection.name,
+                                     "localField": "version._id",
+                                     "foreignField": "parent",
+                                     "as": "representations"}})
+
+    latest = list()
+    for doc in collection.aggregate(pipeline):
+        joined = None
+        for repr_ in doc.get("representations", []):
+            if (repr_["type"] == "representation" and
+                    repr_["name"] == representation):
+                joined = repr_
+                break
+
+        latest.append((subsets[doc["_id"]], doc["version"], joined))
+
+    latest.sort(key=lambda item: order[item[0]["_id"]])
+
+    return latest
+
+
+def _counter_filter(asset_id, subset_name):
+    # Deterministic `_id`, so there is only one counter per subset
+    return {"_id": "%s/%s" % (asset_id, subset_name),
+            "type": "versionCounter",
+            "parent": asset_id,
+            "name": subset_name}
+
+
+def get_reserved_version(asset_id, subset_name):
+    """Return last reserved version number of subset, or 0"""
+    counter = get_collection().find_one(_counter_filter(asset_id, subset_name))
+    return counter["reserved"] if counter else 0
+
+
+def reserve_version(asset_id, subset_name, latest=0):
+    """Reserve next version number of subset atomically
+
+    Each subset has a counter document, keyed by asset and subset name so
+    it works before the subset exists. Concurrent publishes of the same
+    subset always get different numbers, reserved numbers that were not
+    published are skipped.
+
+    The counter `_id` is derived from asset and subset name, so concurrent
+    first reservations can not create two counters.
+
+    Arguments:
+        asset_id (ObjectId): Asset `_id`
+        subset_name (str): Subset name
+        latest (int, optional): Latest version number in database, counter
+            starts from it if behind
+
+    Returns:
+        int: Reserved version number
+
+    """
+    collection = get_collection()
+    filter_ = _counter_filter(asset_id, subset_name)
+
+    try:
+        collection.update_one(filter_,
+                              {"$max": {"reserved": latest}},
+                              upsert=True)
+    except pymongo.errors.DuplicateKeyError:
+        # Counter just created by other publish, update that one
+        collection.update_one(filter_, {"$max": {"reserved": latest}})
+    counter = collection.find_one_and_update(
+        filter_,
+        {"$inc": {"reserved": 1}},
+        return_document=pymongo.ReturnDocument.AFTER)
+
+    return counter["reserved"]
+
+
+def get_cache(context):
+    """Return the `DocumentCache` of the publish context"""
+    if "avalonCache" not in context.data:
+        context.data["avalonCache"] = DocumentCache()
+
+    return context.data["avalonCache"]
+
+
+class DocumentCache(object):
+    """Read-through cache of Avalon documents for one publish session
+
+    Documents are indexed by `_id`, and by `(type, parent, name)` which is
+    unique for assets, subsets, versions and representations. Documents
+    that not found are cached as well, until invalidated.
+
+    Returned documents are shared, do not modify them.
+
+    Usage:
+        >> cache = get_cache(context)
+        >> subset = cache.find_one({"type": "subset",
+        ..                          "parent": asset_id,
+        ..                          "name": "modelDefault"})
+        >> versions = cache.find_many(version_ids)
+
+    """
+
+    KEY_FIELDS = ("type", "parent", "name")
+
+    def __init__(self):
+        self._by_id = dict()
+        self._by_key = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, document):
+        return tuple(document.get(field) for field in self.KEY_FIELDS)
+
+    def _store(self, document):
+        self._by_id[document["_id"]] = document
+        if all(field in document for field in self.KEY_FIELDS):
+            self._by_key[self._key(document)] = document
+
+    def find_one(self, filter):
+        """Return one document by `_id`, or by `type`, `parent` and `name`
+
+        Other filters are not cached, and passed to `avalon.io.find_one`.
+
+        """
+        fields = set(filter)
+        if fields == {"_id"}:
+            index, key = self._by_id, filter["_id"]
+        elif fields == set(self.KEY_FIELDS):
+            index, key = self._by_key, self._key(filter)
+        else:
+            return io.find_one(filter)
+
+        with self._lock:
+            if key in index:
+                self.hits += 1
+                return index[key]
+
+        document = io.find_one(filter)
+
+        with self._lock:
+            self.misses += 1
+            if document is None:
+                index[key] = None
+            else:
+                self._store(document)
+
+        return document
+
+    def find_many(self, ids):
+        """Return documents by `_id`, not cached ones are queried at once
+
+        Arguments:
+            ids (list): Document `_id`s
+
+        Returns:
+            list: Document of each id, `None` if not found
+
+        """
+        ids = list(ids)
+
+        with self._lock:
+            missing = [_id for _id in set(ids) if _id not in self._by_id]
+            self.hits += len(set(ids)) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            found = list(io.find({"_id": {"$in": missing}}))
+
+            with self._lock:
+                for _id in missing:
+                    self._by_id[_id] = None
+                for document in found:
+                    self._store(document)
+
+        return [self._by_id[_id] for _id in ids]
+
+    def invalidate(self, _id=None, document=None):
+        """Remove cached document by `_id`, or by the index fields of
+        `document`
+        """
+        with self._lock:
+            if _id is not None:
+                cached = self._by_id.pop(_id, None)
+                if cached is not None:
+                    self._by_key.pop(self._key(cached), None)
+
+            if document is not None:
+                self._by_key.pop(self._key(document), None)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._by_key.clear()
+
+
+class BulkWriter(object):
+    """Queue write operations and send them in one ordered `bulk_write`
+
+    Inserted documents get their `_id` on queued, so later operations can
+    refer to them before they are written.
+
+    If `cache` is given, written documents are invalidated from the cache
+    once flushed.
+
+    Usage:
+        >> writer = BulkWriter()
+        >> version_id = writer.insert_one(version)
+        >> writer.update_one({"_id": other_id}, {"$set": {...}})
+        >> writer.flush()  # One round trip
+
+    Arguments:
+        cache (DocumentCache, optional): Cache to invalidate
+
+    """
+
+    def __init__(self, cache=None):
+        self._operations = list()
+        self._invalidations = list()
+        self.cache = cache
+
+    def __len__(self):
+        return len(self._operations)
+
+    def insert_one(self, document):
+        """Queue document insertion, return document's `_id`"""
+        if "_id" not in document:
+            document["_id"] = io.ObjectId()
+        self._operations.append(InsertOne(document))
+        self._invalidations.append((document["_id"], document))
+        return document["_id"]
+
+    def insert_many(self, documents):
+        """Queue documents insertion, return `_id` of each document"""
+        return [self.insert_one(document) for document in documents]
+
+    def update_one(self, filter, update):
+        self._operations.append(UpdateOne(filter, update))
+        self._invalidate_filter(filter)
+
+    def update_many(self, filter, update):
+        self._operations.append(UpdateMany(filter, update))
+        self._invalidate_filter(filter)
+
+    def _invalidate_filter(self, filter):
+        _id = filter.get("_id")
+        if _id is None or isinstance(_id, dict):
+            # Not filtered by one `_id`, clear all
+            self._invalidations.append((None, None))
+        else:
+            self._invalidations.append((_id, None))
+
+    def flush(self):
+        """Write all queued operations in order
+
+        Returns:
+            pymongo.results.BulkWriteResult: `None` if nothing queued
+
+        """
+        if not self._operations:
+            return None
+
+        operations, self._operations = self._operations, list()
+        invalidations, self._invalidations = self._invalidations, list()
+        log.debug("Writing {} operations in bulk.".format(len(operations)))
+
+        try:
+            return get_collection().bulk_write(operations, ordered=True)
+        finally:
+            if self.cache is not None:
+                self._invalidate(invalidations)
+
+    def _invalidate(self, invalidations):
+        for _id, document in invalidations:
+            if _id is None:
+                self.cache.clear()
+                return
+            self.cache.invalidate(_id, document)
+
+
+class DatabaseStats(object):
+    """Database calls statistics by pyblish plugin and instance
+
+    Collected by `instrument`, calls that are not made by any plugin are
+    not recorded. Time of iterating cursors is counted in the call that
+    made the cursor.
+
+    Usage:
+        >> stats = DatabaseStats()
+        >> instrument(stats)
+        >> ...  # Publish
+        >> uninstrument()
+        >> stats.entries()
+
+    """
+
+    def __init__(self):
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def record(self, owner, operation, seconds, documents, calls=1):
+        """Add one call, or the iteration of it's cursor if `calls` is 0
+
+        Arguments:
+            owner (tuple): Plugin name and instance name, instance name is
+                empty string for context plugins
+            operation (str): Collection method name
+            seconds (float): Latency
+            documents (int): Count of documents returned
+            calls (int, optional): Call count to add, default 1
+
+        """
+        with self._lock:
+            if owner not in self._entries:
+                self._entries[owner] = {"plugin": owner[0],
+                                        "instance": owner[1],
+                                        "calls": 0,
+                                        "seconds": 0.0,
+                                        "documents": 0,
+                                        "operations": dict()}
+            entry = self._entries[owner]
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+            entry["documents"] += documents
+            operations = entry["operations"]
+            operations[operation] = operations.get(operation, 0) + calls
+
+    def entry(self, owner):
+        """Return calls, seconds and documents recorded of `owner`"""
+        with self._lock:
+            entry = self._entries.get(owner)
+            if entry is None:
+                return {"calls": 0, "seconds": 0.0, "documents": 0}
+            return {key: entry[key]
+                    for key in ("calls", "seconds", "documents")}
+
+    def entries(self, instance=None):
+        """Return entries sorted by latency, slowest first
+
+        Arguments:
+            instance (str, optional): Only return entries of this instance
+                and of context plugins
+
+        Returns:
+            list: Dict of "plugin", "instance", "calls", "seconds",
+                "documents" and "operations" (call count by method)
+
+        """
+        with self._lock:
+            entries = [dict(entry, operations=dict(entry["operations"]))
+                       for entry in self._entries.values()]
+
+        if instance is not None:
+            entries = [entry for entry in entries
+                       if entry["instance"] in ("", instance)]
+
+        return sorted(entries, key=lambda e: e["seconds"], reverse=True)
+
+
+def _current_owner():
+    """Return plugin and instance name of the calling plugin, or `None`"""
+    frame = sys._getframe(2)
+    plugin = None
+    while frame is not None:
+        local = frame.f_locals
+        if plugin is None:
+            if isinstance(local.get("self"), pyblish.plugin.Plugin):
+                plugin = type(local["self"]).__name__
+
+        if plugin is not None:
+            instance = local.get("instance")
+            if isinstance(instance, pyblish.plugin.Instance):
+                return plugin, instance.name
+
+        frame = frame.f_back
+
+    if plugin is None:
+        return None
+    return plugin, ""
+
+
+class _InstrumentedCursor(object):
+
+    def __init__(self, cursor, stats, owner, operation):
+        self._cursor = cursor
+        self._stats = stats
+        self._owner = owner
+        self._operation = operation
+        self._seconds = 0.0
+        self._documents = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # Chained, e.g. `cursor.sort(...)`
+            return self if result is self._cursor else result
+        return call
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            document = next(self._cursor)
+        except StopIteration:
+            self._flush()
+            raise
+        finally:
+            self._seconds += time.time() - start
+        self._documents += 1
+        return document
+
+    next = __next__  # Python 2
+
+    def _flush(self):
+        if self._seconds or self._documents:
+            self._stats.record(self._owner,
+                               self._operation,
+                               self._seconds,
+                               self._documents,
+                               calls=0)
+        self._seconds = 0.0
+        self._documents = 0
+
+    def __del__(self):
+        self._flush()
+
+
+class _InstrumentedCollection(object):
+
+    OPERATIONS = [
+        "find",
+        "find_one",
+        "insert_one",
+        "insert_many",
+        "replace_one",
+        "update_one",
+        "update_many",
+        "find_one_and_update",
+        "delete_many",
+        "distinct",
+        "aggregate",
+        "bulk_write",
+    ]
+
+    CURSORS = ["find", "aggregate"]
+
+    def __init__(self, collection, stats):
+        self._collection = collection
+        self._stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in self.OPERATIONS:
+            return attr
+
+        def call(*args, **kwargs):
+            owner = _current_owner()
+            if owner is None:
+                return attr(*args, **kwargs)
+
+            start = time.time()
+            result = attr(*args, **kwargs)
+            seconds = time.time() - start
+
+            if name in self.CURSORS:
+                documents = 0
+                result = _InstrumentedCursor(result, self._stats, owner, name)
+            elif name == "find_one":
+                documents = int(result is not None)
+            elif name == "distinct":
+                documents = len(result)
+            else:
+                documents = 0
+
+            self._stats.record(owner, name, seconds, documents)
+            return result
+        return call
+
+
+class _InstrumentedDatabase(object):
+
+    def __init__(self, database, stats):
+        self._database = database
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+    def __getitem__(self, name):
+        return _InstrumentedCollection(self._database[name], self._stats)
+
+
+def instrument(stats):
+    """Record database calls made through `avalon.io` into `stats`
+
+    Replace the database of `avalon.io` with a recording proxy, until
+    `uninstrument` or `avalon.io.install` is called.
+
+    Arguments:
+        stats (DatabaseStats): Where calls are recorded
+
+    Returns:
+        bool: False if `avalon.io` is not installed
+
+    """
+    uninstrument()
+    if io._database is None:
+        return False
+
+    io._database = _InstrumentedDatabase(io._database, stats)
+    return True
+
+
+def instrumented_stats():
+    """Return the `DatabaseStats` that recording calls, or `None`"""
+    if isinstance(io._database, _InstrumentedDatabase):
+        return io._database._stats
+    return None
+
+
+def uninstrument():
+    """Restore the database of `avalon.io` replaced by `instrument`"""
+    if isinstance(io._database, _InstrumentedDatabase):
+        io._database = io._database._database
+
+
+# Compound indexes for lookups by `type`, `parent` and `name`, latest
+# version (sorted by name), children by `parent`, and source file.
+# Keys and options of each index
+INDEXES = [
+    ([("type", pymongo.ASCENDING),
+      ("parent", pymongo.ASCENDING),
+      ("name", pymongo.DESCENDING)], {}),
+    ([("parent", pymongo.ASCENDING)], {}),
+    ([("type", pymongo.ASCENDING),
+      ("data.sourcePath", pymongo.ASCENDING)], {}),
+]
+
+
+def ensure_indexes(collection, dry_run=False):
+    """Create indexes in `INDEXES` if not exists
+
+    Returns:
+        list: Keys of created (or to be created if `dry_run`) indexes
+
+    """
+    existing = [list(index["key"])
+                for index in collection.index_information().values()]
+    created = list()
+
+    for keys, options in INDEXES:
+        if keys in existing:
+            continue
+
+        log.info("Creating index {} on {!r}".format(keys, collection.name))
+        created.append(keys)
+        if not dry_run:
+            collection.create_index(keys, background=True, **options)
+
+    return created
+
+
+def backfill_source_paths(collection, project, dry_run=False, batch=1000):
+    """Add `data.sourcePath` to versions published before it existed
+
+    Returns:
+        int: Count of updated (or to be updated if `dry_run`) versions
+
+    """
+    cursor = collection.find({"type": "version",
+                              "data.source": {"$exists": True},
+                              "data.sourcePath": {"$exists": False}},
+                             projection={"data.source": True})
+    operations = list()
+    count = 0
+
+    for version in cursor:
+        source_path = normalize_source(version["data"]["source"], project)
+        operations.append(
+            UpdateOne({"_id": version["_id"]},
+                      {"$set": {"data.sourcePath": source_path}}))
+        count += 1
+
+        if len(operations) >= batch:
+            if not dry_run:
+                collection.bulk_write(operations, ordered=False)
+            operations = list()
+
+    if operations and not dry_run:
+        collection.bulk_write(operations, ordered=False)
+
+    return count
+
+
+def _query_shapes(collection):
+    """Yield label, filter and sort of query shapes used in this config
+
+    Filter values are taken from existing documents.
+
+    """
+    sample = dict()
+    for type_ in ("subset", "version", "representation"):
+        sample[type_] = collection.find_one({"type": type_})
+
+    subset = sample["subset"]
+    version = sample["version"]
+    representation = sample["representation"]
+
+    if subset is not None:
+        yield ("subset by name",
+               {"type": "subset",
+                "parent": subset["parent"],
+                "name": subset["name"]},
+               None)
+
+    if version is not None:
+        yield ("latest version of subset",
+               {"type": "version", "parent": version["parent"]},
+               [("name", -1)])
+        yield ("latest versions of subsets",
+               {"type": "version", "parent": {"$in": [version["parent"]]}},
+               None)
+        yield ("children of version",
+               {"parent": version["_id"]},
+               None)
+        yield ("versions by source file",
+               {"type": "version",
+                "data.sourcePath": version["data"].get("sourcePath", "")},
+               [("name", -1)])
+
+    if representation is not None:
+        yield ("representation by name",
+               {"type": "representation",
+                "parent": representation["parent"],
+                "name": representation["name"]},
+               None)
+
+
+def _plan_stages(plan):
+    stages = [plan["stage"]]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages += _plan_stages(child)
+    return stages
+
+
+def audit_queries(collection, slow_ms=100, ratio=10):
+    """Explain query shapes used in this config, report the slow ones
+
+    A query is slow if it scans the collection, examines more than `ratio`
+    times of documents it returns, or takes more than `slow_ms`.
+
+    Returns:
+        list: Dict of "label", "filter", "stages", "examined", "returned",
+            "millis" and "slow" of each query shape
+
+    """
+    report = list()
+
+    for label, filter_, sort in _query_shapes(collection):
+        cursor = collection.find(filter_)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = cursor.explain()
+
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        stats = explain.get("executionStats", {})
+        examined = stats.get("totalDocsExamined", 0)
+        returned = stats.get("nReturned", 0)
+        millis = stats.get("executionTimeMillis", 0)
+
+        slow = ("COLLSCAN" in stages or
+                examined > max(returned, 1) * ratio or
+                millis >= slow_ms)
+
+        report.append({"label": label,
+                       "filter": filter_,
+                       "stages": stages,
+                       "examined": examined,
+                       "returned": returned,
+                       "millis": millis,
+                       "slow": slow})
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create indexes or audit queries of project collections")
+    parser.add_argument("command", choices=["index", "audit"])
+    parser.add_argument("projects", nargs="*",
+                        help="Project names, default all projects")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report, do not create indexes or update "
+                             "documents")
+    parser.add_argument("--slow-ms", type=int, default=100,
+                        help="Report queries slower than this milliseconds")
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    io.install()
+    projects = args.projects or [project["name"] for project in io.projects()]
+
+    slow_count = 0
+    for project in projects:
+        io.Session["AVALON_PROJECT"] = project
+        collection = get_collection()
+        print("Project: %s" % project)
+
+        if args.command == "index":
+            start = time.time()
+            created = ensure_indexes(collection, dry_run=args.dry_run)
+            updated = backfill_source_paths(collection,
+                                            project,
+                                            dry_run=args.dry_run)
+            print("    %d indexes created, %d versions' source path updated "
+                  "(%.2f sec)" % (len(created), updated, time.time() - start))
+            continue
+
+        for shape in audit_queries(collection, slow_ms=args.slow_ms):
+            slow_count += shape["slow"]
+            print("    %s %s: %s, %d examined, %d returned, %d ms" % (
+                "SLOW" if shape["slow"] else "ok  ",
+                shape["label"],
+                " > ".join(shape["stages"]),
+                shape["examined"],
+                shape["returned"],
+                shape["millis"]))
+
+    return 1 if slow_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
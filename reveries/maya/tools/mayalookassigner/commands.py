@@ -10,6 +10,7 @@ from avalon.maya.pipeline import AVALON_CONTAINER_ID
 from avalon.vendor import six
 
 from ....utils import get_representation_path_
+from ....database import get_latest_versions
 from ....maya import lib, utils
 from ...pipeline import (
     get_container_from_namespace,
@@ -205,14 +206,11 @@ def create_items_from_nodes(nodes):
 def list_looks(asset_id):
     """Return all look subsets from database for the given asset
     """
-    look_subsets = list(io.find({"parent": asset_id,
-                                 "type": "subset",
-                                 "name": {"$regex": "look*"}}))
-    for look in look_subsets:
-        # Get the latest version of this look subset
-        version = io.find_one({"type": "version",
-                               "parent": look["_id"]},
-                              sort=[("name", -1)])
+    look_subsets = list()
+    latest_versions = get_latest_versions({"parent": asset_id,
+                                           "name": {"$regex": "look*"}})
+    for look, version, _ in latest_versions:
+        look_subsets.append(look)
         look["version"] = version["name"]
         look["versionId"] = version["_id"]
 
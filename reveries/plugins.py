@@ -4,14 +4,33 @@ import sys
 import inspect
 import types
 import logging
+import threading
+
+from multiprocessing.pool import ThreadPool
 
 import pyblish.api
+import pyblish.logic
 import avalon.api
 import avalon.io
 
 from .vendor import six
-from .utils import temp_dir, deep_update
-from . import CONTRACTOR_PATH
+from .utils import (
+    temp_dir,
+    deep_update,
+    discover_plugins,
+    get_hash_cache,
+    hash_files,
+)
+from .database import get_cache, uninstrument
+from .staging import get_staging_manager
+from .transfer import is_same_device, verify_checksums
+from . import CONTRACTOR_PATH, profiler
+
+
+log = logging.getLogger(__name__)
+
+# Plugin name and toggled state from publish GUI, see `on_plugin_toggled`
+_plugin_toggles = dict()
 
 
 class BaseContractor(object):
@@ -49,6 +68,10 @@ class BaseContractor(object):
             "AVALON_TOOLS": os.getenv("AVALON_TOOLS", ""),
         }, **avalon.api.Session)
 
+        # Profile remote publish as well
+        if os.getenv("REVERIES_PROFILE"):
+            environment["REVERIES_PROFILE"] = os.environ["REVERIES_PROFILE"]
+
         # Save Context data from source
         #
         # (TODO): Deadline will convert the variable name to uppercase,
@@ -253,6 +276,78 @@ def create_dependency_instance(dependent,
     return instance
 
 
+BACKGROUND_WORKERS = 4
+
+
+def get_background_pool(context):
+    """Return the thread pool for `PackageExtractor.add_job` of the context
+    """
+    if "backgroundPool" not in context.data:
+        context.data["backgroundPool"] = ThreadPool(BACKGROUND_WORKERS)
+    return context.data["backgroundPool"]
+
+
+def _add_job_result(data, representation, result):
+    if isinstance(result, dict):
+        packages = data["packages"]
+        deep_update(packages.setdefault(representation, dict()), result)
+
+
+def join_background_jobs(context):
+    """Wait for all background jobs in context and collect their results
+
+    Returned dict of each job is added to it's representation data, like
+    `PackageExtractor.add_data`. The thread pool is closed afterward.
+
+    Returns:
+        list: Tuples of instance, representation and error of failed jobs
+
+    """
+    failed = list()
+
+    for instance in context:
+        jobs = instance.data.pop("backgroundJobs", [])
+        for representation, job in jobs:
+            try:
+                result = job.get()
+            except Exception as e:
+                failed.append((instance, representation, e))
+            else:
+                _add_job_result(instance.data, representation, result)
+
+    pool = context.data.pop("backgroundPool", None)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return failed
+
+
+def teardown_publish(context=None):
+    """Release what publish session holds, whether it succeeded or not
+
+    Run by `PublishTeardown` and on "published" signal, so things like
+    background jobs, staging dirs, publish profiler or database calls
+    recording won't leak into next publish of the same session.
+
+    """
+    if context is not None:
+        # Left by failed extraction
+        failed = join_background_jobs(context)
+        for instance, representation, error in failed:
+            log.warning("Background job of {0} ({1}) failed: {2}"
+                        "".format(instance, representation, error))
+
+        manager = get_staging_manager()
+        for instance in context:
+            staging_dir = instance.data.get("stagingDir")
+            if staging_dir:
+                manager.release(staging_dir)
+
+    profiler.uninstall()
+    uninstrument()
+
+
 class PackageLoader(object):
     """Load representation into host application
 
@@ -265,6 +360,24 @@ class PackageLoader(object):
         super(PackageLoader, self).__init__(context)
         self.package_path = self.fname
         self.fname = None  # Do not use
+        self.representation = context["representation"]
+
+        if os.environ.get("REVERIES_VERIFY_ON_LOAD"):
+            self.verify_package()
+
+    def verify_package(self):
+        """Raise `IOError` if files not match the checksums recorded on
+        publish
+
+        Called on init if environment variable `REVERIES_VERIFY_ON_LOAD` is
+        set. Representations published without checksums always pass.
+
+        """
+        checksums = self.representation["data"].get("checksums", [])
+        invalid = verify_checksums(self.package_path, checksums)
+        if invalid:
+            raise IOError("Published files missing or changed in {!r}: {}"
+                          "".format(self.package_path, ", ".join(invalid)))
 
     def file_path(self, file_name):
         return os.path.join(self.package_path, file_name)
@@ -325,6 +438,171 @@ def context_process(process):
     return _context_process
 
 
+def host_independent(process):
+    """Decorator, mark plugin process as host-independent
+
+    Validators that only wait on database or network, and never call host
+    API, can be marked with this. They will be run concurrently by
+    `ValidateConcurrently` at the beginning of validation, and the result
+    and logs of each will be replayed when pyblish reaches the plugin, so
+    they are still reported in order.
+
+    If used with `context_process`, this must be the outer one.
+
+    """
+
+    def replay(self, target):
+        if isinstance(target, pyblish.api.Instance):
+            context, instance_id = target.context, target.id
+        else:
+            context, instance_id = target, None
+
+        results = context.data.get("hostIndependentResults", {})
+        key = (type(self).__name__, instance_id)
+        if key not in results:
+            return process(self, target)
+
+        records, exc_info = results.pop(key)
+        for record in records:
+            self.log.handle(record)
+        if exc_info is not None:
+            six.reraise(*exc_info)
+
+    # Pyblish checks argument name to tell instance or context plugin
+    if "instance" in _get_arg_names(process):
+        def _host_independent(self, instance):
+            return replay(self, instance)
+    else:
+        def _host_independent(self, context):
+            return replay(self, context)
+
+    _host_independent.hostIndependent = True
+
+    return _host_independent
+
+
+def _get_arg_names(func):
+    if six.PY2:
+        return inspect.getargspec(func).args
+    return inspect.getfullargspec(func).args
+
+
+class _RecordCapture(logging.Handler):
+    """Collect log records into the list of current thread"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.local = threading.local()
+
+    def emit(self, record):
+        records = getattr(self.local, "records", None)
+        if records is not None:
+            records.append(record)
+
+
+def on_plugin_toggled(plugin, new_value, old_value):
+    """Keep plugin toggled in publish GUI, for `host_independent_plugins`
+
+    Pyblish QML does not change `active` of the plugins in host, and they
+    are not the same classes that `discover_plugins` returns, so the toggle
+    is kept by plugin name until next "reset".
+
+    """
+    _plugin_toggles[plugin.__name__] = new_value
+
+
+def on_instance_toggled(instance, new_value, old_value):
+    """Apply instance toggled in publish GUI to instance data"""
+    instance.data["publish"] = new_value
+
+
+def on_publish_reset(context):
+    """Forget plugin toggles of previous publish GUI session"""
+    _plugin_toggles.clear()
+
+
+def host_independent_plugins(context, min_order, max_order):
+    """Return plugin and instance pairs marked by `host_independent`
+
+    Instance is `None` for context plugins. Plugins and instances that
+    toggled off, either by `active` and `publish` data or in publish GUI,
+    are excluded as `pyblish.logic.Iterator` does.
+
+    """
+    targets = ["default"] + pyblish.api.registered_targets()
+    plugins = discover_plugins().by_range(min_order, max_order)
+    plugins = pyblish.logic.plugins_by_targets(plugins, targets)
+
+    pairs = list()
+    for Plugin in plugins:
+        if not _plugin_toggles.get(Plugin.__name__, Plugin.active):
+            continue
+        if not getattr(Plugin.process, "hostIndependent", False):
+            continue
+
+        if issubclass(Plugin, pyblish.api.InstancePlugin):
+            for instance in pyblish.logic.instances_by_plugin(context,
+                                                              Plugin):
+                if instance.data.get("publish", True):
+                    pairs.append((Plugin, instance))
+        else:
+            pairs.append((Plugin, None))
+
+    return pairs
+
+
+def run_host_independent(context, pairs, workers=8):
+    """Run host-independent plugins concurrently, save results for replay
+
+    Log records of each plugin are held, not emitted, until replayed by
+    `host_independent`.
+
+    Arguments:
+        context (pyblish.api.Context): Publish context
+        pairs (list): Plugin and instance pairs, from
+            `host_independent_plugins`
+        workers (int, optional): Thread count
+
+    """
+    # Results of previous run must not be replayed
+    context.data.pop("hostIndependentResults", None)
+
+    capture = _RecordCapture()
+    loggers = set(Plugin.log for Plugin, _ in pairs)
+
+    def run(pair):
+        Plugin, instance = pair
+        records = capture.local.records = list()
+        exc_info = None
+        try:
+            Plugin().process(context if instance is None else instance)
+        except Exception:
+            exc_info = sys.exc_info()
+        finally:
+            capture.local.records = None
+
+        key = (Plugin.__name__, None if instance is None else instance.id)
+        return key, (records, exc_info)
+
+    propagate = dict()
+    for logger in loggers:
+        propagate[logger] = logger.propagate
+        logger.propagate = False
+        logger.addHandler(capture)
+
+    pool = ThreadPool(min(workers, len(pairs)) or 1)
+    try:
+        results = dict(pool.map(run, pairs))
+    finally:
+        pool.close()
+        pool.join()
+        for logger in loggers:
+            logger.removeHandler(capture)
+            logger.propagate = propagate[logger]
+
+    context.data["hostIndependentResults"] = results
+
+
 def skip_stage(extractor):
     """Decorator, indicate the extractor will directly save to publish dir
 
@@ -389,16 +667,24 @@ class PackageExtractor(pyblish.api.InstancePlugin):
 
         ```
 
+    * Host-independent follow-up work, like hashing or listing files, can be
+      handed to a thread pool with `add_job` if the attribute `background`
+      is True, so the next representation or instance can be extracted in
+      the meantime. All jobs are joined before integration.
+
     Attributes:
         context (pyblish.api.Context): Current pyblish context object
         data (dict): Current pyblish instance data
         member (list): Current pyblish instance members
         representations (list): Names of representations that can be extracted
+        background (bool): Run jobs from `add_job` in background, default
+            False, which runs them in place.
 
     """
 
     families = []
     representations = []
+    background = False
 
     def extract(self):
         """Multi-representation extraction process
@@ -432,6 +718,7 @@ class PackageExtractor(pyblish.api.InstancePlugin):
         for method, repr_ in extract_methods:
             self._current_representation = repr_
             method()
+            self._hash_package(repr_)
 
     def process(self, instance):
         """Extractor's main process
@@ -452,7 +739,7 @@ class PackageExtractor(pyblish.api.InstancePlugin):
         self._active_representations = list()
         self._current_representation = None
         self._extract_to_publish_dir = False
-        self._subset_doc = avalon.io.find_one({
+        self._subset_doc = get_cache(self.context).find_one({
             "type": "subset",
             "parent": self.context.data["assetDoc"]["_id"],
             "name": self.data["subset"],
@@ -487,6 +774,8 @@ class PackageExtractor(pyblish.api.InstancePlugin):
             self.data["files"] = list()
         if "hardlinks" not in self.data:
             self.data["hardlinks"] = list()
+        if "blobs" not in self.data:
+            self.data["blobs"] = list()
 
     def file_name(self, extension="", suffix=""):
         """Convenient method for composing file name with default format"""
@@ -502,7 +791,7 @@ class PackageExtractor(pyblish.api.InstancePlugin):
 
         MUST call this in every representation's extraction process.
 
-        The default staging directory is generated by `tempfile.mkdtemp()` with
+        The default staging directory is created by `utils.temp_dir` with
         "pyblish_tmp_" prefix, but if the extraction method get decorated with
         `skip_stage`, the staging directory will be the publish directory.
 
@@ -562,6 +851,94 @@ class PackageExtractor(pyblish.api.InstancePlugin):
         """
         self.data["hardlinks"].append((src, dst))
 
+    def add_blob(self, src, dst, c4id):
+        """Add file to content store queue
+
+        The file will be stored into project content store by it's C4 ID,
+        and hardlinked to destination. Files that have the same content will
+        be stored only once, across all subsets.
+
+        Arguments:
+            src (str): Source file path
+            dst (str): The path that file needs to be hardlinked to
+            c4id (str): C4 ID of the source file
+
+        """
+        self.data["blobs"].append((src, dst, c4id))
+
+    def _hash_package(self, representation):
+        """Hash staged package files into hash cache in background
+
+        So the integrator does not need to read them again once the package
+        has been renamed into publish dir. Only when staging dir and publish
+        dir are on the same device, otherwise files are hashed while being
+        copied on integration. Waits for other jobs of the representation
+        first, which may still be writing files.
+
+        """
+        if self._extract_to_publish_dir or get_hash_cache() is None:
+            return
+
+        staging_dir = self.data.get("stagingDir")
+        version_dir = self.data.get("versionDir")
+        if not staging_dir or not version_dir:
+            return
+        package_dir = os.path.join(staging_dir, representation)
+        if not os.path.isdir(package_dir):
+            return
+        if not is_same_device(package_dir, version_dir):
+            return
+
+        jobs = [job for repr_, job in self.data.get("backgroundJobs", [])
+                if repr_ == representation]
+
+        def hash_package():
+            for job in jobs:
+                job.wait()
+            try:
+                hash_files([os.path.join(root, name)
+                            for root, _, files in os.walk(package_dir)
+                            for name in files])
+            except (IOError, OSError) as e:
+                # Not fatal, will be hashed on integration
+                self.log.warning("Hashing staged package failed: "
+                                 "{}".format(e))
+
+        job = get_background_pool(self.context).apply_async(hash_package)
+        if "backgroundJobs" not in self.data:
+            self.data["backgroundJobs"] = list()
+        self.data["backgroundJobs"].append((representation, job))
+
+    def add_job(self, func, *args, **kwargs):
+        """Run host-independent work of current representation
+
+        If `background` is True, `func` will be run in a thread pool, else
+        it runs right away. Returned dict of `func` will be added to the
+        representation data like `add_data`, once all jobs are joined by
+        `ExtractBackgroundJobs`.
+
+        `func` must not call host API or `add_data`, but `add_file`,
+        `add_hardlink` and `add_blob` can be called.
+
+        Arguments:
+            func (callable): Host-independent function
+            *args: Arguments for `func`
+            **kwargs: Keyword arguments for `func`
+
+        """
+        representation = self._current_representation
+
+        if not self.background:
+            _add_job_result(self.data, representation, func(*args, **kwargs))
+            return
+
+        job = get_background_pool(self.context).apply_async(func,
+                                                            args,
+                                                            kwargs)
+        if "backgroundJobs" not in self.data:
+            self.data["backgroundJobs"] = list()
+        self.data["backgroundJobs"].append((representation, job))
+
 
 class DelegatablePackageExtractor(PackageExtractor):
     """Reveries' delegatable extractor base class
@@ -0,0 +1,241 @@
+"""Profile pyblish plugin execution
+
+Wall time, CPU time, peak RSS, database calls and IO bytes of each plugin
+and instance are recorded while installed, and can be exported as Chrome
+trace-event JSON (open with `chrome://tracing` or Perfetto).
+
+Enabled in publish by environment variable `REVERIES_PROFILE`, which is
+also passed to contractor jobs, see `CollectPublishProfiler` and
+`PublishReports`.
+
+Usage:
+    >> profiler = install()
+    >> pyblish.util.publish()
+    >> profiler.dump("publish_trace.json")
+    >> uninstall()
+
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+import pyblish.api
+import pyblish.plugin
+
+from .database import (
+    DatabaseStats,
+    instrument,
+    instrumented_stats,
+    uninstrument,
+)
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+self = sys.modules[__name__]
+self._profiler = None
+
+log = logging.getLogger(__name__)
+
+
+STAGES = [
+    ("collect", pyblish.api.CollectorOrder),
+    ("validate", pyblish.api.ValidatorOrder),
+    ("extract", pyblish.api.ExtractorOrder),
+    ("integrate", pyblish.api.IntegratorOrder),
+]
+
+
+def _stage(order):
+    for name, base in STAGES:
+        if base - 0.5 <= order < base + 0.5:
+            return name
+    return "other"
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _peak_rss():
+    """Return peak resident set size of this process in bytes, or `None`"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _io_counters():
+    """Return bytes read and written by this process, or `None`"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(":", 1) for line in f if ":" in line)
+    except (IOError, OSError):
+        return None
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+class PublishProfiler(object):
+    """Record resource usage of each processed plugin and instance
+
+    CPU time and IO bytes are counted for the whole process, so plugins
+    that run concurrently share them.
+
+    """
+
+    def __init__(self):
+        self.events = list()
+        self.origin = time.time()
+        self.db_stats = DatabaseStats()
+        self._lock = threading.Lock()
+        self._process = pyblish.plugin.process
+
+    def process(self, plugin, context, instance=None, action=None):
+        """Run `pyblish.plugin.process` and record it"""
+        instance_name = instance.name if instance is not None else ""
+        owner = (plugin.__name__, instance_name)
+        db_before = self.db_stats.entry(owner)
+
+        io_before = _io_counters()
+        rss_before = _peak_rss()
+        cpu_before = _cpu_time()
+        start = time.time()
+
+        result = None
+        try:
+            result = self._process(plugin, context, instance, action)
+            return result
+        finally:
+            wall = time.time() - start
+            cpu = _cpu_time() - cpu_before
+            rss = _peak_rss()
+            io_after = _io_counters()
+            db_after = self.db_stats.entry(owner)
+
+            args = {
+                "instance": instance_name,
+                "success": bool(result and result["success"]),
+                "cpu": cpu,
+                "peakRss": rss,
+                "rssGrowth": (rss - rss_before) if rss is not None else None,
+                "dbCalls": db_after["calls"] - db_before["calls"],
+                "dbSeconds": db_after["seconds"] - db_before["seconds"],
+                "dbDocuments": (db_after["documents"] -
+                                db_before["documents"]),
+                "ioRead": None,
+                "ioWrite": None,
+            }
+            if io_before is not None and io_after is not None:
+                args["ioRead"] = io_after[0] - io_before[0]
+                args["ioWrite"] = io_after[1] - io_before[1]
+
+            event = {
+                "name": plugin.__name__,
+                "cat": _stage(plugin.order),
+                "ph": "X",
+                "ts": int((start - self.origin) * 1e6),
+                "dur": int(wall * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.current_thread().ident,
+                "args": args,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def summary(self):
+        """Return recorded events as flat dicts, slowest first
+
+        Returns:
+            list: Dict of "plugin", "instance", "stage", "wall" and keys in
+                trace event's "args"
+
+        """
+        with self._lock:
+            events = list(self.events)
+
+        summary = list()
+        for event in events:
+            entry = dict(event["args"])
+            entry.update({"plugin": event["name"],
+                          "stage": event["cat"],
+                          "wall": event["dur"] / 1e6})
+            summary.append(entry)
+
+        return sorted(summary, key=lambda e: e["wall"], reverse=True)
+
+    def stage_totals(self):
+        """Return total wall seconds of each stage"""
+        totals = dict()
+        with self._lock:
+            for event in self.events:
+                stage = event["cat"]
+                totals[stage] = totals.get(stage, 0) + event["dur"] / 1e6
+        return totals
+
+    def trace(self):
+        """Return Chrome trace-event JSON object"""
+        with self._lock:
+            events = list(self.events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        """Write Chrome trace-event JSON file"""
+        with open(path, "w") as fp:
+            json.dump(self.trace(), fp)
+
+
+def install():
+    """Start profiling plugins processed by `pyblish.plugin.process`
+
+    If already installed, the installed one is returned, so this can be
+    called from both the publish script and the collector.
+
+    Returns:
+        PublishProfiler: The installed profiler
+
+    """
+    if self._profiler is not None:
+        return self._profiler
+
+    profiler = PublishProfiler()
+
+    stats = instrumented_stats()
+    if stats is not None:
+        profiler.db_stats = stats
+    elif not instrument(profiler.db_stats):
+        log.warning("Database not installed, calls not profiled.")
+
+    pyblish.plugin.process = profiler.process
+
+    self._profiler = profiler
+    return profiler
+
+
+def uninstall():
+    """Stop profiling, restore `pyblish.plugin.process`
+
+    Database calls recording is stopped as well, if started by profiler.
+
+    """
+    if self._profiler is None:
+        return
+
+    pyblish.plugin.process = self._profiler._process
+    if instrumented_stats() is self._profiler.db_stats:
+        uninstrument()
+
+    self._profiler = None
+
+
+def get_profiler():
+    """Return the installed `PublishProfiler`, or `None`"""
+    return self._profiler
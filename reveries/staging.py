@@ -0,0 +1,260 @@
+"""Managed staging area for extraction
+
+Stages are created under one stage root, grouped by the session (process)
+that owns them, so leaked stages can be found and removed without
+scanning unrelated files in system temp dir.
+
+    <stage root>/
+        session-<pid>-<id>/
+            .owner.json
+            pyblish_tmp_xxxxxx/
+            ...
+
+Environment variables:
+    REVERIES_STAGE_ROOT: Stage root, e.g. on local SSD. Default is
+        `reveries_stage` in system temp dir.
+    REVERIES_STAGE_MAX_MB: Disk use cap of the stage root, no cap if not
+        set.
+    REVERIES_STAGE_MAX_AGE: Hours before sessions that can not be checked
+        by owner PID are stale, default 72.
+
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import atexit
+import logging
+import tempfile
+import threading
+
+
+self = sys.modules[__name__]
+self._manager = None
+
+log = logging.getLogger(__name__)
+
+
+def is_process_alive(pid):
+    """Return True if process `pid` is running on this machine"""
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION,
+                                      False,
+                                      pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == STILL_ACTIVE
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # Exists but not ours
+        return e.errno == 1  # EPERM
+    return True
+
+
+def dir_size(path):
+    """Return total bytes of files in `path`"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class StagingManager(object):
+    """Create and track staging dirs of current session
+
+    Arguments:
+        root (str, optional): Stage root, default `DEFAULT_ROOT`
+        max_bytes (int, optional): Disk use cap of the stage root, creating
+            stage fails if exceeded after stale sessions been removed. Disk
+            use is measured at most once every `USAGE_TTL` seconds.
+        max_age (float, optional): Seconds before sessions that can not be
+            checked by owner PID are stale, default `MAX_AGE`.
+
+    """
+
+    DEFAULT_ROOT = os.path.join(tempfile.gettempdir(), "reveries_stage")
+    OWNER_FILE = ".owner.json"
+    SESSION_PREFIX = "session-"
+    MAX_AGE = 72 * 3600
+    USAGE_TTL = 60
+
+    def __init__(self, root=None, max_bytes=None, max_age=None):
+        self.root = os.path.abspath(root or self.DEFAULT_ROOT)
+        self.max_bytes = max_bytes
+        self.max_age = self.MAX_AGE if max_age is None else max_age
+        self.session_dir = None
+        self.stages = list()  # Active stages of this session
+        self._usage = None  # (measured time, bytes)
+        self._lock = threading.Lock()
+
+    def _ensure_session(self):
+        if self.session_dir is not None:
+            return self.session_dir
+
+        name = "%s%d-%s" % (self.SESSION_PREFIX,
+                            os.getpid(),
+                            uuid.uuid4().hex[:8])
+        session_dir = os.path.join(self.root, name)
+        os.makedirs(session_dir)
+
+        owner = {"pid": os.getpid(),
+                 "host": socket.gethostname(),
+                 "created": time.time()}
+        with open(os.path.join(session_dir, self.OWNER_FILE), "w") as fp:
+            json.dump(owner, fp)
+
+        self.session_dir = session_dir
+        return session_dir
+
+    def create(self, prefix="pyblish_tmp_"):
+        """Create and register a new stage
+
+        Arguments:
+            prefix (str, optional): Prefix name of the stage dir
+
+        Returns:
+            str: Stage dir path
+
+        """
+        if self.max_bytes and self.usage() >= self.max_bytes:
+            self.clean_stale()
+            usage = self.usage(refresh=True)
+            if usage >= self.max_bytes:
+                raise RuntimeError("Staging area {!r} is full, {} MB used."
+                                   "".format(self.root, usage // 1024 ** 2))
+
+        with self._lock:
+            stage = tempfile.mkdtemp(prefix=prefix,
+                                     dir=self._ensure_session())
+            self.stages.append(stage)
+
+        return stage
+
+    def release(self, stage):
+        """Remove stage, if it's registered in this session"""
+        with self._lock:
+            if stage not in self.stages:
+                return
+            self.stages.remove(stage)
+
+        shutil.rmtree(stage, ignore_errors=True)
+        self._usage = None
+
+    def clear(self, prefix=""):
+        """Remove all stages of this session, or which named with `prefix`
+        """
+        with self._lock:
+            stages = [stage for stage in self.stages
+                      if os.path.basename(stage).startswith(prefix)]
+
+        for stage in stages:
+            self.release(stage)
+
+    def usage(self, refresh=False):
+        """Return bytes used in stage root
+
+        Arguments:
+            refresh (bool, optional): Measure again even if the last
+                measurement is within `USAGE_TTL` seconds
+
+        """
+        now = time.time()
+        if (not refresh and self._usage is not None and
+                now - self._usage[0] < self.USAGE_TTL):
+            return self._usage[1]
+
+        usage = dir_size(self.root) if os.path.isdir(self.root) else 0
+        self._usage = (now, usage)
+        return usage
+
+    def _is_stale(self, session_dir):
+        try:
+            with open(os.path.join(session_dir, self.OWNER_FILE)) as fp:
+                owner = json.load(fp)
+        except (IOError, OSError, ValueError):
+            # Owner file not written or broken
+            created = os.path.getmtime(session_dir)
+            return time.time() - created > self.max_age
+
+        if owner["host"] == socket.gethostname():
+            return not is_process_alive(owner["pid"])
+
+        return time.time() - owner["created"] > self.max_age
+
+    def clean_stale(self):
+        """Remove sessions which owner process is gone or too old
+
+        Only session dirs in stage root are checked.
+
+        Returns:
+            list: Removed session dirs
+
+        """
+        if not os.path.isdir(self.root):
+            return []
+
+        removed = list()
+        for name in os.listdir(self.root):
+            session_dir = os.path.join(self.root, name)
+            if (not name.startswith(self.SESSION_PREFIX) or
+                    session_dir == self.session_dir or
+                    not os.path.isdir(session_dir)):
+                continue
+
+            if self._is_stale(session_dir):
+                log.info("Removing stale stages {!r}".format(session_dir))
+                shutil.rmtree(session_dir, ignore_errors=True)
+                removed.append(session_dir)
+                self._usage = None
+
+        return removed
+
+    def close(self):
+        """Remove all stages and the session dir"""
+        self.clear()
+        if self.session_dir is not None:
+            shutil.rmtree(self.session_dir, ignore_errors=True)
+            self.session_dir = None
+
+
+def get_staging_manager():
+    """Return the `StagingManager` of current session
+
+    Stale sessions are cleaned when the manager is created, and stages are
+    all removed on exit.
+
+    """
+    root = os.environ.get("REVERIES_STAGE_ROOT") or StagingManager.DEFAULT_ROOT
+    root = os.path.abspath(root)
+
+    if self._manager is None or self._manager.root != root:
+        max_mb = os.environ.get("REVERIES_STAGE_MAX_MB")
+        max_age = os.environ.get("REVERIES_STAGE_MAX_AGE")
+
+        manager = StagingManager(
+            root,
+            max_bytes=int(float(max_mb) * 1024 ** 2) if max_mb else None,
+            max_age=float(max_age) * 3600 if max_age else None)
+        manager.clean_stale()
+        atexit.register(manager.close)
+
+        self._manager = manager
+
+    return self._manager
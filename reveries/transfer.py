@@ -0,0 +1,461 @@
+"""Parallel file transfer for publishing
+"""
+import os
+import sys
+import time
+import errno
+import shutil
+import json
+import hashlib
+import logging
+import threading
+
+from .vendor import six
+from .vendor.six.moves import queue
+from .utils import _C4Hasher, hash_file, get_hash_cache
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+
+RENAME = "rename"
+REFLINK = "reflink"
+COPY = "copy"
+
+COPY_BUFFER = 1024 * 1024
+
+# Linux ioctl request code for cloning file content (copy-on-write)
+_FICLONE = 0x40049409
+
+
+def is_same_device(src, dst):
+    """Return True if `dst` is or would be on the same device as `src`
+
+    Arguments:
+        src (str): Existing path
+        dst (str): Path that may not exist yet, the nearest existing parent
+            will be checked.
+
+    """
+    dst = os.path.abspath(dst)
+    while not os.path.exists(dst):
+        parent = os.path.dirname(dst)
+        if parent == dst:
+            return False
+        dst = parent
+
+    return os.stat(src).st_dev == os.stat(dst).st_dev
+
+
+def reflink_file(src, dst):
+    """Clone file with copy-on-write, without copying data blocks
+
+    Only supported on Linux filesystems that implement `FICLONE`, like
+    Btrfs or XFS. `OSError` will be raised if not supported, and the
+    partially created `dst` will be removed.
+
+    Arguments:
+        src (str): Source file path
+        dst (str): Destination file path
+
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "Reflink not supported.")
+
+    try:
+        with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+            fcntl.ioctl(dst_f.fileno(), _FICLONE, src_f.fileno())
+    except (IOError, OSError) as e:
+        if os.path.isfile(dst):
+            os.remove(dst)
+        raise OSError(e.errno, "Reflink failed: %s" % e)
+
+    shutil.copystat(src, dst)
+
+
+def copy_file_hashed(src, dst, buffer_size=COPY_BUFFER, cache_path=None):
+    """Copy file and compute C4 ID of the content in the same read pass
+
+    The C4 ID of `dst` will also be saved into hash cache, so hashing the
+    copied file later does not need to read it again.
+
+    Arguments:
+        src (str): Source file path
+        dst (str): Destination file path
+        buffer_size (int, optional): Read/write buffer size
+        cache_path (str, optional): Path to save into hash cache, if `dst`
+            is a temporary name that will be renamed to. Default `dst`.
+
+    Returns:
+        str: C4 ID of the file content
+        int: File size
+
+    """
+    hash_obj = hashlib.sha512()
+    size = 0
+
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        for chunk in iter(lambda: src_f.read(buffer_size), b""):
+            hash_obj.update(chunk)
+            dst_f.write(chunk)
+            size += len(chunk)
+
+    shutil.copystat(src, dst)
+
+    c4id = _C4Hasher().encode(hash_obj.digest())
+
+    cache = get_hash_cache()
+    if cache is not None:
+        cache.set(cache_path or dst, c4id, os.stat(dst))
+
+    return c4id, size
+
+
+def replace_file(src, dst):
+    """Rename file `src` to `dst`, replace `dst` if exists
+
+    Renaming onto existing file fails on Windows, so `dst` will be removed
+    and renamed again in that case.
+
+    """
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.isfile(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def file_checksum(file_path):
+    """Return C4 ID and size of a file
+
+    For files that were not copied by `copy_file_hashed`, e.g. renamed or
+    hardlinked.
+
+    Arguments:
+        file_path (str): File path string
+
+    Returns:
+        str: C4 ID of the file content
+        int: File size
+
+    """
+    return hash_file(file_path), os.path.getsize(file_path)
+
+
+def verify_checksums(root, checksums, use_cache=True):
+    """Return files that do not match the checksums recorded on publish
+
+    Arguments:
+        root (str): Representation dir
+        checksums (list): Value of `representation["data"]["checksums"]`
+        use_cache (bool, optional): Look up the hash cache before reading
+            files, default is True.
+
+    Returns:
+        list: Relative path of missing or mismatched files
+
+    """
+    invalid = list()
+
+    for entry in checksums:
+        file_path = os.path.join(root, entry["file"])
+        if not os.path.isfile(file_path):
+            invalid.append(entry["file"])
+            continue
+
+        if (os.path.getsize(file_path) != entry["size"] or
+                hash_file(file_path, use_cache=use_cache) != entry["c4id"]):
+            invalid.append(entry["file"])
+
+    return invalid
+
+
+class TransferEngine(object):
+    """Run file transfer tasks on a bounded worker pool
+
+    Tasks are queued by `add` and run by `run`, which blocks until all
+    queued tasks are done. Tasks queued in one `run` have no order, call
+    `run` again for tasks that depend on previous ones.
+
+    Usage:
+        >> engine = TransferEngine(workers=8)
+        >> engine.add(shutil.copyfile, (src, dst), size=os.path.getsize(src))
+        >> engine.run()
+
+    Progress and throughput will be logged every `PROGRESS_INTERVAL`
+    seconds while running.
+
+    If any task failed, tasks that not yet started will be dropped, and the
+    first error will be re-raised after running tasks are finished.
+
+    Arguments:
+        workers (int, optional): Thread count, default is `WORKERS`
+        log (logging.Logger, optional): Logger for progress report
+
+    """
+
+    WORKERS = 8
+    PROGRESS_INTERVAL = 5  # seconds
+
+    def __init__(self, workers=None, log=None):
+        self.workers = workers or self.WORKERS
+        self.log = log or logging.getLogger(__name__)
+        self._tasks = list()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._done = 0
+        self._bytes = 0
+        self._exc_info = None
+
+    def add(self, func, args=(), size=0, callback=None):
+        """Queue a transfer task
+
+        Arguments:
+            func (callable): Transfer function
+            args (tuple, optional): Arguments for `func`
+            size (int, optional): Bytes that will be transferred, for
+                progress report
+            callback (callable, optional): Called with the return value of
+                `func` once it's done, in the worker thread, so callbacks
+                may run concurrently.
+
+        """
+        self._tasks.append((func, args, size, callback))
+
+    def run(self):
+        """Run all queued tasks and wait for them
+
+        Returns:
+            int: Done task count
+            int: Transferred bytes
+            float: Elapsed seconds
+
+        """
+        tasks, self._tasks = self._tasks, list()
+        if not tasks:
+            return 0, 0, 0.0
+
+        self._reset()
+        total = len(tasks)
+        total_bytes = sum(task[2] for task in tasks)
+
+        pending = queue.Queue()
+        for task in tasks:
+            pending.put(task)
+
+        threads = list()
+        for _ in range(min(self.workers, total)):
+            thread = threading.Thread(target=self._work, args=(pending,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        start = time.time()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(self.PROGRESS_INTERVAL)
+                if thread.is_alive():
+                    self._report(total, total_bytes, start)
+
+        elapsed = time.time() - start
+
+        if self._exc_info is not None:
+            self.log.error("Transfer failed, {0}/{1} done."
+                           "".format(self._done, total))
+            exc_info, self._exc_info = self._exc_info, None
+            six.reraise(*exc_info)
+
+        self._report(total, total_bytes, start)
+
+        return self._done, self._bytes, elapsed
+
+    def _work(self, pending):
+        while self._exc_info is None:
+            try:
+                func, args, size, callback = pending.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                result = func(*args)
+                if callback is not None:
+                    callback(result)
+                with self._lock:
+                    self._done += 1
+                    self._bytes += size
+            except Exception:
+                with self._lock:
+                    if self._exc_info is None:
+                        self._exc_info = sys.exc_info()
+                return
+
+    def _report(self, total, total_bytes, start):
+        elapsed = max(time.time() - start, 1e-6)
+        megabytes = self._bytes / 1024.0 / 1024.0
+        self.log.info("Transferred {0}/{1} files, {2:.1f}/{3:.1f} MB, "
+                      "{4:.1f} MB/s".format(self._done,
+                                            total,
+                                            megabytes,
+                                            total_bytes / 1024.0 / 1024.0,
+                                            megabytes / elapsed))
+
+
+class TransferJournal(object):
+    """Record of finished transfers in a version dir
+
+    Each finished transfer is appended to the journal file as one line of
+    JSON, so the journal stays readable if the process died halfway. On
+    retry, transfers that have been recorded can be skipped.
+
+    File records are buffered and synced to disk in batches of
+    `FLUSH_COUNT`, package records and `flush` sync them immediately. File
+    records that were lost only make those files transferred again.
+
+    Recorded paths are relative to the version dir, so the journal can be
+    resumed on machines that mount the publish root differently.
+
+    Arguments:
+        version_dir (str): Version dir path
+
+    """
+
+    FILE_NAME = ".transfer.journal"
+    PARTIAL_SUFFIX = ".partial"
+    FLUSH_COUNT = 256
+
+    def __init__(self, version_dir):
+        self.version_dir = version_dir
+        self.path = os.path.join(version_dir, self.FILE_NAME)
+        self._files = dict()
+        self._packages = dict()
+        self._pending = list()
+        self._lock = threading.Lock()
+        self._broken_line = False
+        self._load()
+
+    @classmethod
+    def partial_name(cls, path):
+        """Return hidden dir name for transferring into `path`"""
+        return "." + os.path.basename(path) + cls.PARTIAL_SUFFIX
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, "r") as journal:
+            for line in journal:
+                self._broken_line = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Incomplete last line
+                    continue
+
+                if "package" in entry:
+                    if entry["method"] is None:
+                        # Discarded
+                        self._packages.pop(entry["package"], None)
+                    else:
+                        self._packages[entry["package"]] = entry
+                else:
+                    self._files[entry["file"]] = entry
+
+    def _relpath(self, path):
+        path = os.path.relpath(path, self.version_dir)
+        if path.startswith(os.pardir):
+            return None
+        return path.replace("\\", "/")
+
+    def _append(self, entry, flush=False):
+        with self._lock:
+            self._pending.append(json.dumps(entry) + "\n")
+            if flush or len(self._pending) >= self.FLUSH_COUNT:
+                self._write()
+
+    def _write(self):
+        if not self._pending:
+            return
+
+        with open(self.path, "a") as journal:
+            if self._broken_line:
+                journal.write("\n")
+                self._broken_line = False
+            journal.writelines(self._pending)
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        self._pending = list()
+
+    def flush(self):
+        """Write buffered records and sync the journal file to disk"""
+        with self._lock:
+            self._write()
+
+    def record_file(self, path, c4id, size):
+        """Record a transferred file and it's checksum
+
+        Files that are not in version dir will not be recorded.
+
+        """
+        rel_path = self._relpath(path)
+        if rel_path is None:
+            return
+
+        entry = {"file": rel_path, "c4id": c4id, "size": size}
+        self._append(entry)
+        self._files[rel_path] = entry
+
+    def record_package(self, package, method):
+        """Record a package that has been completely transferred"""
+        entry = {"package": package, "method": method}
+        self._append(entry, flush=True)
+        self._packages[package] = entry
+
+    def discard_package(self, package):
+        """Record a package that was recorded but not transferred"""
+        entry = {"package": package, "method": None}
+        self._append(entry, flush=True)
+        self._packages.pop(package, None)
+
+    def get_file(self, path, check_path=None):
+        """Return C4 ID and size of a recorded file, or `None`
+
+        The file is recorded only if it is in the journal and the file
+        exists with the recorded size.
+
+        Arguments:
+            path (str): Destination path of the transfer
+            check_path (str, optional): Path to check the existence and size
+                instead of `path`, e.g. a temporary name.
+
+        """
+        rel_path = self._relpath(path)
+        entry = self._files.get(rel_path)
+        if entry is None:
+            return None
+
+        check_path = check_path or path
+        if (not os.path.isfile(check_path) or
+                os.path.getsize(check_path) != entry["size"]):
+            return None
+
+        return entry["c4id"], entry["size"]
+
+    def has_package(self, package):
+        return package in self._packages
+
+    def packages(self):
+        """Return names of recorded packages"""
+        return list(self._packages)
+
+    def remove(self):
+        """Remove journal file, after the version is published"""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
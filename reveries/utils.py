@@ -1,59 +1,67 @@
 
 import os
-import tempfile
+import sys
+import time
+import logging
 import hashlib
 import codecs
-import shutil
+import mmap
+import sqlite3
 import weakref
 import getpass
+import threading
+import bisect
 import pymongo
 
-from distutils.dir_util import copy_tree
+from multiprocessing.pool import ThreadPool
 
 from avalon import io, Session
+from avalon.vendor import filelink
 
 import pyblish.api
+import pyblish.plugin
+import pyblish.logic
 import avalon
 from pyblish_qml.ipc import formatting
 
+from .vendor import six
+from .staging import get_staging_manager
+
+
+self = sys.modules[__name__]
+self._hash_cache = None
+self._plugin_discovery = None
+
+log = logging.getLogger(__name__)
+
 
 def temp_dir(prefix="pyblish_tmp_"):
     """Provide a temporary directory for staging
 
-    This temporary directory is generated through `tempfile.mkdtemp()`
+    This temporary directory is created and registered by current session's
+    `StagingManager`, see `reveries.staging`.
 
     Arguments:
         prefix (str, optional): Prefix name of the temporary directory
 
     """
-    return tempfile.mkdtemp(prefix=prefix)
+    return get_staging_manager().create(prefix)
 
 
 def clear_stage(prefix="pyblish_tmp_"):
     """Remove temporary staging directory with prefix
 
-    Remove temporary directory which named with prefix in
-    `tempfile.gettempdir()`
+    Remove current session's staging directories which named with prefix,
+    and stale sessions' left by crashed processes. Only the stage root is
+    scanned.
 
     Arguments:
         prefix (str, optional): Prefix name of the temporary directory
 
     """
-    tempdir = tempfile.gettempdir()
-    cwd_backup = os.getcwd()
-
-    os.chdir(tempdir)
-    for item in os.listdir(tempdir):
-        if not (os.path.isdir(item) and item.startswith(prefix)):
-            continue
-
-        # Remove
-        full_path = os.path.join(tempdir, item)
-        print("Removing {!r}".format(full_path))
-        shutil.rmtree(full_path)
-        print("Removed.")
-
-    os.chdir(cwd_backup)
+    manager = get_staging_manager()
+    manager.clear(prefix)
+    manager.clean_stale()
 
 
 def get_timeline_data(project=None, asset_name=None):
@@ -209,12 +217,91 @@ def publish_results_formatting(context):
     return formatted
 
 
-def hash_file(file_path):
-    hasher = AssetHasher()
+def hash_file(file_path, use_cache=True):
+    """Return C4 ID of a file
+
+    Arguments:
+        file_path (str): File path string
+        use_cache (bool, optional): Look up the hash cache before reading
+            the file, default is True. See `get_hash_cache`.
+
+    """
+    hasher = AssetHasher(use_cache=use_cache)
     hasher.add_file(file_path)
     return hasher.digest()
 
 
+def hash_files(file_paths, workers=None, use_cache=True):
+    """Return C4 ID of each file and of all files, hash in parallel
+
+    The C4 ID of all files is the same no matter which file has been hashed
+    first.
+
+    Arguments:
+        file_paths (list): A list of file path string
+        workers (int, optional): Thread count, default `AssetHasher.WORKERS`
+        use_cache (bool, optional): Look up the hash cache before reading
+            the file, default is True. See `get_hash_cache`.
+
+    Returns:
+        dict: C4 ID of each file path
+        str: C4 ID of all files
+
+    """
+    hasher = AssetHasher(use_cache=use_cache, workers=workers)
+    file_ids = hasher.add_files(file_paths)
+    return file_ids, hasher.digest()
+
+
+def quick_hash_file(file_path, block_size=1024 * 1024):
+    """Return a quick fingerprint of a file in C4 ID format
+
+    Instead of reading the whole file, only file size, modified time and the
+    head, middle and tail blocks of the file are hashed. This is good for
+    telling whether a huge file has changed, but not a content hash.
+
+    Arguments:
+        file_path (str): File path string
+        block_size (int, optional): Size of each sampled block, default 1MB
+
+    """
+    stat = os.stat(file_path)
+    size = stat.st_size
+
+    hasher = _C4Hasher()
+    # Only in seconds, the precision of mtime may vary between platforms
+    hasher.hash_obj.update(_to_bytes("%d:%d" % (size, int(stat.st_mtime))))
+
+    with open(file_path, "rb") as file:
+        for offset in sorted({0,
+                              max(0, (size - block_size) // 2),
+                              max(0, size - block_size)}):
+            file.seek(offset)
+            hasher.hash_obj.update(file.read(block_size))
+
+    return hasher.digest()
+
+
+def get_hash_cache():
+    """Return the shared `HashCache` of current session
+
+    The cache file is located by environment variable `REVERIES_HASH_CACHE`,
+    or `~/.reveries/hashcache.db` if not set.
+
+    Set environment variable `REVERIES_NO_HASH_CACHE` to disable the cache,
+    e.g. for auditing published files, `None` will be returned in that case.
+
+    """
+    if os.environ.get("REVERIES_NO_HASH_CACHE"):
+        return None
+
+    path = os.environ.get("REVERIES_HASH_CACHE") or HashCache.DEFAULT_PATH
+    if self._hash_cache is None or self._hash_cache.path != path:
+        self._hash_cache = HashCache(path)
+
+    return self._hash_cache
+
+
 def plugins_by_range(base=1.5, offset=2, paths=None):
     """Find plugins by thier order which fits in range
 
@@ -236,19 +323,374 @@ def plugins_by_range(base=1.5, offset=2, paths=None):
 
     plugins = list()
 
-    for plugin in pyblish.api.discover(paths=paths):
-        if ("order" in plugin.__dict__ and
-                _min <= plugin.order < _max):
-
+    for plugin in discover_plugins(paths).by_range(_min, _max):
+        if "order" in plugin.__dict__:
             plugins.append(plugin)
 
     return plugins
 
 
+def discover_plugins(paths=None):
+    """Return `PluginDiscovery` of current plugin paths and registrations
+
+    Plugins are discovered by `pyblish.api.discover` only when the plugin
+    files, registered hosts, plugins or discovery filters changed.
+
+    Set environment variable `REVERIES_NO_PLUGIN_CACHE` to discover every
+    time.
+
+    Arguments:
+        paths (list, optional): Paths to discover plug-ins from, default
+            all registered paths.
+
+    """
+    signature = PluginDiscovery.signature(paths)
+
+    if (os.environ.get("REVERIES_NO_PLUGIN_CACHE") or
+            self._plugin_discovery is None or
+            self._plugin_discovery.key != signature):
+        self._plugin_discovery = PluginDiscovery(paths, signature)
+
+    return self._plugin_discovery
+
+
+class PluginDiscovery(object):
+    """Discovered pyblish plugins with order and family indexes
+
+    Usage:
+        >> discovery = discover_plugins()
+        >> pyblish.util.collect(context, plugins=discovery.plugins())
+        >> discovery.by_range(0.5, 1.5)  # Validators
+        >> discovery.by_families(["reveries.model"])
+
+    Arguments:
+        paths (list, optional): Paths to discover plug-ins from
+        key (tuple, optional): Signature of discovery, see `signature`
+
+    """
+
+    def __init__(self, paths=None, key=None):
+        self.key = key
+        self._plugins = sorted(pyblish.api.discover(paths=paths),
+                               key=lambda plugin: plugin.order)
+        self._orders = [plugin.order for plugin in self._plugins]
+        self._by_families = dict()
+
+    @classmethod
+    def signature(cls, paths=None):
+        """Return key that changes if discovery result may change
+
+        The key consists of modified time and size of plugin files in
+        `paths`, registered hosts, plugins and discovery filters.
+
+        """
+        files = list()
+        for path in paths or pyblish.plugin.plugin_paths():
+            path = os.path.normpath(path)
+            if not os.path.isdir(path):
+                continue
+
+            for fname in sorted(os.listdir(path)):
+                if not fname.endswith(".py") or fname.startswith("_"):
+                    continue
+                stat = os.stat(os.path.join(path, fname))
+                files.append((path, fname, stat.st_mtime, stat.st_size))
+
+        return (tuple(files),
+                tuple(pyblish.api.registered_hosts()),
+                tuple(id(plugin) for plugin in
+                      pyblish.api.registered_plugins()),
+                tuple(id(filter_) for filter_ in
+                      pyblish.api.registered_discovery_filters()))
+
+    def plugins(self):
+        """Return all plugins, sorted by order"""
+        return list(self._plugins)
+
+    def by_range(self, min_order, max_order):
+        """Return plugins which `min_order <= order < max_order`"""
+        start = bisect.bisect_left(self._orders, min_order)
+        end = bisect.bisect_left(self._orders, max_order)
+        return self._plugins[start:end]
+
+    def by_families(self, families):
+        """Return plugins compatible with `families`, sorted by order"""
+        key = tuple(sorted(families))
+        if key not in self._by_families:
+            self._by_families[key] = pyblish.logic.plugins_by_families(
+                self._plugins, list(key))
+        return list(self._by_families[key])
+
+
+class HashCache(object):
+    """On-disk cache of file and directory C4 IDs
+
+    Each file entry is keyed by file path, and only valid when file size,
+    modified time and inode are all the same as the time it was hashed.
+
+    Each directory entry is keyed by directory path, and only valid when the
+    signature (stats of files and digests of sub-dirs in it) is the same.
+
+    Least recently used entries will be evicted once the entry count of each
+    kind exceeds `max_entries`.
+
+    Any database error will be logged and treated as a cache miss, so the
+    cache never fails the hashing.
+
+    Arguments:
+        path (str): Cache database file path
+        max_entries (int, optional): Size cap of the cache, default is
+            `MAX_ENTRIES`
+
+    """
+
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"),
+                                ".reveries",
+                                "hashcache.db")
+    MAX_ENTRIES = 200000
+    EVICT_INTERVAL = 1000  # Check size cap every N insertion
+    TOUCH_INTERVAL = 100  # Write access time of hit entries every N hits
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self._lock = threading.Lock()
+        self._inserted = 0
+        self._touched = {"hashes": dict(), "dirs": dict()}
+        self._hits = 0
+        self._conn = None
+
+        try:
+            self._connect()
+        except (sqlite3.Error, OSError) as e:
+            log.warning("Hash cache unavailable: {}".format(e))
+            self._conn = None
+
+    def _connect(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self._conn = sqlite3.connect(self.path,
+                                     timeout=10,
+                                     check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS hashes ("
+                           "path TEXT PRIMARY KEY, "
+                           "size INTEGER, "
+                           "mtime REAL, "
+                           "inode INTEGER, "
+                           "c4id TEXT, "
+                           "atime REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS hashes_atime "
+                           "ON hashes (atime)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dirs ("
+                           "path TEXT PRIMARY KEY, "
+                           "signature TEXT, "
+                           "c4id TEXT, "
+                           "atime REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dirs_atime "
+                           "ON dirs (atime)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.normcase(os.path.abspath(file_path))
+
+    def _touch(self, table, key):
+        # Access time of hits are written in batch, with lock acquired
+        self._touched[table][key] = time.time()
+        self._hits += 1
+        if self._hits >= self.TOUCH_INTERVAL:
+            self._write_touched()
+            self._conn.commit()
+
+    def _write_touched(self):
+        # Uncommitted, with lock acquired
+        for table, touched in self._touched.items():
+            if touched:
+                self._conn.executemany(
+                    "UPDATE %s SET atime=? WHERE path=?" % table,
+                    [(atime, key) for key, atime in touched.items()]
+                )
+                touched.clear()
+        self._hits = 0
+
+    def get(self, file_path, stat=None):
+        """Return cached C4 ID of the file, or `None` if missed
+
+        Arguments:
+            file_path (str): File path string
+            stat (os.stat_result, optional): File stat, query if not provided
+
+        """
+        if self._conn is None:
+            return None
+
+        stat = stat or os.stat(file_path)
+        key = self._key(file_path)
+
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT c4id FROM hashes WHERE "
+                    "path=? AND size=? AND mtime=? AND inode=?",
+                    (key, stat.st_size, stat.st_mtime, stat.st_ino)
+                ).fetchone()
+                if row is None:
+                    return None
+
+                self._touch("hashes", key)
+
+            except sqlite3.Error as e:
+                log.warning("Hash cache read failed: {}".format(e))
+                return None
+
+        return row[0]
+
+    def set(self, file_path, c4id, stat):
+        """Save C4 ID of the file
+
+        Arguments:
+            file_path (str): File path string
+            c4id (str): C4 ID of the file
+            stat (os.stat_result): File stat at the time before it's hashed
+
+        """
+        if self._conn is None:
+            return
+
+        with self._lock:
+            try:
+                self._write_touched()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                    (self._key(file_path),
+                     stat.st_size,
+                     stat.st_mtime,
+                     stat.st_ino,
+                     c4id,
+                     time.time())
+                )
+                self._conn.commit()
+
+            except sqlite3.Error as e:
+                log.warning("Hash cache write failed: {}".format(e))
+                return
+
+            self._inserted += 1
+
+        if self._inserted % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def get_dir(self, dir_path, signature):
+        """Return cached C4 ID of the directory, or `None` if missed
+
+        Arguments:
+            dir_path (str): Directory path string
+            signature (str): Directory content signature
+
+        """
+        if self._conn is None:
+            return None
+
+        key = self._key(dir_path)
+
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT c4id FROM dirs WHERE path=? AND signature=?",
+                    (key, signature)
+                ).fetchone()
+                if row is None:
+                    return None
+
+                self._touch("dirs", key)
+
+            except sqlite3.Error as e:
+                log.warning("Hash cache read failed: {}".format(e))
+                return None
+
+        return row[0]
+
+    def set_dir(self, dir_path, signature, c4id):
+        """Save C4 ID of the directory
+
+        Arguments:
+            dir_path (str): Directory path string
+            signature (str): Directory content signature
+            c4id (str): C4 ID of the directory
+
+        """
+        if self._conn is None:
+            return
+
+        with self._lock:
+            try:
+                self._write_touched()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                    (self._key(dir_path), signature, c4id, time.time())
+                )
+                self._conn.commit()
+
+            except sqlite3.Error as e:
+                log.warning("Hash cache write failed: {}".format(e))
+
+    def evict(self):
+        """Remove least recently used entries which exceeded size cap"""
+        if self._conn is None:
+            return
+
+        with self._lock:
+            try:
+                self._write_touched()
+                for table in ("hashes", "dirs"):
+                    count = self._conn.execute(
+                        "SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+                    exceeded = count - self.max_entries
+                    if exceeded > 0:
+                        self._conn.execute(
+                            "DELETE FROM {0} WHERE path IN (SELECT path "
+                            "FROM {0} ORDER BY atime LIMIT ?)".format(table),
+                            (exceeded,)
+                        )
+                self._conn.commit()
+
+            except sqlite3.Error as e:
+                log.warning("Hash cache eviction failed: {}".format(e))
+
+    def clear(self):
+        """Remove all entries"""
+        if self._conn is None:
+            return
+
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM hashes")
+                self._conn.execute("DELETE FROM dirs")
+                self._conn.commit()
+
+            except sqlite3.Error as e:
+                log.warning("Hash cache clear failed: {}".format(e))
+                return
+
+            for touched in self._touched.values():
+                touched.clear()
+            self._hits = 0
+
+
+def _to_bytes(string):
+    if not isinstance(string, bytes):
+        string = string.encode("utf-8")
+    return string
+
+
 class _C4Hasher(object):
 
     CHUNK_SIZE = 4096 * 10  # magic number
     PREFIX = "c4"
+    B58CHARS = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
 
     def __init__(self):
         self.hash_obj = None
@@ -262,7 +704,7 @@ class _C4Hasher(object):
     def _b58encode(self, bytes):
         """Base58 Encode bytes to string
         """
-        b58chars = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+        b58chars = self.B58CHARS
         b58base = 58
 
         long_value = int(codecs.encode(bytes, "hex_codec"), 16)
@@ -277,11 +719,23 @@ class _C4Hasher(object):
 
         return result
 
-    def digest(self):
-        """Return hash value of data added so far
+    def _b58decode(self, string):
+        """Base58 Decode string to SHA-512 digest bytes
+        """
+        b58chars = self.B58CHARS
+        b58base = 58
+
+        long_value = 0
+        for char in string:
+            long_value = long_value * b58base + b58chars.index(char)
+
+        return codecs.decode("%0128x" % long_value, "hex_codec")
+
+    def encode(self, raw_digest):
+        """Encode SHA-512 digest bytes into C4 ID
         """
         c4_id_length = 90
-        b58_hash = self._b58encode(self.hash_obj.digest())
+        b58_hash = self._b58encode(raw_digest)
 
         padding = ""
         if len(b58_hash) < (c4_id_length - 2):
@@ -290,6 +744,16 @@ class _C4Hasher(object):
         c4id = self.PREFIX + padding + b58_hash
         return c4id
 
+    def decode(self, c4id):
+        """Decode C4 ID into SHA-512 digest bytes
+        """
+        return self._b58decode(c4id[len(self.PREFIX):])
+
+    def digest(self):
+        """Return hash value of data added so far
+        """
+        return self.encode(self.hash_obj.digest())
+
 
 class AssetHasher(_C4Hasher):
     """A data hasher for digital content creation
@@ -316,8 +780,63 @@ class AssetHasher(_C4Hasher):
         Until you call `clear`
         >> hasher.clear()
 
+    Each file is hashed on its own, and the hash value of multiple files is
+    the C4 ID of those file IDs, which is order independent. Hash value of
+    one single file is the C4 ID of that file.
+
+    File IDs are looked up from the hash cache before reading the file,
+    unless `use_cache` is False or the cache is disabled. See
+    `get_hash_cache`.
+
+    How file been read can be chosen by `read_mode`:
+
+        * `READ_CHUNK`: Read in fixed size chunks of `CHUNK_SIZE`.
+
+        * `READ_ADAPTIVE`: Read into a reused buffer, which size is chosen
+          by file size, between `MIN_BUFFER` and `MAX_BUFFER`. Much less
+          read calls on large files.
+
+        * `READ_MMAP`: Memory map the file and hash it without copying.
+          Files smaller than `MMAP_MIN_SIZE` are read as `READ_ADAPTIVE`.
+
+    Arguments:
+        use_cache (bool, optional): Use hash cache, default is True
+        workers (int, optional): Thread count for hashing multiple files,
+            default is `WORKERS`
+        read_mode (str, optional): File reading mode, default is `READ_MODE`
+
     """
 
+    WORKERS = 8
+
+    READ_CHUNK = "chunk"
+    READ_ADAPTIVE = "adaptive"
+    READ_MMAP = "mmap"
+    READ_MODE = READ_ADAPTIVE
+
+    MIN_BUFFER = 1024 * 64
+    MAX_BUFFER = 1024 * 1024 * 16
+    MMAP_MIN_SIZE = 1024 * 1024
+
+    def __init__(self, use_cache=True, workers=None, read_mode=None):
+        self.use_cache = use_cache
+        self.workers = workers or self.WORKERS
+        self.read_mode = read_mode or self.READ_MODE
+        self._digests = None
+
+        if self.read_mode not in (self.READ_CHUNK,
+                                  self.READ_ADAPTIVE,
+                                  self.READ_MMAP):
+            raise ValueError("Unknown read mode: {!r}".format(read_mode))
+
+        super(AssetHasher, self).__init__()
+
+    def clear(self):
+        """Start a new hash session
+        """
+        super(AssetHasher, self).clear()
+        self._digests = list()
+
     def add_file(self, file_path):
         """Add one file to hasher
 
@@ -325,15 +844,117 @@ class AssetHasher(_C4Hasher):
             file_path (str): File path string
 
         """
-        chunk_size = self.CHUNK_SIZE
+        self._digests.append(self._hash_file(file_path))
+
+    def add_files(self, file_paths):
+        """Add multiple files to hasher, hash them in parallel
+
+        Files are hashed in a thread pool with `workers` threads, the hash
+        value is the same as adding them one by one.
+
+        Arguments:
+            file_paths (list): A list of file path string
+
+        Returns:
+            dict: C4 ID of each file path
+
+        """
+        digests = self._hash_files(file_paths)
+        self._digests += list(digests.values())
+
+        return {path: self.encode(digest) for path, digest in digests.items()}
+
+    def _hash_files(self, file_paths):
+        """Return SHA-512 digest bytes of each file, hash in parallel
+        """
+        file_paths = list(set(file_paths))
+
+        if self.workers <= 1 or len(file_paths) <= 1:
+            digests = [self._hash_file(path) for path in file_paths]
+        else:
+            # `hashlib` releases GIL while hashing large data, so threads
+            # are good enough for overlapping I/O and hashing.
+            pool = ThreadPool(min(self.workers, len(file_paths)))
+            try:
+                digests = pool.map(self._hash_file, file_paths)
+            finally:
+                pool.close()
+                pool.join()
+
+        return dict(zip(file_paths, digests))
+
+    def _hash_file(self, file_path):
+        """Return SHA-512 digest bytes of a file, from cache if possible
+        """
+        cache = get_hash_cache() if self.use_cache else None
+        stat = os.stat(file_path)
+
+        if cache is not None:
+            c4id = cache.get(file_path, stat)
+            if c4id is not None:
+                return self.decode(c4id)
+
+        hash_obj = hashlib.sha512()
 
         with open(file_path, "rb") as file:
-            for chunk in iter(lambda: file.read(chunk_size), b""):
-                self.hash_obj.update(chunk)
+            if self.read_mode == self.READ_CHUNK:
+                self._read_chunk(file, hash_obj)
+
+            elif (self.read_mode == self.READ_MMAP and
+                    stat.st_size >= self.MMAP_MIN_SIZE):
+                self._read_mmap(file, hash_obj)
+
+            else:
+                self._read_adaptive(file, hash_obj, stat.st_size)
+
+        raw_digest = hash_obj.digest()
+
+        if cache is not None:
+            after = os.stat(file_path)
+            if (after.st_size, after.st_mtime) == (stat.st_size,
+                                                   stat.st_mtime):
+                # Only cache if the file did not change while hashing
+                cache.set(file_path, self.encode(raw_digest), stat)
+
+        return raw_digest
+
+    def _read_chunk(self, file, hash_obj):
+        chunk_size = self.CHUNK_SIZE
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            hash_obj.update(chunk)
+
+    def _read_adaptive(self, file, hash_obj, file_size):
+        buffer_size = min(max(file_size // 64, self.MIN_BUFFER),
+                          self.MAX_BUFFER)
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            hash_obj.update(view[:size])
+
+    def _read_mmap(self, file, hash_obj):
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            hash_obj.update(mapped)
+        finally:
+            mapped.close()
 
     def add_dir(self, dir_path, recursive=True, followlinks=True):
         """Add one directory to hasher
 
+        The directory is hashed as a Merkle tree, each file is read once in
+        sorted order, and each sub-dir gets it's own digest which composed
+        from the names and digests of it's entries. So the hash value changes
+        when any file been renamed, moved or modified, but not depends on the
+        order of file system listing.
+
+        Sub-dir digest is reused from the hash cache if none of the files in
+        that sub-dir changed, and the rest of the files are hashed in
+        parallel.
+
         Arguments:
             dir_path (str): Directory path string
             recursive (bool, optional): Add sub-dir as well, default is True
@@ -341,16 +962,218 @@ class AssetHasher(_C4Hasher):
                 symlinks, default is True
 
         """
-        for root, dirs, files in os.walk(dir_path, followlinks=followlinks):
-            for name in files:
-                self.add_file(os.path.join(root, name))
+        cache = get_hash_cache() if self.use_cache else None
 
-            if not recursive:
-                continue
+        tree = self._scan_dir(dir_path, recursive, followlinks, set())
+        file_paths = self._resolve_dir(tree, cache)
+        file_digests = self._hash_files(file_paths)
+
+        self._digests.append(self._compose_dir(tree, cache, file_digests))
+
+    def _scan_dir(self, dir_path, recursive, followlinks, visited):
+        """Collect directory tree with content signature of each directory
+
+        The signature is composed from names and stats of the files, and
+        names and signatures of the sub-dirs, so no file will be read here.
+
+        """
+        # Avoid infinite loop that caused by symlinks
+        visited.add(os.path.realpath(dir_path))
+
+        node = {"path": dir_path, "files": [], "dirs": [], "digest": None}
+        signer = hashlib.sha1()
+
+        for name in sorted(os.listdir(dir_path)):
+            path = os.path.join(dir_path, name)
+            if os.path.isdir(path):
+                if not recursive:
+                    continue
+                if os.path.islink(path) and not followlinks:
+                    continue
+                if os.path.realpath(path) in visited:
+                    continue
+
+                child = self._scan_dir(path, recursive, followlinks, visited)
+                node["dirs"].append((name, child))
+                signer.update(_to_bytes("d\0%s\0%s\0" % (
+                    name, child["signature"])))
+            else:
+                stat = os.stat(path)
+                node["files"].append(name)
+                signer.update(_to_bytes("f\0%s\0%d\0%r\0%d\0" % (
+                    name, stat.st_size, stat.st_mtime, stat.st_ino)))
+
+        node["signature"] = signer.hexdigest()
+
+        return node
+
+    def _resolve_dir(self, node, cache):
+        """Get directory digests from cache, return files that need hashing
+        """
+        if cache is not None:
+            c4id = cache.get_dir(node["path"], node["signature"])
+            if c4id is not None:
+                node["digest"] = self.decode(c4id)
+                return []
+
+        file_paths = [os.path.join(node["path"], name)
+                      for name in node["files"]]
+        for _, child in node["dirs"]:
+            file_paths += self._resolve_dir(child, cache)
 
-            for name in dirs:
-                path = os.path.join(root, name)
-                self.add_dir(path, recursive=True, followlinks=followlinks)
+        return file_paths
+
+    def _compose_dir(self, node, cache, file_digests):
+        """Return SHA-512 digest bytes of a directory tree node
+        """
+        if node["digest"] is not None:
+            return node["digest"]
+
+        entries = list()
+        for name in node["files"]:
+            digest = file_digests[os.path.join(node["path"], name)]
+            entries.append((_to_bytes(name), b"f", digest))
+        for name, child in node["dirs"]:
+            digest = self._compose_dir(child, cache, file_digests)
+            entries.append((_to_bytes(name), b"d", digest))
+
+        hash_obj = hashlib.sha512()
+        for name, kind, digest in sorted(entries):
+            hash_obj.update(name + b"\0" + kind + digest)
+
+        node["digest"] = hash_obj.digest()
+
+        if cache is not None:
+            cache.set_dir(node["path"],
+                          node["signature"],
+                          self.encode(node["digest"]))
+
+        return node["digest"]
+
+    def digest(self):
+        """Return hash value of files added so far
+        """
+        if not self._digests:
+            return self.encode(self.hash_obj.digest())
+
+        # C4 ID of IDs, pair up sorted digests level by level until one left
+        digests = sorted(self._digests)
+        while len(digests) > 1:
+            paired = list()
+            for left, right in zip(digests[::2], digests[1::2]):
+                if left == right:
+                    paired.append(left)
+                else:
+                    paired.append(hashlib.sha512(left + right).digest())
+
+            if len(digests) % 2:
+                paired.append(digests[-1])
+
+            digests = paired
+
+        return self.encode(digests[0])
+
+
+class BackgroundHasher(object):
+    """Hash a file or directory with `AssetHasher` in a background thread
+
+    Usage:
+        >> job = BackgroundHasher("/path/to/file")
+        >> job.add_done_callback(on_hashed)
+        >> job.start()
+
+        Do other things, then wait for the hash value
+        >> job.wait()
+        'c463d2Wh5NyBMQRHyxbdBxCzZfaKXvBQaawgfgG18moxQU2jdmaSbCWL...'
+
+    Callbacks are called in the background thread with the hash value, or
+    immediately if the job is already done. `wait` returns after all
+    callbacks that added before the job is done have been called, and
+    re-raise the error if hashing failed.
+
+    Arguments:
+        path (str): File or directory path string
+        **kwargs: Keyword arguments for `AssetHasher`
+
+    """
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self._kwargs = kwargs
+        self._result = None
+        self._exc_info = None
+        self._finished = False
+        self._callbacks = list()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            hasher = AssetHasher(**self._kwargs)
+            if os.path.isdir(self.path):
+                hasher.add_dir(self.path)
+            else:
+                hasher.add_file(self.path)
+            self._result = hasher.digest()
+
+        except Exception:
+            self._exc_info = sys.exc_info()
+            log.error("Hashing failed: {}".format(self.path))
+
+        with self._lock:
+            self._finished = True
+            callbacks = list(self._callbacks)
+
+        if self._exc_info is None:
+            for callback in callbacks:
+                self._call(callback)
+
+        self._done.set()
+
+    def _call(self, callback):
+        try:
+            callback(self._result)
+        except Exception:
+            log.exception("Hash callback failed.")
+
+    def add_done_callback(self, callback):
+        """Add function to be called with the hash value once it's done
+
+        Arguments:
+            callback (callable): Function that takes the hash value
+
+        """
+        with self._lock:
+            if not self._finished:
+                self._callbacks.append(callback)
+                return
+
+        if self._exc_info is None:
+            self._call(callback)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until hashed and return the hash value
+
+        Arguments:
+            timeout (float, optional): Seconds to wait, wait forever if
+                not provided
+
+        """
+        if not self._done.wait(timeout) and not self._done.is_set():
+            raise RuntimeError("Hashing timeout: {}".format(self.path))
+
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+
+        return self._result
 
 
 def get_representation_path_(representation, parents):
@@ -398,36 +1221,80 @@ class AssetGraber(object):
     This is used for copying asset representation and all it's dependency
     assets from current project to another project.
 
+    Grabbing is done in two phases. First the full closure of documents is
+    planned with batched queries, each document visited once, then missing
+    documents are inserted at once after package files are transferred in
+    parallel.
+
     Example:
         >>> # Init with the name of the destination project
         >>> graber = AssetGraber("other_project")
         >>> # Input representation ID
         >>> graber.grab("5c6159dbed9f0d0509a34e27")
-        >>> # Grab another...
-        >>> graber.grab("5c6159dbed9f0d0509a34e38")
+        >>> # Grab more at once...
+        >>> graber.grab(["5c6159dbed9f0d0509a34e38",
+        ...              "5c6159dbed9f0d0509a34e49"])
+        >>> # Only report what will be copied
+        >>> plan = graber.grab("5c6159dbed9f0d0509a34e27", dry_run=True)
+
+    Args:
+        project (str): Destination project name
+        hardlink (bool, optional): Hardlink package files instead of copying
+            if on the same device, default False
+        workers (int, optional): File transfer thread count
 
     """
 
-    def __init__(self, project):
+    # Documents are inserted parents first
+    TYPE_ORDER = ["asset", "subset", "version", "representation"]
+
+    def __init__(self, project, hardlink=False, workers=None):
         self.project = project
+        self.hardlink = hardlink
+        self.workers = workers
         self._project = None
         self._mongo_client = None
         self._database = None
         self._collection = None
         self._connected = False
 
-    def grab(self, representation_id):
+    def grab(self, representation_id, dry_run=False):
         """Copy representation to project
 
         Args:
-            representation_id (str or ObjectId): representation id
+            representation_id (str, ObjectId or list): representation id,
+                or a list of them
+            dry_run (bool, optional): Only plan and log the summary
+
+        Returns:
+            dict: The plan, see `plan`
 
         """
         if not self._connected:
             self._connect()
-        if isinstance(representation_id, str):
-            representation_id = io.ObjectId(representation_id)
-        self._copy_representations(representation_id)
+
+        if isinstance(representation_id, (list, tuple, set)):
+            representation_ids = list(representation_id)
+        else:
+            representation_ids = [representation_id]
+
+        representation_ids = [io.ObjectId(_id)
+                              if isinstance(_id, six.string_types) else _id
+                              for _id in representation_ids]
+
+        plan = self.plan(representation_ids)
+
+        megabytes = plan["bytes"] / 1024.0 / 1024.0
+        log.info("Grabbing into {0!r}: {1} documents to insert, {2} packages, "
+                 "{3} files, {4:.1f} MB".format(self.project,
+                                                len(plan["documents"]),
+                                                len(plan["packages"]),
+                                                len(plan["files"]),
+                                                megabytes))
+        if not dry_run:
+            self.execute(plan)
+
+        return plan
 
     def _connect(self):
         timeout = int(Session["AVALON_TIMEOUT"])
@@ -437,94 +1304,230 @@ class AssetGraber(object):
         self._collection = self._database[self.project]
         self._connected = True
 
-        self._project = self._find_one({"type": "project"})
-
-    def _insert_one(self, item):
-        assert isinstance(item, dict), "item must be of type <dict>"
-        return self._collection.insert_one(item)
-
-    def _find_one(self, filter, projection=None, sort=None):
-        assert isinstance(filter, dict), "filter must be <dict>"
-        return self._collection.find_one(
-            filter=filter,
-            projection=projection,
-            sort=sort
-        )
-
-    def _copy_representations(self, representation_id):
-        """Copy all documents and files of representation and dependencies"""
-        # Representation
-        representation = self._find_one({"_id": representation_id})
-        if not representation:
-            representation = io.find_one({"_id": representation_id})
-            self._insert_one(representation)
-
-            # Version
-            version = io.find_one({"_id": representation["parent"]})
-            if not self._find_one({"_id": version["_id"]}):
-                self._insert_one(version)
-
-                # Subset
-                subset = io.find_one({"_id": version["parent"]})
-                if not self._find_one({"_id": subset["_id"]}):
-                    self._insert_one(subset)
-
-                    # Asset
-                    asset = io.find_one({"_id": subset["parent"]})
-                    if not self._find_one({"_id": asset["_id"]}):
-                        asset["parent"] = self._project["_id"]
-                        self._insert_one(asset)
-
-                        # Asset Visual Parent
-                        parent_id = asset["data"]["visualParent"]
-                        if parent_id:
-                            parent_id = io.ObjectId(parent_id)
-                            if not self._find_one({"_id": parent_id}):
-                                parent_asset = io.find_one({"_id": parent_id})
-                                parent_asset["parent"] = self._project["_id"]
-                                self._insert_one(parent_asset)
-
-                # Dependencies
-                for dependency_id in version["data"]["dependencies"]:
-                    dependency_id = io.ObjectId(dependency_id)
-                    for representation_ in io.find({"parent": dependency_id}):
-                        self._copy_representations(representation_["_id"])
-
-        # Copy package
-        parents = io.parenthood(representation)
-        src_package = get_representation_path_(representation, parents)
-        parents = parents[:-1] + [self._project]
-        dst_package = get_representation_path_(representation, parents)
-        self._copy_dir(src_package, dst_package)
-
-    def _copy_dir(self, src, dst):
-        """ Copy given source to destination"""
-        copy_tree(src, dst)
+        self._project = self._collection.find_one({"type": "project"})
+
+    def _fetch(self, documents, ids):
+        """Find source documents not yet visited, in one query"""
+        missing = list(set(ids) - set(documents))
+        if not missing:
+            return []
+
+        found = list(io.find({"_id": {"$in": missing}}))
+        for document in found:
+            documents[document["_id"]] = document
+        return found
+
+    def _find_existing(self, ids):
+        """Return `_id`s that already exist in destination project"""
+        if not ids:
+            return set()
+        cursor = self._collection.find({"_id": {"$in": list(ids)}},
+                                       projection={"_id": True})
+        return set(document["_id"] for document in cursor)
+
+    def plan(self, representation_ids):
+        """Collect documents and package files to copy
+
+        Dependencies are followed for versions that are not yet in the
+        destination project, level by level.
+
+        Args:
+            representation_ids (list): Representation `_id`s
+
+        Returns:
+            dict: "documents" to insert, "packages" as source and destination
+                dir pairs, "files" as tuples of source, destination, size and
+                the C4 ID recorded on publish (or `None`), and total "bytes"
+
+        """
+        src_project = io.find_one({"type": "project"})
+
+        documents = dict()
+        existing = set()
+        representations = list()
+
+        frontier = self._fetch(documents, representation_ids)
+        while frontier:
+            representations += frontier
+
+            versions = self._fetch(documents,
+                                   [doc["parent"] for doc in frontier])
+            subsets = self._fetch(documents,
+                                  [doc["parent"] for doc in versions])
+            assets = self._fetch(documents,
+                                 [doc["parent"] for doc in subsets])
+            visual_parents = self._fetch(
+                documents,
+                [io.ObjectId(doc["data"]["visualParent"]) for doc in assets
+                 if doc["data"].get("visualParent")])
+
+            new = frontier + versions + subsets + assets + visual_parents
+            existing.update(self._find_existing(doc["_id"] for doc in new))
+
+            # Dependencies
+            dependency_ids = set()
+            for version in versions:
+                if version["_id"] in existing:
+                    continue
+                for dependency_id in version["data"].get("dependencies", {}):
+                    dependency_ids.add(io.ObjectId(dependency_id))
+
+            if not dependency_ids:
+                break
+
+            frontier = list()
+            for document in io.find({"type": "representation",
+                                     "parent": {"$in": list(dependency_ids)}}):
+                if document["_id"] not in documents:
+                    documents[document["_id"]] = document
+                    frontier.append(document)
+
+        inserts = list()
+        for document in documents.values():
+            if document["_id"] in existing:
+                continue
+            if document["type"] == "asset":
+                document = dict(document, parent=self._project["_id"])
+            inserts.append(document)
+        inserts.sort(key=lambda doc: self.TYPE_ORDER.index(doc["type"]))
+
+        packages = list()
+        files = list()
+        for representation in representations:
+            version = documents[representation["parent"]]
+            subset = documents[version["parent"]]
+            asset = documents[subset["parent"]]
+
+            parents = [version, subset, asset]
+            src = get_representation_path_(representation,
+                                           parents + [src_project])
+            dst = get_representation_path_(representation,
+                                           parents + [self._project])
+            packages.append((src, dst))
+
+            checksums = {entry["file"]: entry["c4id"] for entry in
+                         representation["data"].get("checksums", [])}
+            files += self._plan_files(src, dst, checksums)
+
+        return {
+            "documents": inserts,
+            "packages": packages,
+            "files": files,
+            "bytes": sum(size for _, _, size, _ in files),
+        }
+
+    def _plan_files(self, src, dst, checksums):
+        files = list()
+        for root, _, names in os.walk(src):
+            rel_root = os.path.relpath(root, src)
+            for name in names:
+                rel_path = os.path.normpath(os.path.join(rel_root, name))
+                file_path = os.path.join(src, rel_path)
+                files.append((file_path,
+                              os.path.join(dst, rel_path),
+                              os.path.getsize(file_path),
+                              checksums.get(rel_path.replace("\\", "/"))))
+        return files
+
+    def execute(self, plan):
+        """Transfer package files in parallel, then insert documents
+
+        Documents are inserted after all files are transferred, so the
+        destination project never refers to missing files.
+
+        Args:
+            plan (dict): Returned from `plan`
+
+        """
+        from .transfer import TransferEngine
+
+        engine = TransferEngine(workers=self.workers, log=log)
+        for src, dst, size, c4id in plan["files"]:
+            engine.add(self._transfer_file, (src, dst, c4id), size=size)
+        engine.run()
+
+        if plan["documents"]:
+            self._collection.insert_many(plan["documents"], ordered=True)
+
+    def _transfer_file(self, src, dst, c4id=None):
+        """Copy or hardlink file, verify the copy with recorded `c4id`"""
+        from .transfer import copy_file_hashed, is_same_device
+
+        dirname = os.path.dirname(dst)
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+        if os.path.exists(dst):
+            # Not writing through, in case it's linked to the source
+            os.remove(dst)
+
+        if self.hardlink and is_same_device(src, dirname):
+            filelink.create(src, dst, filelink.HARDLINK)
+            return
+
+        copied, _ = copy_file_hashed(src, dst)
+        if c4id is not None and copied != c4id:
+            os.remove(dst)
+            raise IOError("Checksum mismatch: %s" % src)
+
+
+def normalize_source(source, project):
+    """Return source path that relative to project dir, for matching
+
+    The path is lower-cased and with "/" separators, so it can be matched
+    exactly no matter which root or drive it's been published from.
+
+    Args:
+        source (str): A path string where subsets been published from
+        project (str): Project name
+
+    """
+    source = source.replace("\\", "/").lower()
+    marker = "/%s/" % project.lower()
+    if marker in source:
+        source = source.split(marker, 1)[-1]
+
+    return source.strip("/")
 
 
 def get_versions_from_sourcefile(source, project):
     """Get version documents by the source path
 
-    By matching the path with field `version.data.source` to query latest
-    versions.
+    By matching the path with indexed field `version.data.sourcePath` to
+    query latest versions. Versions published before the field existed
+    can be updated by `python -m reveries.database index`, if nothing
+    found, they will be matched with field `version.data.source` instead.
 
     Args:
         source (str): A path string where subsets been published from
         project (str): Project name
 
     """
-    source = source.split(project, 1)[-1].replace("\\", "/")
-    source = {"$regex": "/*{}".format(source), "$options": "i"}
+    versions = list(io.find({"type": "version",
+                             "data.sourcePath": normalize_source(source,
+                                                                 project)},
+                            sort=[("name", -1)]))
+    if not versions:
+        # Versions that not been updated, slow query
+        legacy = source.split(project, 1)[-1].replace("\\", "/")
+        legacy = {"$regex": "/*{}".format(legacy), "$options": "i"}
+        versions = list(io.find({"type": "version",
+                                 "data.source": legacy,
+                                 "data.sourcePath": {"$exists": False}},
+                                sort=[("name", -1)]))
+        if versions:
+            log.warning("Versions without 'data.sourcePath' found, run "
+                        "`python -m reveries.database index` to update.")
 
-    cursor = io.find({"type": "version",
-                      "data.source": source},
-                     sort=[("name", -1)])
     # (NOTE) Each version usually coming from different source file, but
     #        let's not making this assumtion.
     #        So here we filter out other versions that belongs to the same
     #        subset.
     subsets = set()
-    for version in cursor:
+    for version in versions:
         if version["parent"] not in subsets:
             subsets.add(version["parent"])
 
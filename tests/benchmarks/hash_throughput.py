@@ -0,0 +1,99 @@
+"""Benchmark file hashing throughput of each `AssetHasher` read mode
+
+Usage:
+    python tests/benchmarks/hash_throughput.py <dir> [<dir> ...] [--size MB]
+
+Pass one local disk dir and one network mount dir to compare. A test file
+will be written into each dir, hashed once per read mode, then removed.
+
+(NOTE) Writing the test file puts it into OS page cache, which makes the
+       first read much faster than a cold read from disk or network. On
+       platforms that support `posix_fadvise`, the cache will be dropped
+       before each run.
+
+"""
+import os
+import sys
+import time
+import argparse
+
+from reveries.utils import AssetHasher
+
+
+MODES = [
+    AssetHasher.READ_CHUNK,
+    AssetHasher.READ_ADAPTIVE,
+    AssetHasher.READ_MMAP,
+]
+
+
+def drop_cache(file_path):
+    if not hasattr(os, "posix_fadvise"):
+        return False
+
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+    return True
+
+
+def make_file(dir_path, size):
+    file_path = os.path.join(dir_path, ".reveries_hash_benchmark.bin")
+    block = os.urandom(1024 * 1024)
+    with open(file_path, "wb") as f:
+        for _ in range(size):
+            f.write(block)
+
+    return file_path
+
+
+def benchmark(dir_path, size, repeat):
+    file_path = make_file(dir_path, size)
+    results = list()
+
+    try:
+        for mode in MODES:
+            elapsed = list()
+            for _ in range(repeat):
+                cold = drop_cache(file_path)
+
+                hasher = AssetHasher(use_cache=False, read_mode=mode)
+                start = time.time()
+                hasher.add_file(file_path)
+                elapsed.append(time.time() - start)
+
+            best = min(elapsed)
+            results.append((mode, best, size / best, cold))
+    finally:
+        os.remove(file_path)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("dirs", nargs="+",
+                        help="Directories to benchmark in")
+    parser.add_argument("--size", type=int, default=1024,
+                        help="Test file size in MB, default 1024")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per read mode, best one is reported")
+
+    args = parser.parse_args(argv)
+
+    row = "%-40s %-10s %10s %12s %6s"
+    print(row % ("Dir", "Mode", "Seconds", "MB/s", "Cold"))
+    for dir_path in args.dirs:
+        for mode, seconds, throughput, cold in benchmark(dir_path,
+                                                         args.size,
+                                                         args.repeat):
+            print(row % (dir_path, mode, "%.3f" % seconds,
+                         "%.1f" % throughput, cold))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
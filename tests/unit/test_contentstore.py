@@ -0,0 +1,83 @@
+import os
+import stat
+import time
+import tempfile
+
+import reveries.contentstore
+import reveries.utils
+
+
+def test_content_store_put():
+    wdir = tempfile.mkdtemp(prefix="test_store")
+    store = reveries.contentstore.ContentStore(os.path.join(wdir, "store"))
+
+    src = os.path.join(wdir, "foo.bar")
+    with open(src, "w") as foo:
+        foo.write("foo")
+
+    c4id = reveries.utils.hash_file(src, use_cache=False)
+    assert not store.has(c4id)
+
+    blob = store.put(src, c4id)
+    assert store.has(c4id)
+    assert blob == store.path(c4id)
+    # Read-only
+    assert not os.stat(blob).st_mode & stat.S_IWRITE
+
+    with open(blob) as f:
+        assert f.read() == "foo"
+
+    # Stored only once
+    assert store.put(src, c4id) == blob
+    assert list(store.iter_blobs()) == [(c4id, blob)]
+
+    # Content not matched, e.g. stale hash
+    stale_id = reveries.utils.hash_file(src, use_cache=False)
+    with open(src, "w") as foo:
+        foo.write("bar")
+    os.remove(blob)
+    try:
+        store.put(src, stale_id)
+    except IOError:
+        pass
+    else:
+        raise AssertionError("Content not verified.")
+    assert list(store.iter_blobs()) == []
+
+
+def test_content_store_collect_garbage():
+    wdir = tempfile.mkdtemp(prefix="test_store")
+    store = reveries.contentstore.ContentStore(os.path.join(wdir, "store"))
+
+    old = time.time() - 3600 * 48
+
+    def put(content):
+        src = os.path.join(wdir, content)
+        with open(src, "w") as f:
+            f.write(content)
+        # Source files are usually old
+        os.utime(src, (old, old))
+        c4id = reveries.utils.hash_file(src, use_cache=False)
+        return c4id, store.put(src, c4id)
+
+    used_id, used = put("foo")
+    _, unused = put("bar")
+    _, fresh = put("baz")
+
+    # Just stored, not removed even if the source is old
+    removed, _ = store.collect_garbage({used_id}, min_age=24)
+    assert removed == []
+
+    os.utime(used, (old, old))
+    os.utime(unused, (old, old))
+
+    removed, freed = store.collect_garbage({used_id}, dry_run=True)
+    assert removed == [unused]
+    assert os.path.isfile(unused)
+
+    removed, freed = store.collect_garbage({used_id})
+    assert removed == [unused]
+    assert freed == 3
+    assert not os.path.isfile(unused)
+    assert os.path.isfile(used)
+    assert os.path.isfile(fresh)
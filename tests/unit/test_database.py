@@ -0,0 +1,649 @@
+import os
+import json
+import pytest
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+import pyblish.api
+import pyblish.plugin
+import pyblish.util
+from avalon import io
+
+import reveries
+import reveries.database
+import reveries.plugins
+import reveries.utils
+
+
+mongomock = pytest.importorskip("mongomock")
+
+
+class CountingCollection(object):
+    """Collection proxy that counts database round trips"""
+
+    ROUND_TRIPS = [
+        "find",
+        "find_one",
+        "insert_one",
+        "insert_many",
+        "update_many",
+        "bulk_write",
+        "aggregate",
+    ]
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.calls = list()
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in self.ROUND_TRIPS:
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            return attr(*args, **kwargs)
+        return call
+
+
+class CountingDatabase(object):
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getitem__(self, name):
+        return self.collection
+
+
+@pytest.fixture
+def database():
+    collection = CountingCollection(mongomock.MongoClient().db.test)
+    patches = [
+        mock.patch.object(io, "_database", CountingDatabase(collection)),
+        mock.patch.object(io, "_is_installed", True),
+        mock.patch.dict(io.Session, {"AVALON_PROJECT": "test"}),
+    ]
+    for patch in patches:
+        patch.start()
+
+    yield collection
+
+    for patch in patches:
+        patch.stop()
+
+
+def get_plugin(name):
+    for plugin in pyblish.plugin.discover(paths=[reveries.PUBLISH_PATH]):
+        if plugin.__name__ == name:
+            return plugin()
+
+
+def get_integrator():
+    return get_plugin("IntegrateAvalonSubset")
+
+
+def register(integrator, context, subset_name, dependencies):
+    instance = context.create_instance(subset_name)
+    instance.data["subset"] = subset_name
+    instance.data["dependencies"] = dependencies
+
+    integrator.writer = integrator.get_writer(context)
+    subset = integrator.get_subset(instance)
+    version = integrator.create_version(subset, 1, [None], {})
+    representations = [
+        {"type": "representation", "name": name, "data": {}}
+        for name in ("mayaBinary", "Alembic", "GPUCache")
+    ]
+    version_id = integrator.write_database(instance,
+                                           version,
+                                           representations)
+    integrator.update_dependent(instance, version_id)
+
+    return version_id
+
+
+def test_bulk_write_round_trips(database):
+    dependency_ids = [
+        database.insert_one({"type": "version"}).inserted_id
+        for _ in range(100)
+    ]
+    dependencies = {str(_id): {"count": 1} for _id in dependency_ids}
+    database.calls[:] = []
+
+    context = pyblish.api.Context()
+    context.data["assetDoc"] = {"_id": io.ObjectId()}
+
+    integrator = get_integrator()
+    version_id = register(integrator, context, "modelDefault", dependencies)
+
+    # Nothing written until flushed
+    assert database.calls == ["find_one"]
+    integrator.writer.flush()
+    # Was 5 + 100 round trips, one for each insertion and dependency
+    assert database.calls == ["find_one", "bulk_write"]
+
+    version = database.find_one({"_id": version_id})
+    subset = database.find_one({"_id": version["parent"]})
+    assert subset["name"] == "modelDefault"
+    assert len(list(database.find({"parent": version_id}))) == 3
+
+    field = "data.dependents." + str(version_id)
+    assert len(list(database.find({field: {"count": 1}}))) == 100
+
+
+def test_bulk_write_context(database):
+    context = pyblish.api.Context()
+    context.data["assetDoc"] = {"_id": io.ObjectId()}
+
+    integrator = get_integrator()
+    environ = {"REVERIES_BULK_WRITE_CONTEXT": "1"}
+    with mock.patch.dict("os.environ", environ):
+        dependency_id = register(integrator, context, "modelDefault", {})
+        register(integrator, context, "lookDefault",
+                 {str(dependency_id): {"count": 2}})
+
+    assert database.calls == ["find_one", "find_one"]
+    context.data["avalonBulkWriter"].flush()
+    assert database.calls == ["find_one", "find_one", "bulk_write"]
+
+    # Ordered, the dependency version is inserted before updated
+    dependency = database.find_one({"_id": dependency_id})
+    assert len(dependency["data"]["dependents"]) == 1
+
+
+def test_document_cache(database):
+    asset_id = io.ObjectId()
+    subset_id = database.insert_one({"type": "subset",
+                                     "parent": asset_id,
+                                     "name": "modelDefault"}).inserted_id
+    version_ids = [
+        database.insert_one({"type": "version",
+                             "parent": subset_id,
+                             "name": i}).inserted_id
+        for i in range(10)
+    ]
+    database.calls[:] = []
+
+    cache = reveries.database.DocumentCache()
+
+    subset = cache.find_one({"type": "subset",
+                             "parent": asset_id,
+                             "name": "modelDefault"})
+    assert cache.find_one({"_id": subset_id}) is subset
+    assert database.calls == ["find_one"]
+
+    # Not existed also cached
+    filter_ = {"type": "subset", "parent": asset_id, "name": "lookDefault"}
+    assert cache.find_one(filter_) is None
+    assert cache.find_one(filter_) is None
+    assert database.calls == ["find_one", "find_one"]
+
+    # Query missed at once
+    versions = cache.find_many(version_ids + [io.ObjectId()])
+    assert [v["name"] for v in versions[:-1]] == list(range(10))
+    assert versions[-1] is None
+    assert cache.find_many(version_ids)[0] is versions[0]
+    assert database.calls == ["find_one", "find_one", "find"]
+
+    assert cache.hits == 12
+    assert cache.misses == 13
+
+    # Invalidated by our writes
+    writer = reveries.database.BulkWriter(cache)
+    writer.insert_one(dict(filter_))
+    writer.update_one({"_id": subset_id}, {"$set": {"data.foo": 1}})
+    writer.flush()
+
+    assert cache.find_one(filter_)["name"] == "lookDefault"
+    assert cache.find_one({"_id": subset_id})["data"]["foo"] == 1
+    assert cache.find_one({"_id": version_ids[0]}) is versions[0]
+
+
+def test_get_subset_created_by_others(database):
+    context = pyblish.api.Context()
+    asset_id = io.ObjectId()
+    context.data["assetDoc"] = {"_id": asset_id}
+
+    instance = context.create_instance("modelDefault")
+    instance.data["subset"] = "modelDefault"
+
+    # Looked up and cached as not found in earlier plugin
+    filter_ = {"type": "subset", "parent": asset_id, "name": "modelDefault"}
+    assert reveries.database.get_cache(context).find_one(filter_) is None
+
+    # Then created by other publish
+    subset_id = database.insert_one(dict(filter_)).inserted_id
+
+    integrator = get_integrator()
+    integrator.writer = integrator.get_writer(context)
+    subset = integrator.get_subset(instance)
+
+    assert subset["_id"] == subset_id
+    assert integrator.subset_created is False
+    assert len(integrator.writer) == 0
+
+
+def test_get_latest_version_names(database):
+    subset_ids = [io.ObjectId() for _ in range(3)]
+    for i, subset_id in enumerate(subset_ids[:2]):
+        for name in range(1, 5 + i):
+            database.insert_one({"type": "version",
+                                 "parent": subset_id,
+                                 "name": name})
+    database.calls[:] = []
+
+    latest = reveries.database.get_latest_version_names(subset_ids)
+    assert latest == {subset_ids[0]: 4, subset_ids[1]: 5}
+    assert database.calls == ["aggregate"]
+
+
+def test_validate_latest_version_loaded(database):
+    subset_id = io.ObjectId()
+    version_ids = [
+        database.insert_one({"type": "version",
+                             "parent": subset_id,
+                             "name": name}).inserted_id
+        for name in (1, 2)
+    ]
+    containers = list()
+    for i in range(300):
+        representation_id = database.insert_one({
+            "type": "representation",
+            "parent": version_ids[i % 2],
+            "name": "mayaBinary%d" % i,
+        }).inserted_id
+        containers.append({"objectName": "container%d" % i,
+                           "representation": str(representation_id)})
+    database.calls[:] = []
+
+    host = mock.Mock()
+    host.ls.return_value = containers
+    validator = get_plugin("ValidateLatestVersionLoaded")
+    validator.log = mock.Mock()
+
+    with mock.patch("avalon.api.registered_host", return_value=host):
+        validator.process(pyblish.api.Context())
+
+    assert database.calls == ["find", "find", "aggregate"]
+
+    message = validator.log.warning.call_args[0][0]
+    outdated = message.split("\n")[1:]
+    assert sorted(outdated) == sorted("container%d" % i
+                                      for i in range(0, 300, 2))
+
+
+def test_validate_avalon_dependencies(database):
+    subset_id = io.ObjectId()
+
+    def insert_version(parent, dependencies):
+        return database.insert_one({
+            "type": "version",
+            "parent": parent,
+            "data": {"dependencies": {str(_id): {"count": 1}
+                                      for _id in dependencies}},
+        }).inserted_id
+
+    # Shared model under many rigs, rigs under one layout
+    model = insert_version(io.ObjectId(), [])
+    rigs = [insert_version(io.ObjectId(), [model]) for _ in range(20)]
+    layout = insert_version(io.ObjectId(), rigs)
+    database.calls[:] = []
+
+    validator = get_plugin("ValidateAvalonDependencies")
+    validator.cache = reveries.database.DocumentCache()
+
+    dependencies = {str(layout): {"count": 1}}
+    assert validator.find_cycle(dependencies, subset_id) == []
+    # One query per level
+    assert database.calls == ["find", "find", "find"]
+
+    # Depends on previous version of itself
+    previous = insert_version(subset_id, [])
+    rig = insert_version(io.ObjectId(), [model, previous])
+    dependencies = {str(layout): {"count": 1}, str(rig): {"count": 1}}
+    assert validator.find_cycle(dependencies, subset_id) == [rig, previous]
+
+
+def test_get_latest_versions(database):
+    asset_id = io.ObjectId()
+    families = {
+        "modelDefault": "reveries.model",
+        "modelProxy": "reveries.model",
+        "rigDefault": "reveries.rig",
+        "lookDefault": "reveries.look",
+    }
+    for name, family in sorted(families.items()):
+        subset_id = database.insert_one({"type": "subset",
+                                         "parent": asset_id,
+                                         "name": name}).inserted_id
+        for number in (1, 2, 3):
+            # Family changed in latest version
+            if name == "rigDefault" and number == 3:
+                family = "reveries.model"
+            version_id = database.insert_one({
+                "type": "version",
+                "parent": subset_id,
+                "name": number,
+                "data": {"families": [family]},
+            }).inserted_id
+            if name == "modelProxy":
+                continue
+            database.insert_one({"type": "representation",
+                                 "parent": version_id,
+                                 "name": "mayaBinary",
+                                 "data": {"number": number}})
+    database.calls[:] = []
+
+    latest = reveries.database.get_latest_versions(
+        {"parent": asset_id},
+        families=["reveries.model"],
+        representation="mayaBinary")
+    assert database.calls == ["find", "aggregate"]
+
+    latest = {subset["name"]: (version, representation)
+              for subset, version, representation in latest}
+    assert sorted(latest) == ["modelDefault", "modelProxy", "rigDefault"]
+    assert latest["modelDefault"][0]["name"] == 3
+    assert latest["modelDefault"][1]["data"]["number"] == 3
+    assert latest["modelProxy"][1] is None
+
+    # Not joined, in the order of subsets
+    latest = reveries.database.get_latest_versions({"parent": asset_id})
+    assert [subset["name"] for subset, _, _ in latest] == sorted(families)
+    assert all(representation is None for _, _, representation in latest)
+
+
+def test_ensure_indexes(database):
+    created = reveries.database.ensure_indexes(database)
+    assert created == [keys for keys, _ in reveries.database.INDEXES]
+    # Only once
+    assert reveries.database.ensure_indexes(database) == []
+
+
+def test_versions_from_sourcefile(database):
+    subset_id = io.ObjectId()
+    for name in (1, 2):
+        database.insert_one({
+            "type": "version",
+            "parent": subset_id,
+            "name": name,
+            "data": {"source": "{root}/Proj/Avalon/work/Model/scene.ma"},
+        })
+
+    # Not yet backfilled
+    source = "X:\\show\\Proj\\Avalon\\work\\Model\\scene.ma"
+    versions = list(reveries.utils.get_versions_from_sourcefile(source,
+                                                                "Proj"))
+    assert [v["name"] for v in versions] == [2]
+
+    assert reveries.database.backfill_source_paths(database, "Proj") == 2
+    version = database.find_one({"type": "version"})
+    assert version["data"]["sourcePath"] == "avalon/work/model/scene.ma"
+
+    source = "X:\\Projects\\proj\\Avalon\\work\\Model\\scene.ma"
+    versions = list(reveries.utils.get_versions_from_sourcefile(source,
+                                                                "Proj"))
+    assert [v["name"] for v in versions] == [2]
+
+    # Nothing left
+    assert reveries.database.backfill_source_paths(database, "Proj") == 0
+
+
+def test_audit_queries(database):
+    subset_id = io.ObjectId()
+    database.insert_one({"type": "version",
+                         "parent": subset_id,
+                         "name": 1,
+                         "data": {}})
+    explain = {
+        "queryPlanner": {"winningPlan": {
+            "stage": "SORT",
+            "inputStage": {"stage": "COLLSCAN"},
+        }},
+        "executionStats": {"totalDocsExamined": 500,
+                           "nReturned": 1,
+                           "executionTimeMillis": 3},
+    }
+    with mock.patch.object(mongomock.collection.Cursor, "explain",
+                           create=True, return_value=explain):
+        report = reveries.database.audit_queries(database)
+
+    assert [shape["label"] for shape in report] == [
+        "latest version of subset",
+        "latest versions of subsets",
+        "children of version",
+        "versions by source file",
+    ]
+    assert all(shape["slow"] for shape in report)
+    assert report[0]["stages"] == ["SORT", "COLLSCAN"]
+
+
+def test_database_stats(database):
+    subset_id = io.ObjectId()
+    for name in (1, 2, 3):
+        database.insert_one({"type": "version",
+                             "parent": subset_id,
+                             "name": name})
+
+    class Validator(pyblish.api.InstancePlugin):
+        def process(self, instance):
+            list(io.find({"type": "version"}))
+            self.find_latest()
+
+        def find_latest(self):
+            return io.find_one({"type": "version"}, sort=[("name", -1)])
+
+    context = pyblish.api.Context()
+    instance = context.create_instance("modelDefault")
+
+    stats = reveries.database.DatabaseStats()
+    assert reveries.database.instrument(stats)
+    try:
+        Validator().process(instance)
+        # Not made by plugin
+        io.find_one({"type": "version"})
+    finally:
+        reveries.database.uninstrument()
+
+    assert isinstance(io._database, CountingDatabase)
+
+    entries = stats.entries()
+    assert len(entries) == 1
+    assert entries[0]["plugin"] == "Validator"
+    assert entries[0]["instance"] == "modelDefault"
+    assert entries[0]["calls"] == 2
+    assert entries[0]["documents"] == 4
+    assert entries[0]["operations"] == {"find": 1, "find_one": 1}
+
+    assert stats.entries("lookDefault") == []
+
+
+def test_database_stats_teardown(database):
+
+    class ValidateFail(pyblish.api.ContextPlugin):
+        order = pyblish.api.ValidatorOrder
+
+        def process(self, context):
+            io.find_one({"type": "version"})
+            raise AssertionError("Failed")
+
+    stats = reveries.database.DatabaseStats()
+    assert reveries.database.instrument(stats)
+
+    pyblish.api.register_callback("published",
+                                  reveries.plugins.teardown_publish)
+    try:
+        pyblish.util.publish(plugins=[ValidateFail,
+                                      get_plugin("PublishTeardown").__class__])
+    finally:
+        pyblish.api.deregister_callback("published",
+                                        reveries.plugins.teardown_publish)
+
+    # Stopped on validation failed, still uninstrumented
+    assert isinstance(io._database, CountingDatabase)
+    assert stats.entries()[0]["plugin"] == "ValidateFail"
+
+
+def test_asset_graber(database, tmpdir):
+    root = str(tmpdir)
+    template = "{root}/{project}/{silo}/{asset}/{subset}/v{version}/" \
+               "{representation}"
+    project = {"type": "project",
+               "name": "Src",
+               "config": {"template": {"publish": template}}}
+    database.insert_one(dict(project))
+
+    asset_id = database.insert_one({"type": "asset",
+                                    "name": "Foo",
+                                    "silo": "Props",
+                                    "data": {"visualParent": None}}
+                                   ).inserted_id
+
+    def publish(name, dependencies):
+        subset_id = database.insert_one({"type": "subset",
+                                         "parent": asset_id,
+                                         "name": name}).inserted_id
+        version_id = database.insert_one({
+            "type": "version",
+            "parent": subset_id,
+            "name": 1,
+            "data": {"dependencies": {str(_id): {"count": 1}
+                                      for _id in dependencies}},
+        }).inserted_id
+        representation_id = database.insert_one({
+            "type": "representation",
+            "parent": version_id,
+            "name": "mayaBinary",
+            "data": {},
+        }).inserted_id
+
+        package = os.path.join(root, "Src", "Props", "Foo", name, "v1",
+                               "mayaBinary")
+        os.makedirs(package)
+        with open(os.path.join(package, name + ".mb"), "w") as f:
+            f.write(name)
+
+        return version_id, representation_id
+
+    # Diamond dependencies
+    model, _ = publish("modelDefault", [])
+    rig_a, _ = publish("rigA", [model])
+    rig_b, _ = publish("rigB", [model])
+    _, layout = publish("layoutDefault", [rig_a, rig_b])
+
+    destination = mongomock.MongoClient().db.dst
+    destination.insert_one(dict(project, name="Dst"))
+
+    graber = reveries.utils.AssetGraber("Dst")
+    graber._collection = CountingCollection(destination)
+    graber._project = destination.find_one({"type": "project"})
+    graber._connected = True
+    database.calls[:] = []
+
+    with mock.patch("avalon.api.registered_root", return_value=root):
+        plan = graber.grab(str(layout), dry_run=True)
+        # Model visited once, one query per document type of each level
+        assert len(plan["packages"]) == 4
+        assert len(database.calls) == 11
+        assert plan["bytes"] == sum(len(name) for name in (
+            "modelDefault", "rigA", "rigB", "layoutDefault"))
+        assert destination.count_documents({}) == 1
+
+        graber.grab(layout)
+
+    assert destination.count_documents({"type": "representation"}) == 4
+    asset = destination.find_one({"type": "asset"})
+    assert asset["parent"] == graber._project["_id"]
+    model_file = os.path.join(root, "Dst", "Props", "Foo", "modelDefault",
+                              "v1", "mayaBinary", "modelDefault.mb")
+    with open(model_file) as f:
+        assert f.read() == "modelDefault"
+
+    # Nothing left
+    with mock.patch("avalon.api.registered_root", return_value=root):
+        plan = graber.grab(layout, dry_run=True)
+    assert plan["documents"] == []
+
+    # Bad copy removed
+    bad_file = os.path.join(root, "bad.mb")
+    with pytest.raises(IOError):
+        graber._transfer_file(model_file, bad_file, c4id="c4Wrong")
+    assert not os.path.exists(bad_file)
+
+
+def test_reserve_version(database):
+    asset_id = io.ObjectId()
+    reserve = reveries.database.reserve_version
+
+    assert reveries.database.get_reserved_version(asset_id, "foo") == 0
+    assert reserve(asset_id, "foo", latest=3) == 4
+    assert reserve(asset_id, "foo", latest=3) == 5
+    assert reserve(asset_id, "bar") == 1
+    # Catch up with versions published without reservation
+    assert reserve(asset_id, "foo", latest=9) == 10
+    assert reveries.database.get_reserved_version(asset_id, "foo") == 10
+
+
+def test_reserve_version_first_race(database):
+    asset_id = io.ObjectId()
+    filter_ = reveries.database._counter_filter(asset_id, "foo")
+    reserved = list()
+
+    def racing_update_one(*args, **kwargs):
+        # Other publish reserved first, then our upsert inserts the
+        # counter again which has the same `_id`
+        del database.update_one
+        reserved.append(reveries.database.reserve_version(asset_id, "foo"))
+        database.insert_one(dict(filter_, reserved=0))
+
+    database.update_one = racing_update_one
+    reserved.append(reveries.database.reserve_version(asset_id, "foo"))
+
+    assert reserved == [1, 2]
+    assert len(list(database.find(filter_))) == 1
+
+
+def test_extract_version_directory(database, tmpdir):
+    template = "{root}/{project}/{silo}/{asset}/{subset}/v{version}/" \
+               "{representation}"
+    context = pyblish.api.Context()
+    context.data["projectDoc"] = {
+        "config": {"template": {"publish": template}}}
+    context.data["assetDoc"] = {"_id": io.ObjectId()}
+
+    def extract(workfile):
+        context.data["sourceFingerprint"] = {"currentMaking": workfile,
+                                             "currentHash": workfile}
+        instance = context.create_instance("modelDefault")
+        instance.data["subset"] = "modelDefault"
+        get_plugin("ExtractVersionDirectory").process(instance)
+        return instance.data["versionNext"]
+
+    session = {"AVALON_PROJECT": "Proj",
+               "AVALON_SILO": "Props",
+               "AVALON_ASSET": "Foo"}
+    with mock.patch("avalon.api.registered_root", return_value=str(tmpdir)):
+        with mock.patch.dict("avalon.Session", session):
+            assert extract("a.ma") == 1
+            assert extract("b.ma") == 2
+            # Not integrated, reused by the same workfile
+            assert extract("a.ma") == 1
+            assert extract("c.ma") == 3
+
+            # Left by publish before version reservation
+            def leave_version(number, workfile, success):
+                version_dir = tmpdir.join("Proj", "Props", "Foo",
+                                          "modelDefault", "v%d" % number)
+                version_dir.ensure(dir=True)
+                version_dir.join(".fingerprint.json").write(json.dumps(
+                    {"currentMaking": workfile, "success": success}))
+
+            leave_version(4, "x.ma", success=True)
+            leave_version(5, "y.ma", success=False)
+            # Failed one is taken over once reserved
+            assert extract("d.ma") == 5
+            # But not reused without reservation
+            assert extract("e.ma") == 6
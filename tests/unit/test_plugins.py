@@ -0,0 +1,271 @@
+import os
+import time
+import tempfile
+import threading
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+import pyblish.api
+import pyblish.plugin
+
+import reveries.plugins
+import reveries.utils
+
+
+class ExtractFoo(reveries.plugins.PackageExtractor):
+
+    representations = ["Foo", "Bar"]
+    background = True
+
+    def _process(self, instance):
+        self.context = instance.context
+        self.data = instance.data
+        self._active_representations = self.representations
+        self._extract_to_publish_dir = False
+        self.data["packages"] = dict()
+        self.data["files"] = list()
+
+    def extract_Foo(self):
+        self.add_data({"entryFileName": "foo.ma"})
+        self.add_job(self.list_files, "foo")
+
+    def extract_Bar(self):
+        self.add_job(self.list_files, "bar")
+
+    def list_files(self, name):
+        self.add_file(name, name + ".copy")
+        return {"thread": threading.current_thread().name}
+
+
+def test_package_extractor_add_job():
+    context = pyblish.api.Context()
+    instance = context.create_instance("foo")
+
+    ExtractFoo().process(instance)
+    assert len(instance.data["backgroundJobs"]) == 2
+
+    assert reveries.plugins.join_background_jobs(context) == []
+    assert "backgroundPool" not in context.data
+
+    packages = instance.data["packages"]
+    assert packages["Foo"]["entryFileName"] == "foo.ma"
+    assert packages["Foo"]["thread"] != threading.current_thread().name
+    assert "thread" in packages["Bar"]
+    assert sorted(instance.data["files"]) == [("bar", "bar.copy"),
+                                              ("foo", "foo.copy")]
+
+    # Run in place if not background
+    ExtractFoo.background = False
+    try:
+        instance = context.create_instance("bar")
+        ExtractFoo().process(instance)
+    finally:
+        ExtractFoo.background = True
+
+    assert "backgroundJobs" not in instance.data
+    assert (instance.data["packages"]["Bar"]["thread"] ==
+            threading.current_thread().name)
+
+
+def test_package_extractor_hash_package():
+    context = pyblish.api.Context()
+    instance = context.create_instance("foo")
+    instance.data["stagingDir"] = tempfile.mkdtemp(prefix="test_hash_package")
+    instance.data["versionDir"] = tempfile.mkdtemp(prefix="test_hash_package")
+
+    extractor = ExtractFoo()
+
+    def write_file(name):
+        time.sleep(0.1)
+        file_path = os.path.join(instance.data["stagingDir"], "Foo", name)
+        with open(file_path, "w") as f:
+            f.write(name)
+
+    extractor.list_files = write_file
+    os.makedirs(os.path.join(instance.data["stagingDir"], "Foo"))
+
+    cache = reveries.utils.HashCache(
+        os.path.join(instance.data["stagingDir"], "cache.db"))
+    with mock.patch.dict("os.environ", {"REVERIES_HASH_CACHE": cache.path}):
+        extractor.process(instance)
+        assert reveries.plugins.join_background_jobs(context) == []
+
+    # Hashed after the job that writes file
+    file_path = os.path.join(instance.data["stagingDir"], "Foo", "foo")
+    assert cache.get(file_path) == reveries.utils.hash_file(file_path,
+                                                            use_cache=False)
+
+    # Not renamed into publish dir, hashed on copy instead
+    cache.clear()
+    with mock.patch.dict("os.environ", {"REVERIES_HASH_CACHE": cache.path}):
+        with mock.patch("reveries.plugins.is_same_device", return_value=False):
+            extractor.process(instance)
+            assert reveries.plugins.join_background_jobs(context) == []
+
+    assert cache.get(file_path) is None
+
+
+class Loader(object):
+    """Stand-in of `avalon.api.Loader`, without resolving path from database
+    """
+
+    def __init__(self, context):
+        self.fname = context["path"]
+
+
+class LoadFoo(reveries.plugins.PackageLoader, Loader):
+    pass
+
+
+def test_package_loader_verify_package():
+    package_path = tempfile.mkdtemp(prefix="test_verify_package")
+    file_path = os.path.join(package_path, "foo")
+    with open(file_path, "w") as f:
+        f.write("foo")
+
+    checksums = [{"file": "foo",
+                  "size": os.path.getsize(file_path),
+                  "c4id": reveries.utils.hash_file(file_path,
+                                                   use_cache=False)}]
+    context = {"path": package_path,
+               "representation": {"data": {"checksums": checksums}}}
+
+    with mock.patch.dict("os.environ", {"REVERIES_VERIFY_ON_LOAD": "1"}):
+        LoadFoo(context)
+
+        with open(file_path, "w") as f:
+            f.write("bar")
+        try:
+            LoadFoo(context)
+        except IOError:
+            pass
+        else:
+            raise AssertionError("Changed file not detected.")
+
+    # Opt-in
+    LoadFoo(context)
+
+
+def test_join_background_jobs_failed():
+    context = pyblish.api.Context()
+    instance = context.create_instance("foo")
+
+    extractor = ExtractFoo()
+
+    def fail(name):
+        raise IOError("Disk full")
+
+    extractor.list_files = fail
+    extractor.process(instance)
+
+    failed = reveries.plugins.join_background_jobs(context)
+    assert [(i, r, str(e)) for i, r, e in failed] == [
+        (instance, "Foo", "Disk full"),
+        (instance, "Bar", "Disk full"),
+    ]
+
+
+class ValidateSlow(pyblish.api.InstancePlugin):
+
+    @reveries.plugins.host_independent
+    def process(self, instance):
+        time.sleep(0.2)
+        self.log.info("Validated %s" % instance)
+        if instance.name == "bad":
+            raise AssertionError("Bad instance")
+
+
+class ValidateSlowContext(pyblish.api.ContextPlugin):
+
+    @reveries.plugins.host_independent
+    def process(self, context):
+        time.sleep(0.2)
+        self.log.info("Validated context")
+
+
+def test_run_host_independent():
+    assert ValidateSlow.__instanceEnabled__
+    assert ValidateSlowContext.__contextEnabled__
+
+    context = pyblish.api.Context()
+    good = context.create_instance("good")
+    bad = context.create_instance("bad")
+
+    pairs = [(ValidateSlow, good),
+             (ValidateSlow, bad),
+             (ValidateSlowContext, None)]
+
+    start = time.time()
+    reveries.plugins.run_host_independent(context, pairs)
+    assert time.time() - start < 0.4
+
+    # Replayed in order
+    start = time.time()
+    results = [pyblish.plugin.process(Plugin, context, instance)
+               for Plugin, instance in pairs]
+    assert time.time() - start < 0.2
+
+    messages = [[r.getMessage() for r in result["records"]]
+                for result in results]
+    assert messages == [["Validated good"],
+                        ["Validated bad"],
+                        ["Validated context"]]
+    assert [result["success"] for result in results] == [True, False, True]
+    assert str(results[1]["error"]) == "Bad instance"
+
+    # Not prefetched, run as usual
+    result = pyblish.plugin.process(ValidateSlow, context, good)
+    assert result["success"]
+    assert len(result["records"]) == 1
+
+
+def test_host_independent_plugins_toggled():
+    context = pyblish.api.Context()
+    good = context.create_instance("good")
+    bad = context.create_instance("bad")
+
+    discovery = mock.Mock()
+    discovery.by_range.return_value = [ValidateSlow, ValidateSlowContext]
+
+    def get_pairs():
+        with mock.patch("reveries.plugins.discover_plugins",
+                        return_value=discovery):
+            return reveries.plugins.host_independent_plugins(context, 0, 1)
+
+    assert get_pairs() == [(ValidateSlow, good),
+                           (ValidateSlow, bad),
+                           (ValidateSlowContext, None)]
+
+    # Toggled in publish GUI
+    reveries.plugins.on_instance_toggled(bad, False, True)
+    assert get_pairs() == [(ValidateSlow, good),
+                           (ValidateSlowContext, None)]
+
+    reveries.plugins.on_plugin_toggled(ValidateSlow, False, True)
+    assert get_pairs() == [(ValidateSlowContext, None)]
+
+    # Plugin toggles forgotten on reset
+    reveries.plugins.on_publish_reset(context)
+    assert get_pairs() == [(ValidateSlow, good),
+                           (ValidateSlowContext, None)]
+
+
+def test_teardown_publish_background_jobs():
+    context = pyblish.api.Context()
+    instance = context.create_instance("foo")
+
+    extractor = ExtractFoo()
+
+    def fail(name):
+        raise IOError("Disk full")
+
+    extractor.list_files = fail
+    extractor.process(instance)
+
+    # Failed publish never reached `ExtractBackgroundJobs`
+    reveries.plugins.teardown_publish(context)
+    assert "backgroundPool" not in context.data
+    assert "backgroundJobs" not in instance.data
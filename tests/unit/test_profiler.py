@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import tempfile
+
+import pyblish.api
+import pyblish.plugin
+import pyblish.util
+
+import reveries
+import reveries.plugins
+from reveries import profiler
+
+
+class CollectFoo(pyblish.api.ContextPlugin):
+    order = pyblish.api.CollectorOrder
+
+    def process(self, context):
+        context.create_instance("foo", family="foo")
+
+
+class ExtractFoo(pyblish.api.InstancePlugin):
+    order = pyblish.api.ExtractorOrder
+    families = ["foo"]
+
+    def process(self, instance):
+        instance.data["payload"] = [0] * 100000
+
+
+def test_publish_profiler():
+    process = pyblish.plugin.process
+
+    publish_profiler = profiler.install()
+    assert profiler.install() is publish_profiler
+    try:
+        pyblish.util.publish(plugins=[CollectFoo, ExtractFoo])
+    finally:
+        profiler.uninstall()
+
+    assert pyblish.plugin.process is process
+    assert profiler.get_profiler() is None
+
+    summary = publish_profiler.summary()
+    assert sorted((e["plugin"], e["instance"], e["stage"])
+                  for e in summary) == [("CollectFoo", "", "collect"),
+                                        ("ExtractFoo", "foo", "extract")]
+    assert all(e["success"] for e in summary)
+    assert set(publish_profiler.stage_totals()) == {"collect", "extract"}
+
+    trace_path = os.path.join(tempfile.mkdtemp(), "trace.json")
+    publish_profiler.dump(trace_path)
+    with open(trace_path) as f:
+        trace = json.load(f)
+    assert [e["name"] for e in trace["traceEvents"]] == ["CollectFoo",
+                                                         "ExtractFoo"]
+    assert all(e["ph"] == "X" for e in trace["traceEvents"])
+
+
+class ExtractFail(pyblish.api.InstancePlugin):
+    order = pyblish.api.ExtractorOrder
+    families = ["foo"]
+
+    def process(self, instance):
+        raise IOError("Disk full")
+
+
+def get_teardown():
+    for plugin in pyblish.plugin.discover(paths=[reveries.PUBLISH_PATH]):
+        if plugin.__name__ == "PublishTeardown":
+            return plugin
+
+
+def test_publish_profiler_teardown():
+    PublishTeardown = get_teardown()
+    process = pyblish.plugin.process
+
+    # Uninstalled even if publish failed
+    first = profiler.install()
+    pyblish.util.publish(plugins=[CollectFoo, ExtractFail, PublishTeardown])
+
+    assert pyblish.plugin.process is process
+    assert profiler.get_profiler() is None
+
+    # Next publish not appended to previous trace
+    second = profiler.install()
+    assert second is not first
+    pyblish.util.publish(plugins=[CollectFoo, ExtractFoo, PublishTeardown])
+
+    assert len(first.summary()) == 3
+    assert [e["name"] for e in second.trace()["traceEvents"]] == [
+        "CollectFoo", "ExtractFoo", "PublishTeardown"]
+    assert profiler.get_profiler() is None
+
+
+class ExtractBackground(reveries.plugins.PackageExtractor):
+    order = pyblish.api.ExtractorOrder
+    families = ["foo"]
+    representations = ["Foo"]
+    background = True
+
+    def _process(self, instance):
+        self.context = instance.context
+        self.data = instance.data
+        self._active_representations = self.representations
+        self._extract_to_publish_dir = False
+        self.data["packages"] = dict()
+
+    def extract_Foo(self):
+        self.add_job(time.sleep, 0.1)
+
+
+def test_contractor_stages_teardown():
+    # Run stages like contractor script does
+    plugins = [CollectFoo, ExtractBackground, get_teardown()]
+    process = pyblish.plugin.process
+
+    profiler.install()
+    context = pyblish.api.Context()
+    pyblish.util.collect(context, plugins=plugins)
+    pyblish.util.extract(context, plugins=plugins)
+    assert "backgroundPool" in context.data
+    pyblish.util.integrate(context, plugins=plugins)
+
+    assert "backgroundPool" not in context.data
+    assert pyblish.plugin.process is process
+    assert profiler.get_profiler() is None
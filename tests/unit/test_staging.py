@@ -0,0 +1,119 @@
+
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+from reveries.staging import StagingManager
+
+
+def _write(path, size):
+    with open(path, "wb") as fp:
+        fp.write(b"0" * size)
+
+
+def test_staging_registry():
+    root = tempfile.mkdtemp(prefix="test_staging")
+    manager = StagingManager(root)
+
+    stage_a = manager.create("pyblish_tmp_")
+    stage_b = manager.create("other_")
+
+    # Stages are grouped in session dir under the root
+    assert os.path.dirname(stage_a) == manager.session_dir
+    assert os.path.dirname(manager.session_dir) == os.path.abspath(root)
+    assert manager.stages == [stage_a, stage_b]
+
+    manager.clear("pyblish_tmp_")
+    assert not os.path.isdir(stage_a)
+    assert os.path.isdir(stage_b)
+
+    # Not registered, not removed
+    manager.release(root)
+    assert os.path.isdir(root)
+
+    manager.close()
+    assert os.listdir(root) == []
+
+    shutil.rmtree(root)
+
+
+def test_staging_clean_stale():
+    root = tempfile.mkdtemp(prefix="test_staging")
+    manager = StagingManager(root, max_age=60)
+    stage = manager.create()
+
+    def make_session(name, owner):
+        session_dir = os.path.join(root, name)
+        os.makedirs(session_dir)
+        with open(os.path.join(session_dir, manager.OWNER_FILE), "w") as fp:
+            json.dump(owner, fp)
+        return session_dir
+
+    host = socket.gethostname()
+    now = time.time()
+
+    # Owner process gone
+    dead = make_session("session-dead",
+                        {"pid": 2 ** 22 + 1, "host": host, "created": now})
+    # Owner process alive
+    alive = make_session("session-alive",
+                         {"pid": os.getpid(), "host": host, "created": 0})
+    # Other host, checked by age
+    old = make_session("session-old",
+                       {"pid": 1, "host": "other", "created": now - 120})
+    new = make_session("session-new",
+                       {"pid": 1, "host": "other", "created": now})
+    # Unrelated dir
+    unrelated = os.path.join(root, "unrelated")
+    os.makedirs(unrelated)
+
+    removed = manager.clean_stale()
+
+    assert sorted(removed) == sorted([dead, old])
+    for path in (alive, new, unrelated, stage):
+        assert os.path.isdir(path)
+
+    manager.close()
+    shutil.rmtree(root)
+
+
+def test_staging_quota():
+    root = tempfile.mkdtemp(prefix="test_staging")
+    manager = StagingManager(root, max_bytes=1024)
+
+    stage = manager.create()
+    _write(os.path.join(stage, "data"), 2048)
+
+    # Measured usage is reused within TTL
+    assert manager.usage() == 0
+    assert manager.usage(refresh=True) >= 2048
+
+    try:
+        manager.create()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("Quota not enforced.")
+
+    manager.release(stage)
+    assert os.path.isdir(manager.create())
+
+    manager.close()
+
+    # Not measured if no cap
+    manager = StagingManager(root)
+    with mock.patch("reveries.staging.dir_size") as dir_size:
+        manager.create()
+        manager.create()
+    assert not dir_size.called
+
+    manager.close()
+    shutil.rmtree(root)
@@ -0,0 +1,171 @@
+import os
+import tempfile
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+import reveries.utils
+import reveries.transfer
+
+
+def test_transfer_engine_run():
+    engine = reveries.transfer.TransferEngine(workers=4)
+
+    received = list()
+    for i in range(20):
+        engine.add(received.append, (i,), size=10)
+
+    done, size, _ = engine.run()
+    assert done == 20
+    assert size == 200
+    assert sorted(received) == list(range(20))
+
+    # Callback with return value
+    results = list()
+    engine.add(len, ("foo",), callback=results.append)
+    engine.run()
+    assert results == [3]
+
+    # Queue is emptied after run
+    assert engine.run() == (0, 0, 0.0)
+
+
+def test_transfer_engine_error():
+    engine = reveries.transfer.TransferEngine(workers=1)
+
+    received = list()
+
+    def fail():
+        raise IOError("Disk full")
+
+    engine.add(received.append, (0,))
+    engine.add(fail)
+    engine.add(received.append, (1,))
+
+    try:
+        engine.run()
+    except IOError as e:
+        assert str(e) == "Disk full"
+    else:
+        assert False, "Error not raised."
+
+    # Tasks after failure are dropped
+    assert received == [0]
+
+
+def test_is_same_device():
+    wdir = tempfile.mkdtemp(prefix="test_transfer")
+    src = os.path.join(wdir, "foo")
+    os.makedirs(src)
+
+    # Destination not exists yet
+    assert reveries.transfer.is_same_device(src, os.path.join(wdir, "a/b"))
+
+
+def test_reflink_file():
+    wdir = tempfile.mkdtemp(prefix="test_transfer")
+    src = os.path.join(wdir, "foo.bar")
+    dst = os.path.join(wdir, "foo.bar.link")
+    with open(src, "w") as foo:
+        foo.write("foo")
+
+    try:
+        reveries.transfer.reflink_file(src, dst)
+    except OSError:
+        # Not supported, no partial file left
+        assert not os.path.exists(dst)
+    else:
+        with open(dst) as f:
+            assert f.read() == "foo"
+
+
+def test_copy_file_hashed():
+    wdir = tempfile.mkdtemp(prefix="test_transfer")
+    src = os.path.join(wdir, "foo.bar")
+    dst = os.path.join(wdir, "foo.bar.copy")
+    with open(src, "w") as foo:
+        foo.write("foo" * 4096)
+
+    with mock.patch.dict("os.environ", {"REVERIES_NO_HASH_CACHE": "1"}):
+        c4id, size = reveries.transfer.copy_file_hashed(src, dst,
+                                                        buffer_size=1000)
+        assert c4id == reveries.utils.hash_file(src)
+        assert size == os.path.getsize(src)
+
+        with open(dst) as f:
+            assert f.read() == "foo" * 4096
+
+        checksums = [{"file": "foo.bar.copy", "c4id": c4id, "size": size}]
+        assert reveries.transfer.verify_checksums(wdir, checksums) == []
+
+        with open(dst, "w") as foo:
+            foo.write("bar" * 4096)
+        assert reveries.transfer.verify_checksums(wdir, checksums) == [
+            "foo.bar.copy"]
+
+        os.remove(dst)
+        assert reveries.transfer.verify_checksums(wdir, checksums) == [
+            "foo.bar.copy"]
+
+
+def test_transfer_journal():
+    version_dir = tempfile.mkdtemp(prefix="test_transfer")
+    file_path = os.path.join(version_dir, "foo", "foo.bar")
+    os.makedirs(os.path.dirname(file_path))
+    with open(file_path, "w") as foo:
+        foo.write("foo")
+
+    journal = reveries.transfer.TransferJournal(version_dir)
+    journal.record_file(file_path, "c4Foo", 3)
+    journal.record_package("foo", reveries.transfer.COPY)
+    # Not in version dir, not recorded
+    journal.record_file(os.path.dirname(version_dir), "c4Bar", 3)
+
+    # Incomplete line written by dead process
+    with open(journal.path, "a") as f:
+        f.write('{"file": "foo/')
+
+    journal = reveries.transfer.TransferJournal(version_dir)
+    assert journal.get_file(file_path) == ("c4Foo", 3)
+    assert journal.has_package("foo")
+    assert journal.packages() == ["foo"]
+
+    # Continue recording after incomplete line
+    journal.record_package("bar", reveries.transfer.COPY)
+    journal = reveries.transfer.TransferJournal(version_dir)
+    assert sorted(journal.packages()) == ["bar", "foo"]
+
+    # Rename recorded but failed
+    journal.record_package("baz", reveries.transfer.RENAME)
+    journal.discard_package("baz")
+    assert not journal.has_package("baz")
+    journal = reveries.transfer.TransferJournal(version_dir)
+    assert sorted(journal.packages()) == ["bar", "foo"]
+
+    # Size changed, need to transfer again
+    with open(file_path, "w") as foo:
+        foo.write("foo bar")
+    assert journal.get_file(file_path) is None
+
+    journal.remove()
+    assert not os.path.exists(journal.path)
+
+
+def test_transfer_journal_batch():
+    version_dir = tempfile.mkdtemp(prefix="test_transfer")
+    file_path = os.path.join(version_dir, "foo.bar")
+    with open(file_path, "w") as foo:
+        foo.write("foo")
+
+    journal = reveries.transfer.TransferJournal(version_dir)
+    journal.record_file(file_path, "c4Foo", 3)
+    # Buffered, not yet written
+    assert not os.path.exists(journal.path)
+
+    journal.flush()
+    journal = reveries.transfer.TransferJournal(version_dir)
+    assert journal.get_file(file_path) == ("c4Foo", 3)
+
+    journal.remove()
@@ -1,6 +1,7 @@
 
 import pytest
 import os
+import sqlite3
 import tempfile
 
 try:
@@ -8,6 +9,8 @@ try:
 except ImportError:
     import unittest.mock as mock
 
+import pyblish.api
+
 import reveries
 import reveries.utils
 
@@ -28,8 +31,8 @@ def test_temp_dir():
 
 def test_clear_stage():
     prefix = "test_clear"
-    tmp_1 = tempfile.mkdtemp(prefix=prefix)
-    tmp_2 = tempfile.mkdtemp(prefix=prefix)
+    tmp_1 = reveries.utils.temp_dir(prefix=prefix)
+    tmp_2 = reveries.utils.temp_dir(prefix=prefix)
 
     reveries.utils.clear_stage(prefix=prefix)
 
@@ -131,6 +134,167 @@ ZrAkZzsWcbWtDg5oQstpDuni4Hirj75GEmTc1sFT"""
     assert hash_val == empty_file_hash_val.replace("\n", "")
 
 
+def test_hash_cache():
+    prefix = "test_hash_cache"
+    wdir = tempfile.mkdtemp(prefix=prefix)
+    file_path = os.path.join(wdir, "foo.bar")
+    with open(file_path, "w") as foo:
+        foo.write("foo")
+
+    cache = reveries.utils.HashCache(os.path.join(wdir, "cache.db"),
+                                     max_entries=2)
+    environ = {"REVERIES_HASH_CACHE": cache.path}
+
+    with mock.patch.dict("os.environ", environ):
+        hash_val = reveries.utils.hash_file(file_path)
+        # Cached
+        assert cache.get(file_path) == hash_val
+        assert reveries.utils.hash_file(file_path) == hash_val
+        # Cache not used
+        assert reveries.utils.hash_file(file_path, use_cache=False) == hash_val
+
+    # File changed, cache missed
+    with open(file_path, "w") as foo:
+        foo.write("foo bar")
+    assert cache.get(file_path) is None
+
+    # Least recently used entry evicted
+    stat = os.stat(file_path)
+    cache.set(file_path, "c4A", stat)
+    cache.set(file_path + ".1", "c4B", stat)
+    cache.set(file_path + ".2", "c4C", stat)
+    cache.evict()
+    assert cache.get(file_path, stat) is None
+    assert cache.get(file_path + ".2", stat) == "c4C"
+
+
+def test_hash_cache_touch():
+    wdir = tempfile.mkdtemp(prefix="test_hash_cache")
+    file_path = os.path.join(wdir, "foo.bar")
+    with open(file_path, "w") as foo:
+        foo.write("foo")
+
+    cache = reveries.utils.HashCache(os.path.join(wdir, "cache.db"))
+    cache.TOUCH_INTERVAL = 3
+    stat = os.stat(file_path)
+    cache.set(file_path, "c4A", stat)
+
+    def get_atime():
+        conn = sqlite3.connect(cache.path)
+        atime = conn.execute("SELECT atime FROM hashes").fetchone()[0]
+        conn.close()
+        return atime
+
+    atime = get_atime()
+    # Not committed on every hit
+    cache.get(file_path, stat)
+    cache.get(file_path, stat)
+    assert get_atime() == atime
+    cache.get(file_path, stat)
+    assert get_atime() > atime
+
+    cache.clear()
+    assert cache.get(file_path, stat) is None
+
+
+def test_hash_files():
+    wdir = tempfile.mkdtemp(prefix="test_hash_files")
+    file_paths = list()
+    for i in range(20):
+        file_path = os.path.join(wdir, "%d.bar" % i)
+        with open(file_path, "w") as foo:
+            foo.write(str(i) * 4096 * i)
+        file_paths.append(file_path)
+
+    file_ids, hash_val = reveries.utils.hash_files(file_paths,
+                                                   workers=4,
+                                                   use_cache=False)
+
+    for path in file_paths:
+        assert file_ids[path] == reveries.utils.hash_file(path,
+                                                          use_cache=False)
+
+    # Combined hash value not depend on the order
+    hasher = reveries.utils.AssetHasher(use_cache=False)
+    for path in reversed(file_paths):
+        hasher.add_file(path)
+    assert hasher.digest() == hash_val
+
+
+def test_asset_hasher_read_mode():
+    wdir = tempfile.mkdtemp(prefix="test_hash_read")
+    Hasher = reveries.utils.AssetHasher
+
+    for size in (0, 100, Hasher.MMAP_MIN_SIZE * 3 + 1):
+        file_path = os.path.join(wdir, "%d.bar" % size)
+        with open(file_path, "wb") as foo:
+            foo.write(os.urandom(size))
+
+        hash_vals = set()
+        for mode in (Hasher.READ_CHUNK,
+                     Hasher.READ_ADAPTIVE,
+                     Hasher.READ_MMAP):
+            hasher = Hasher(use_cache=False, read_mode=mode)
+            hasher.add_file(file_path)
+            hash_vals.add(hasher.digest())
+
+        assert len(hash_vals) == 1
+
+    with pytest.raises(ValueError):
+        Hasher(read_mode="foo")
+
+
+def test_quick_hash_file():
+    wdir = tempfile.mkdtemp(prefix="test_quick_hash")
+    file_path = os.path.join(wdir, "foo.bar")
+    data = bytearray(os.urandom(1024 * 10))
+    with open(file_path, "wb") as foo:
+        foo.write(data)
+
+    hash_val = reveries.utils.quick_hash_file(file_path, block_size=1024)
+    assert hash_val.startswith("c4")
+
+    # Change in sampled block
+    data[-1] = (data[-1] + 1) % 256
+    with open(file_path, "wb") as foo:
+        foo.write(data)
+    os.utime(file_path, (0, 0))
+    changed = reveries.utils.quick_hash_file(file_path, block_size=1024)
+    assert changed != hash_val
+
+    # Modified time changed
+    os.utime(file_path, (100, 100))
+    touched = reveries.utils.quick_hash_file(file_path, block_size=1024)
+    assert touched != changed
+
+
+def test_background_hasher():
+    wdir = tempfile.mkdtemp(prefix="test_background_hash")
+    file_path = os.path.join(wdir, "foo.bar")
+    with open(file_path, "w") as foo:
+        foo.write("foo")
+
+    received = list()
+
+    job = reveries.utils.BackgroundHasher(file_path, use_cache=False)
+    job.add_done_callback(received.append)
+    job.start()
+
+    hash_val = job.wait()
+    assert hash_val == reveries.utils.hash_file(file_path, use_cache=False)
+    assert received == [hash_val]
+
+    # Called immediately if done
+    job.add_done_callback(received.append)
+    assert received == [hash_val, hash_val]
+
+    # Error re-raised
+    job = reveries.utils.BackgroundHasher(os.path.join(wdir, "not.exists"))
+    job.start()
+    with pytest.raises(OSError):
+        job.wait()
+
+
 @mock.patch('pyblish.api.discover')
 def test_plugins_by_range(discover):
 
@@ -196,6 +360,61 @@ def test_asset_hasher():
     hasher.clear()
 
 
+def test_asset_hasher_dir():
+
+    def make_tree(files):
+        root = tempfile.mkdtemp(prefix="test_hash_dir")
+        for path, data in files:
+            path = os.path.join(root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write(data)
+        return root
+
+    def digest(dir_path, **kwargs):
+        hasher = reveries.utils.AssetHasher(use_cache=False)
+        hasher.add_dir(dir_path, **kwargs)
+        return hasher.digest()
+
+    files = [("a", "a"), ("sub/b", "b"), ("sub/deep/c", "c")]
+    tree_1 = make_tree(files)
+    tree_2 = make_tree(reversed(files))
+
+    # Not depend on creation or listing order
+    assert digest(tree_1) == digest(tree_2)
+
+    # Nested change detected
+    tree_3 = make_tree(files[:-1] + [("sub/deep/c", "C")])
+    assert digest(tree_1) != digest(tree_3)
+    # But not when non-recursive
+    assert (digest(tree_1, recursive=False) ==
+            digest(tree_3, recursive=False))
+
+    # Rename detected
+    tree_4 = make_tree(files[:-1] + [("sub/deep/d", "c")])
+    assert digest(tree_1) != digest(tree_4)
+
+    # Sub-dir digest reused from cache
+    wdir = tempfile.mkdtemp(prefix="test_hash_dir")
+    cache = reveries.utils.HashCache(os.path.join(wdir, "cache.db"))
+    environ = {"REVERIES_HASH_CACHE": cache.path}
+
+    expected = digest(tree_1)
+
+    with mock.patch.dict("os.environ", environ):
+        hasher = reveries.utils.AssetHasher()
+        hasher.add_dir(tree_1)
+        assert hasher.digest() == expected
+
+        with mock.patch.object(reveries.utils.AssetHasher,
+                               "_hash_file") as _hash_file:
+            hasher.clear()
+            hasher.add_dir(tree_1)
+            assert hasher.digest() == expected
+            assert not _hash_file.called
+
+
 @mock.patch.dict('avalon.Session', {"AVALON_APP": "Maya"})
 @mock.patch('avalon.api.registered_root')
 def test_get_representation_path_(registered_root):
@@ -217,3 +436,44 @@ def test_get_representation_path_(registered_root):
 
     assert path == ("ROOT/Blockbuster/Maya/Asset/Hero/publish/"
                     "modelDefault/v005/MayaBinary")
+
+
+def test_plugin_discovery_cache():
+    plugin_dir = tempfile.mkdtemp(prefix="test_plugins")
+    plugin_file = os.path.join(plugin_dir, "validate_foo.py")
+    source = """
+import pyblish.api
+
+
+class ValidateFoo(pyblish.api.InstancePlugin):
+    order = pyblish.api.ValidatorOrder
+    families = ["foo"]
+
+
+class ExtractFoo(pyblish.api.InstancePlugin):
+    order = pyblish.api.ExtractorOrder
+    families = ["*"]
+"""
+    with open(plugin_file, "w") as f:
+        f.write(source)
+
+    plugins_by_range = reveries.utils.plugins_by_range
+    discover = pyblish.api.discover
+    with mock.patch("pyblish.api.discover", wraps=discover) as discovered:
+        validators = plugins_by_range(1, 0.5, paths=[plugin_dir])
+        extractors = plugins_by_range(2, 0.5, paths=[plugin_dir])
+        assert [p.__name__ for p in validators] == ["ValidateFoo"]
+        assert [p.__name__ for p in extractors] == ["ExtractFoo"]
+
+        discovery = reveries.utils.discover_plugins([plugin_dir])
+        assert [p.__name__ for p in discovery.by_families(["bar"])] == [
+            "ExtractFoo"]
+        # Discovered once
+        assert discovered.call_count == 1
+
+        # Plugin file changed
+        with open(plugin_file, "w") as f:
+            f.write(source.replace("ValidateFoo", "ValidateFooBar"))
+        validators = plugins_by_range(1, 0.5, paths=[plugin_dir])
+        assert [p.__name__ for p in validators] == ["ValidateFooBar"]
+        assert discovered.call_count == 2